@@ -1,10 +1,19 @@
-from datetime import datetime, time
+from collections import OrderedDict, defaultdict
+from datetime import datetime
 
 __author__ = 'sdavidson'
 
 import re
+import threading
+import time
+from multiprocessing.pool import ThreadPool
 from pyowfs import Connection
 from enum import Enum
+from owhistory import OneWireNeoHistory
+from owprotocol import OwserverConnection
+from owrecorder import OneWireNeoRecorder
+from owsnapshot import OneWireNeoSnapshotStore
+from owstats import OneWireNeoStats, clock
 
 '''
     Available 1-Wire Features
@@ -23,6 +32,21 @@ PROPERTY_KIND = Enum('Numeric','String','Timestamp','Boolean','Binary')
     States for sensor objects
 '''
 SENSOR_STATUS = Enum('New', 'Available', 'Missing')
+'''
+    Read policies for sensors and properties: Uncached reads go through the owfs /uncached/ tree (a real bus
+    transaction), Cached reads take whatever owserver has cached, and MaxAge reads from the cache only while the
+    last bus read of the property is younger than the configured max age (otherwise it reads uncached).
+'''
+READ_POLICY = Enum('Uncached', 'Cached', 'MaxAge')
+'''
+    Kinds of events delivered to subscriptions
+'''
+EVENT_KIND = Enum('Changed', 'SensorMissing', 'SensorAppeared')
+'''
+    Health of one owserver in an aggregate: Slow servers missed the refresh deadline and are still working on their
+    last cycle, Offline servers failed to connect or to refresh
+'''
+SERVER_STATUS = Enum('New', 'Online', 'Slow', 'Offline')
 '''
     Sensor properties which are always included if present; may also include entries for uniquely identifying specific
     third-party sensors
@@ -49,6 +73,52 @@ FEATURE_DEFAULT_PROPERTIES = {
 }
 
 
+'''
+    Marker for a property value which has not been fetched yet (None is what a failed read returns)
+'''
+_NOT_READ = object()
+
+
+'''
+    Property states which count as a change of value
+'''
+_CHANGE_STATUSES = frozenset([PROPERTY_STATUS.Changed, PROPERTY_STATUS.Increased, PROPERTY_STATUS.Decreased])
+
+'''
+    Default poll interval in seconds for each feature.  Properties of other features use DEFAULT_POLL_INTERVAL;
+    identity properties (IDENT_PROPERTIES) never change while a device is attached and use IDENT_POLL_INTERVAL.
+'''
+FEATURE_POLL_INTERVALS = {
+    FEATURES.Temperature: 10,
+    FEATURES.Counter: 60,
+    FEATURES.Memory: 3600,
+    FEATURES.Clock: 3600
+}
+DEFAULT_POLL_INTERVAL = 10
+IDENT_POLL_INTERVAL = 3600
+
+'''
+    Factor by which adaptive polling stretches the interval of a property after each read that found it Stable
+'''
+ADAPTIVE_BACKOFF = 2.0
+
+'''
+    Seconds a 12 bit DS18x20 temperature conversion takes
+'''
+CONVERSION_TIME = 0.75
+
+'''
+    Seconds queued writes wait for more writes to coalesce with before they go to the bus
+'''
+WRITE_DELAY = 0.01
+
+'''
+    Poll interval in seconds of switch and sense properties in alarm-driven mode, where they are normally read only
+    when their device shows up in the alarm directory
+'''
+ALARM_SAFETY_INTERVAL = 300
+
+
 class OneWireNeoException(Exception):
     """
     OneWire exception
@@ -77,55 +147,957 @@ class OneWireFamily:
     description = property(lambda self: self._description)
     features = property(lambda self: self._desiredFeatures)
 
+'''
+    Runs refresh work for a set of sensors grouped by the physical bus they sit on.  Each bus is split into at most
+    perBusConcurrency lanes; sensors within a lane are handled one after another, while lanes are spread across a
+    bounded pool of worker threads.  run() returns once every lane has finished.
+
+    Every bus has one lock per lane, held by the lane while it works on a sensor.  lockBus() takes all of them, for
+    work such as writes which must not interleave with refresh reads on the bus.
+'''
+class OneWireNeoRefreshScheduler:
+    def __init__(self, maxWorkers=4, perBusConcurrency=1):
+        if maxWorkers < 1:
+            raise OneWireNeoException('maxWorkers must be at least 1')
+        if perBusConcurrency < 1:
+            raise OneWireNeoException('perBusConcurrency must be at least 1')
+        self._maxWorkers = maxWorkers
+        self._perBusConcurrency = perBusConcurrency
+        self._pool = None
+        self._busLocks = dict()
+        self._busLocksLock = threading.Lock()
+
+    maxWorkers = property(lambda self: self._maxWorkers)
+    perBusConcurrency = property(lambda self: self._perBusConcurrency)
+
+    def run(self, sensors, topology, work):
+        lanes = self.buildLanes(sensors, topology)
+        locks = list()
+        laneCounts = dict()
+        for lane in lanes:
+            bus = topology.get(lane[0].path)
+            laneCounts[bus] = laneCounts.get(bus, -1) + 1
+            locks.append(self._locksFor(bus)[laneCounts[bus]])
+        if len(lanes) < 2 or self._maxWorkers < 2:
+            for lane, lock in zip(lanes, locks):
+                self._runLane(lane, work, lock)
+            return
+        if self._pool is None:
+            self._pool = ThreadPool(self._maxWorkers)
+        pending = [self._pool.apply_async(self._runLane, (lane, work, lock)) for lane, lock in zip(lanes, locks)]
+        # wait for every lane before reporting the first failure, so no bus is left mid-read
+        errors = list()
+        for result in pending:
+            try:
+                result.get()
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+
+    def buildLanes(self, sensors, topology):
+        buses = dict()
+        busOrder = list()
+        for sensor in sensors:
+            bus = topology.get(sensor.path)
+            if not buses.has_key(bus):
+                buses[bus] = list()
+                busOrder.append(bus)
+            buses[bus].append(sensor)
+        lanes = list()
+        for bus in busOrder:
+            busSensors = buses[bus]
+            laneCount = min(self._perBusConcurrency, len(busSensors))
+            for i in range(laneCount):
+                lanes.append(busSensors[i::laneCount])
+        return lanes
+
+    '''
+        Wait for the lanes working on bus (None for the root) and keep them out until unlockBus()
+    '''
+    def lockBus(self, bus):
+        for lock in self._locksFor(bus):
+            lock.acquire()
+
+    def unlockBus(self, bus):
+        for lock in reversed(self._locksFor(bus)):
+            lock.release()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def _locksFor(self, bus):
+        with self._busLocksLock:
+            locks = self._busLocks.get(bus)
+            if locks is None:
+                locks = self._busLocks[bus] = [threading.RLock() for i in range(self._perBusConcurrency)]
+            return locks
+
+    def _runLane(self, lane, work, lock):
+        for sensor in lane:
+            with lock:
+                work(sensor)
+
+'''
+    Assigns each property a poll interval.  Lookups go from the most to the least specific setting: property
+    override, sensor override, identity properties, feature interval, then the default interval.
+
+    Features given an adaptive rule (or every feature, with the rule for None) are polled adaptively instead: each
+    read which finds a property Stable multiplies its interval by backoff, up to maximum, and a read which finds it
+    changed drops it back to minimum at once.  Properties with a property or sensor override and identity
+    properties are never adaptive.
+'''
+class OneWireNeoPollSchedule:
+    def __init__(self, featureIntervals=None, defaultInterval=DEFAULT_POLL_INTERVAL, identInterval=IDENT_POLL_INTERVAL):
+        self._featureIntervals = dict(FEATURE_POLL_INTERVALS)
+        if featureIntervals is not None:
+            self._featureIntervals.update(featureIntervals)
+        self._defaultInterval = defaultInterval
+        self._identInterval = identInterval
+        self._sensorIntervals = dict()
+        self._propertyIntervals = dict()
+        self._adaptiveRules = dict()
+
+    defaultInterval = property(lambda self: self._defaultInterval)
+
+    def setFeatureInterval(self, feature, seconds):
+        self._featureIntervals[feature] = seconds
+
+    def setSensorInterval(self, sensorId, seconds):
+        self._sensorIntervals[sensorId] = seconds
+
+    def setPropertyInterval(self, sensorId, propName, seconds):
+        self._propertyIntervals[(sensorId, propName)] = seconds
+
+    '''
+        Poll properties of feature (None for all features without a rule of their own) adaptively, between minimum
+        and maximum seconds
+    '''
+    def setAdaptive(self, feature, minimum, maximum, backoff=ADAPTIVE_BACKOFF):
+        if minimum <= 0 or maximum < minimum or backoff < 1:
+            raise OneWireNeoException('Adaptive polling needs 0 < minimum <= maximum and backoff >= 1')
+        self._adaptiveRules[feature] = (minimum, maximum, backoff)
+
+    def clearAdaptive(self):
+        self._adaptiveRules.clear()
+
+    '''
+        (minimum, maximum, backoff) for an adaptively polled property, None for a fixed interval
+    '''
+    def adaptiveRuleFor(self, sensorId, propName, feature):
+        if not self._adaptiveRules or propName in IDENT_PROPERTIES or sensorId in self._sensorIntervals or \
+                (sensorId, propName) in self._propertyIntervals:
+            return None
+        rule = self._adaptiveRules.get(feature)
+        return rule if rule is not None else self._adaptiveRules.get(None)
+
+    def clearOverrides(self, sensorId=None):
+        if sensorId is None:
+            self._sensorIntervals.clear()
+            self._propertyIntervals.clear()
+        else:
+            self._sensorIntervals.pop(sensorId, None)
+            for key in [key for key in self._propertyIntervals if key[0] == sensorId]:
+                del self._propertyIntervals[key]
+
+    '''
+        Interval for a property.  For adaptive properties previous is the current interval and status the outcome
+        of the read just made; without a status the current interval is only kept within the rule's bounds.
+    '''
+    def intervalFor(self, sensorId, propName, feature, previous=None, status=None):
+        interval = self._propertyIntervals.get((sensorId, propName))
+        if interval is None:
+            interval = self._sensorIntervals.get(sensorId)
+        if interval is None:
+            if propName in IDENT_PROPERTIES:
+                interval = self._identInterval
+            else:
+                interval = self._featureIntervals.get(feature, self._defaultInterval)
+            rule = self.adaptiveRuleFor(sensorId, propName, feature)
+            if rule is not None:
+                minimum, maximum, backoff = rule
+                if status in _CHANGE_STATUSES:
+                    return minimum
+                interval = previous if previous else interval
+                if status is PROPERTY_STATUS.Stable:
+                    interval *= backoff
+                return min(max(interval, minimum), maximum)
+        return interval
+
+
+'''
+    A single change notification.  Property fields are None for sensor events.
+'''
+class OneWireNeoEvent(object):
+    def __init__(self, kind, sensorId, timestamp, prop=None, previous=None):
+        self._kind = kind
+        self._sensorId = sensorId
+        self._timestamp = timestamp
+        self._propName = None if prop is None else prop.name
+        self._feature = None if prop is None else prop.feature
+        self._value = None if prop is None else prop.value
+        self._status = None if prop is None else prop.status
+        self._previous = previous
+
+    kind = property(lambda self: self._kind)
+    sensorId = property(lambda self: self._sensorId)
+    timestamp = property(lambda self: self._timestamp)
+    propName = property(lambda self: self._propName)
+    feature = property(lambda self: self._feature)
+    value = property(lambda self: self._value)
+    status = property(lambda self: self._status)
+    previous = property(lambda self: self._previous)
+
+    def __repr__(self):
+        if self._propName is None:
+            return '<OneWireNeoEvent %s %s>' % (self._kind, self._sensorId)
+        return '<OneWireNeoEvent %s %s/%s %s -> %s>' % (self._kind, self._sensorId, self._propName, self._previous,
+                                                        self._value)
+
+'''
+    Delivers events matching a sensor id, feature and/or property name pattern (a regex matched from the start of
+    the property name, case insensitive) to a callback or to anything with a put() method such as a Queue.
+    Numeric changes smaller than deadband (measured from the last delivered value) are dropped, and minInterval
+    limits deliveries per property.  Sensor events are filtered by sensor id and by the family's features only.
+'''
+class OneWireNeoSubscription(object):
+    def __init__(self, target, sensorId=None, feature=None, propertyPattern=None, deadband=None, minInterval=None,
+                 kinds=None):
+        if hasattr(target, 'put'):
+            self._deliver = target.put
+        elif callable(target):
+            self._deliver = target
+        else:
+            raise OneWireNeoException('Subscription target must be callable or have a put() method')
+        self._target = target
+        self._sensorId = sensorId
+        self._feature = feature
+        self._pattern = None if propertyPattern is None else re.compile(propertyPattern, re.IGNORECASE)
+        self._deadband = deadband
+        self._minInterval = minInterval
+        self._kinds = frozenset(EVENT_KIND) if kinds is None else frozenset(kinds)
+        self._delivered = dict()
+
+    target = property(lambda self: self._target)
+    sensorId = property(lambda self: self._sensorId)
+    feature = property(lambda self: self._feature)
+    deadband = property(lambda self: self._deadband)
+    minInterval = property(lambda self: self._minInterval)
+
+    def matches(self, event):
+        if event.kind not in self._kinds:
+            return False
+        if self._sensorId is not None and event.sensorId != self._sensorId:
+            return False
+        if event.propName is None:
+            return self._feature is None or self._feature in getFamilyInfo(event.sensorId.partition('.')[0]).features
+        if self._feature is not None and event.feature != self._feature:
+            return False
+        return self._pattern is None or self._pattern.match(event.propName) is not None
+
+    '''
+        Deliver event if it passes the filters, deadband and rate limit; returns True if it was delivered
+    '''
+    def offer(self, event):
+        if not self.matches(event):
+            return False
+        if event.propName is not None:
+            key = (event.sensorId, event.propName)
+            last = self._delivered.get(key)
+            if last is None:
+                # the deadband is measured from the value seen when the subscription first saw this property
+                last = self._delivered[key] = (event.previous, None)
+            lastValue, lastTime = last
+            if self._deadband is not None and isinstance(event.value, float) and isinstance(lastValue, float) and \
+                    abs(event.value - lastValue) < self._deadband:
+                return False
+            if self._minInterval is not None and lastTime is not None and \
+                    event.timestamp - lastTime < self._minInterval:
+                return False
+            self._delivered[key] = (event.value, event.timestamp)
+        self._deliver(event)
+        return True
+
+'''
+    Outcome of a queued write: done() once the bus has answered, result() waits for it and returns True or raises
+    OneWireNeoException when the write was refused or failed.
+'''
+class OneWireNeoWriteFuture(object):
+    def __init__(self, path):
+        self._path = path
+        self._event = threading.Event()
+        self._error = None
+
+    path = property(lambda self: self._path)
+
+    def done(self):
+        return self._event.is_set()
+
+    '''
+        The error the write failed with, or None once it succeeded; waits up to timeout seconds for the outcome
+    '''
+    def exception(self, timeout=None):
+        if not self._event.wait(timeout):
+            raise OneWireNeoException('Write to %s still pending' % self._path)
+        return self._error
+
+    def result(self, timeout=None):
+        error = self.exception(timeout)
+        if error is not None:
+            raise error
+        return True
+
+    def _resolve(self, error=None):
+        self._error = error
+        self._event.set()
+
+'''
+    Pending writes of one sensor.  A later write to a property replaces the queued value, and every caller's future
+    is resolved by the one bus write that goes out.
+'''
+class OneWireNeoWriteQueue(object):
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def put(self, propName, value):
+        future = OneWireNeoWriteFuture(self._path + propName)
+        with self._lock:
+            entry = self._pending.get(propName)
+            if entry is None:
+                self._pending[propName] = (value, [future])
+            else:
+                self._pending[propName] = (value, entry[1] + [future])
+        return future
+
+    '''
+        Remove and return everything queued as a list of (property name, value, futures)
+    '''
+    def take(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = OrderedDict()
+        return [(propName, value, futures) for propName, (value, futures) in pending.items()]
+
+
 class OneWireNeo:
 
-    # TODO: this is hard to test - pass in (optional) Connection to support mock
-    def __init__(self, address='localhost:4304', desiredFeatures=None):
+    def __init__(self, address='localhost:4304', desiredFeatures=None, connection=None, maxWorkers=4,
+                 perBusConcurrency=1, pollSchedule=None, readPolicy=READ_POLICY.Cached, maxAge=None, stats=None,
+                 simultaneous=False, conversionTime=CONVERSION_TIME, temperatureResolution=None, lazy=False,
+                 alarmPolling=False, alarmSafetyInterval=ALARM_SAFETY_INTERVAL, writeDelay=WRITE_DELAY,
+                 discoveryInterval=None):
         # TODO: trap and report errors on connect.
-        print("Connecting to " + address)
-        self._root = Connection(address)
-        print("Connected")
+        if connection is None:
+            print("Connecting to " + address)
+            connection = Connection(address)
+            print("Connected")
+        self._root = connection
         self._desiredFeatures = desiredFeatures
         self._address = address
         self._connected = False
         self._firstCycle = True
         self._sensors = dict()
-        self._updateSensors()
+        self._sensorLock = threading.Lock()
+        self._schemaCache = OneWireNeoSchemaCache()
+        self._pollSchedule = pollSchedule if pollSchedule is not None else OneWireNeoPollSchedule()
+        checkReadPolicy(readPolicy, maxAge)
+        self._readPolicy = readPolicy
+        self._maxAge = maxAge
+        self._scheduler = OneWireNeoRefreshScheduler(maxWorkers, perBusConcurrency)
+        self._refreshLock = threading.Lock()
+        self._pollThread = None
+        self._pollStop = threading.Event()
+        self._subscriptions = tuple()
+        self._pendingEvents = list()
+        self._historyRules = tuple()
+        self._stats = stats if stats is not None else OneWireNeoStats()
+        self._simultaneous = simultaneous
+        self._conversionTime = conversionTime
+        checkTemperatureResolution(temperatureResolution)
+        self._temperatureResolution = temperatureResolution
+        self._familyResolutions = dict()
+        self._sensorResolutions = dict()
+        self._lazy = lazy
+        self._snapshots = OneWireNeoSnapshotStore()
+        self._recorder = None
+        self._readings = None
+        self._alarmPolling = alarmPolling
+        self._alarmSafetyInterval = alarmSafetyInterval
+        self._writeDelay = writeDelay
+        self._writeQueues = dict()
+        self._writeThread = None
+        self._writeWake = threading.Event()
+        self._writeStop = threading.Event()
+        self._foundSensors = list()
+        self._topology = dict()
+        self._discoveryInterval = None
+        self._discoveryThread = None
+        self._discoveryStop = threading.Event()
+        self._updateSensors(force=True)
+        if discoveryInterval is not None:
+            self.startDiscovery(discoveryInterval)
 
     desiredFeatures = property(lambda self: self._desiredFeatures)
     address = property(lambda self: self._address)
     sensors = property(lambda self: tuple(self._sensors.values()))
+    maxWorkers = property(lambda self: self._scheduler.maxWorkers)
+    perBusConcurrency = property(lambda self: self._scheduler.perBusConcurrency)
+    schemaCache = property(lambda self: self._schemaCache)
+    pollSchedule = property(lambda self: self._pollSchedule)
+    readPolicy = property(lambda self: self._readPolicy)
+    maxAge = property(lambda self: self._maxAge)
+    cacheHits = property(lambda self: sum([sensor.cacheHits for sensor in self.sensors]))
+    cacheMisses = property(lambda self: sum([sensor.cacheMisses for sensor in self.sensors]))
+    stats = property(lambda self: self._stats)
+    simultaneous = property(lambda self: self._simultaneous)
+    conversionTime = property(lambda self: self._conversionTime)
+    temperatureResolution = property(lambda self: self._temperatureResolution)
+    lazy = property(lambda self: self._lazy)
+    recorder = property(lambda self: self._recorder)
+    readings = property(lambda self: self._readings)
+    alarmPolling = property(lambda self: self._alarmPolling)
+    alarmSafetyInterval = property(lambda self: self._alarmSafetyInterval)
+    writeDelay = property(lambda self: self._writeDelay)
+    discoveryInterval = property(lambda self: self._discoveryInterval)
 
-    def refresh(self):
-        self._updateSensors()
+    '''
+        Read the properties which are due according to the poll schedule; force reads everything.
+    '''
+    def refresh(self, force=False):
+        self._updateSensors(force)
+
+    '''
+        Override the poll interval of a feature, a sensor or a single property of a sensor.  Already known
+        properties are rescheduled from their last read.
+    '''
+    def setPollInterval(self, seconds, feature=None, sensorId=None, propName=None):
+        if propName is not None:
+            if sensorId is None:
+                raise OneWireNeoException('A property poll interval needs a sensor id')
+            self._pollSchedule.setPropertyInterval(sensorId, propName, seconds)
+        elif sensorId is not None:
+            self._pollSchedule.setSensorInterval(sensorId, seconds)
+        elif feature is not None:
+            self._pollSchedule.setFeatureInterval(feature, seconds)
+        else:
+            raise OneWireNeoException('Poll interval needs a feature, sensor id or property')
+        for sensor in self.sensors:
+            sensor._reschedule()
+
+    '''
+        Poll properties of a feature (all features when None) adaptively: properties which keep reading Stable
+        back off towards maximum seconds, and drop to minimum seconds as soon as they change.  A property's current
+        interval is its pollInterval (pollRate in reads per second).
+    '''
+    def setAdaptivePolling(self, minimum, maximum, feature=None, backoff=ADAPTIVE_BACKOFF):
+        self._pollSchedule.setAdaptive(feature, minimum, maximum, backoff)
+        for sensor in self.sensors:
+            sensor._reschedule()
+
+    def clearAdaptivePolling(self):
+        self._pollSchedule.clearAdaptive()
+        for sensor in self.sensors:
+            sensor._reschedule()
 
-    def _updateSensors(self):
-        #TODO: add timer & stats for min, max, last read time
+    '''
+        Call refresh() every tick seconds on a background thread until stopPolling() is called.
+    '''
+    def startPolling(self, tick=1.0):
+        if self._pollThread is not None and self._pollThread.is_alive():
+            return
+        self._pollStop.clear()
+        self._pollThread = threading.Thread(target=self._pollLoop, args=(tick,), name='OneWireNeo poller')
+        self._pollThread.daemon = True
+        self._pollThread.start()
+
+    def stopPolling(self):
+        self._pollStop.set()
+        if self._pollThread is not None:
+            self._pollThread.join()
+            self._pollThread = None
+
+    '''
+        Enumerate the bus every interval seconds on a background thread instead of on every refresh.  Refreshes then
+        only read the sensors found by the last discovery; sensors appearing, going missing and coming back are
+        picked up by the discovery thread.  stopDiscovery() goes back to discovering on every refresh.
+    '''
+    def startDiscovery(self, interval):
+        self.stopDiscovery()
+        self._discoveryInterval = interval
+        self._discoveryStop.clear()
+        self._discoveryThread = threading.Thread(target=self._discoveryLoop, args=(interval,),
+                                                 name='OneWireNeo discovery')
+        self._discoveryThread.daemon = True
+        self._discoveryThread.start()
+
+    def stopDiscovery(self):
+        self._discoveryStop.set()
+        if self._discoveryThread is not None:
+            self._discoveryThread.join()
+            self._discoveryThread = None
+        self._discoveryInterval = None
+
+    '''
+        Enumerate the bus now and bring the sensor map up to date.  New sensors are read by the next refresh.
+    '''
+    def discover(self):
+        found = self._enumerate()
+        with self._refreshLock:
+            try:
+                self._applyDiscovery(found, time.time())
+            finally:
+                self._dispatchEvents()
+
+    def _discoveryLoop(self, interval):
+        while not self._discoveryStop.wait(interval):
+            try:
+                self.discover()
+            except Exception as e:
+                print("Background discovery failed: %s" % e)
+
+    def _pollLoop(self, tick):
+        while not self._pollStop.wait(tick):
+            try:
+                self.refresh()
+            except Exception as e:
+                print("Background refresh failed: %s" % e)
+
+    '''
+        Register a callback or queue for change, sensor-missing and sensor-appeared events; see
+        OneWireNeoSubscription for the filters.  Events are delivered on the refreshing thread once a cycle ends.
+    '''
+    def subscribe(self, target, sensorId=None, feature=None, propertyPattern=None, deadband=None, minInterval=None,
+                  kinds=None):
+        subscription = OneWireNeoSubscription(target, sensorId, feature, propertyPattern, deadband, minInterval, kinds)
+        with self._sensorLock:
+            self._subscriptions = self._subscriptions + (subscription,)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._sensorLock:
+            self._subscriptions = tuple([sub for sub in self._subscriptions if sub is not subscription])
+
+    '''
+        Keep a ring-buffer history of capacity samples, with rolling statistics over each of the given sample
+        windows, for numeric properties of the given sensor and/or feature (all numeric properties by default).
+        Applies to known properties and to properties discovered later.
+    '''
+    def enableHistory(self, capacity, windows=(), sensorId=None, feature=None):
+        rule = (sensorId, feature, capacity, tuple(windows))
+        with self._sensorLock:
+            self._historyRules = self._historyRules + (rule,)
+        for sensor in self.sensors:
+            for prop in sensor._properties.values():
+                if prop.history is None and self._historyRuleMatches(rule, sensor, prop):
+                    prop._history = OneWireNeoHistory(capacity, windows)
+
+    def disableHistory(self):
+        with self._sensorLock:
+            self._historyRules = tuple()
+        for sensor in self.sensors:
+            for prop in sensor._properties.values():
+                prop._history = None
+
+    def flushSchemaCache(self, sensorId=None):
+        self._schemaCache.flush(sensorId)
+
+    '''
+        Immutable structured view of every sensor and property as of the last update; see owsnapshot for the dict,
+        JSON and columnar forms.  Kept up to date as values are read, so taking one costs only what changed.
+    '''
+    def snapshot(self):
+        return self._snapshots.snapshot()
+
+    '''
+        Choose the temperature resolution in bits (9 to 12, None for the device's own setting) for one sensor, one
+        family, or as the default for all.  A sensor setting beats a family setting, which beats the default.
+        Lower resolutions convert much faster: 94ms at 9 bits against 750ms at 12.
+    '''
+    def setTemperatureResolution(self, bits, sensorId=None, familyCode=None):
+        checkTemperatureResolution(bits)
+        if sensorId is not None:
+            self._sensorResolutions[sensorId] = bits
+        elif familyCode is not None:
+            self._familyResolutions[familyCode.upper()] = bits
+        else:
+            self._temperatureResolution = bits
+        for sensor in self.sensors:
+            sensor.setTemperatureResolution(self._resolutionFor(sensor.id))
+
+    def _resolutionFor(self, sensorId):
+        if self._sensorResolutions.has_key(sensorId):
+            return self._sensorResolutions[sensorId]
+        familyCode = sensorId[:2]
+        if self._familyResolutions.has_key(familyCode):
+            return self._familyResolutions[familyCode]
+        return self._temperatureResolution
+
+    '''
+        Switch simultaneous temperature conversion on or off.  When on, each refresh that has thermometer readings
+        due starts one conversion per bus through owfs simultaneous/temperature, waits conversionTime seconds, and
+        then reads the latched temperatures, instead of every device converting in turn.
+    '''
+    def setSimultaneous(self, simultaneous, conversionTime=None):
+        self._simultaneous = simultaneous
+        if conversionTime is not None:
+            self._conversionTime = conversionTime
+
+    '''
+        Switch alarm-driven polling on or off.  When on, each refresh searches the owfs alarm directory once and
+        reads the sense and PIO properties of the switches listed there (clearing their latches), while the
+        switches' regular polls slow down to one every safetyInterval seconds as a safety net.
+    '''
+    def setAlarmPolling(self, alarmPolling, safetyInterval=None):
+        self._alarmPolling = alarmPolling
+        if safetyInterval is not None:
+            self._alarmSafetyInterval = safetyInterval
+        for sensor in self.sensors:
+            if sensor.id[:2] in ALARM_FAMILIES:
+                sensor.setAlarmInterval(self._alarmSafetyInterval if alarmPolling else None)
+
+    '''
+        Append every numeric reading (and its going missing) to an on-disk log in directory; see owrecorder for the
+        format and OneWireNeoLogReader to query it.  Options are passed to OneWireNeoRecorder.
+    '''
+    def startRecording(self, directory, **options):
+        self.stopRecording()
+        self._recorder = OneWireNeoRecorder(directory, **options)
+        return self._recorder
+
+    def stopRecording(self):
+        recorder, self._recorder = self._recorder, None
+        if recorder is not None:
+            recorder.close()
+
+    '''
+        Keep every numeric reading, and the last capacity samples of each property, in NumPy arrays for vectorized
+        queries; see owquery.  Needs NumPy, which the rest of OneWireNeo does not.  Properties already known are
+        loaded with their current values.
+    '''
+    def startQueries(self, capacity=None):
+        from owquery import DEFAULT_CAPACITY, OneWireNeoReadings
+        readings = OneWireNeoReadings(capacity if capacity is not None else DEFAULT_CAPACITY)
+        for sensor in self.sensors:
+            for prop in sensor._properties.values():
+                if prop.kind is PROPERTY_KIND.Numeric and prop.materialized and prop._lastRead is not None:
+                    readings.update(sensor.id, prop.name, prop.feature, prop._lastRead, self._readingValue(prop))
+        self._readings = readings
+        return readings
+
+    def stopQueries(self):
+        self._readings = None
+
+    '''
+        Queue a write of value to a writable property (PIO, latches, clock) and return a OneWireNeoWriteFuture.
+        Writes are sent by a background thread after writeDelay seconds, so a burst is coalesced: repeated writes to
+        one property send only the last value, and writes covering every channel of a PIO or latch (PIO.A, PIO.B, ...)
+        go out as a single write of their .ALL aggregate.  Written properties are read back on the next refresh.
+        Writes hold their bus (see OneWireNeoRefreshScheduler.lockBus), so they never interleave with refresh reads
+        on it.  Raises OneWireNeoException once close() has been called.
+    '''
+    def write(self, sensorId, propName, value):
+        sensor = self._findSensor(sensorId)
+        if sensor is None:
+            raise OneWireNeoException('Unknown sensor %s' % sensorId)
+        prop = sensor._properties.get(propName)
+        if prop is None:
+            raise OneWireNeoException('Unknown property %s' % propName)
+        if not prop.writable:
+            raise OneWireNeoException('Property %s is not writable' % propName)
+        with self._sensorLock:
+            if self._writeStop.is_set():
+                raise OneWireNeoException('Cannot write to %s: OneWireNeo is closed' % propName)
+            queue = self._writeQueues.get(sensor.path)
+            if queue is None:
+                queue = self._writeQueues[sensor.path] = OneWireNeoWriteQueue(sensor.path)
+            if self._writeThread is None:
+                self._writeThread = threading.Thread(target=self._writeLoop, name='OneWireNeo writer')
+                self._writeThread.daemon = True
+                self._writeThread.start()
+            # queued under the lock, so _stopWriting's last flush sees it
+            future = queue.put(propName, formatWriteValue(value))
+        self._writeWake.set()
+        return future
+
+    '''
+        Send every queued write now; returns once the bus has answered them all
+    '''
+    def flushWrites(self):
+        for path, queue in self._writeQueues.items():
+            if not len(queue):
+                continue
+            sensor = self._sensors.get(path)
+            writes = queue.take()
+            propList = [prop.name for prop in sensor._properties.values()] if sensor is not None else list()
+            bus = self._topology.get(path)
+            self._scheduler.lockBus(bus)
+            try:
+                for target, value, futures in mergeChannelWrites(writes, propList):
+                    self._sendWrite(sensor, path, target, value, futures)
+            finally:
+                self._scheduler.unlockBus(bus)
+
+    def close(self):
+        self.stopPolling()
+        self.stopDiscovery()
+        self.stopRecording()
+        self._stopWriting()
+        self._scheduler.close()
+
+    def _findSensor(self, sensorId):
+        for sensor in self.sensors:
+            if sensor.id == sensorId:
+                return sensor
+        return None
+
+    def _writeLoop(self):
+        while not self._writeStop.is_set():
+            self._writeWake.wait()
+            if self._writeStop.is_set():
+                break
+            # let a burst of writes gather before sending it
+            time.sleep(self._writeDelay)
+            self._writeWake.clear()
+            self.flushWrites()
+
+    def _stopWriting(self):
+        with self._sensorLock:
+            self._writeStop.set()
+        if self._writeThread is not None:
+            self._writeWake.set()
+            self._writeThread.join()
+            self._writeThread = None
+        self.flushWrites()
+
+    def _sendWrite(self, sensor, path, target, value, futures):
+        start = clock()
+        error = None
         try:
-            print('Refreshing sensors')
-            knownSensors = set(self._sensors)
-            for foundSensor in self._root.iter_sensors():
-                self._connected = True
-                spath = foundSensor.path
-                if self._sensors.has_key(spath):
-                    print('Found existing sensor at path %s' % spath)
-                    knownSensors.remove(spath)
-                    self._sensors[spath]._status = SENSOR_STATUS.Available
-                    self._sensors[spath].update(foundSensor)
-                else:
-                    if isDesiredSensor(spath, self._desiredFeatures):
-                        sensor = OneWireNeoSensor(foundSensor, self._desiredFeatures)
-                        self._sensors[spath] = sensor
-            # anything left in knownSensors?
-            if len(knownSensors) > 0:
-                print("Some sensors seem to have gone missing!") # TODO: callback here(?)
-                for sensor in knownSensors:
-                    sensor._status = SENSOR_STATUS.Missing
+            if not self._root.capi.put(path + target, value):
+                error = OneWireNeoException('Write to %s%s refused' % (path, target))
+        except Exception as e:
+            error = OneWireNeoException('Write to %s%s failed: %s' % (path, target, e))
+        self._stats.record('write', clock() - start, path + target)
+        self._stats.increment('writes' if error is None else 'writeFailures', 1, path + target)
+        if error is None and sensor is not None:
+            sensor._markWritten(target)
+        for future in futures:
+            future._resolve(error)
+
+    def _updateSensors(self, force=False):
+        with self._refreshLock:
+            start = clock()
+            try:
+                self._runUpdate(force)
+            finally:
+                self._stats.record('refresh', clock() - start)
+
+    def _runUpdate(self, force):
+        now = time.time()
+        try:
+            if self._discoveryInterval is None:
+                self._applyDiscovery(self._enumerate(), now)
+            foundSensors = self._foundSensors
+            topology = self._topology
+            latchedBuses = frozenset()
+            if self._simultaneous:
+                latchedBuses = self._convertTemperatures(foundSensors, topology, now, force)
+            alarmed = self._searchAlarms() if self._alarmPolling else frozenset()
+            # reads on different buses run in parallel; refresh returns once every bus is done
+            self._scheduler.run(foundSensors, topology,
+                                lambda foundSensor: self._refreshSensor(foundSensor, now, force,
+                                                                        topology.get(foundSensor.path) in latchedBuses,
+                                                                        foundSensor.path in alarmed))
         finally:
             if self._firstCycle:
                 print(str(self))
             self._firstCycle = False
+            self._dispatchEvents()
+
+    '''
+        One bus enumeration: the devices present and the bus each one is on
+    '''
+    def _enumerate(self):
+        start = clock()
+        entries = list(self._root.iter_sensors())
+        topology = getBusTopology(self._root)
+        self._stats.record('discovery', clock() - start)
+        return entries, topology
+
+    '''
+        Update sensor statuses from an enumeration and remember which devices the next refreshes should read: known
+        sensors which are present, and new devices with a desired feature
+    '''
+    def _applyDiscovery(self, found, now):
+        entries, topology = found
+        knownSensors = set(self._sensors)
+        foundSensors = list()
+        for foundSensor in entries:
+            self._connected = True
+            spath = foundSensor.path
+            if self._sensors.has_key(spath):
+                knownSensors.remove(spath)
+                if self._sensors[spath].status == SENSOR_STATUS.Missing:
+                    # device came back; it may not be the same hardware configuration it left with
+                    self._schemaCache.invalidate(self._sensors[spath].id)
+                    self._queueEvent(EVENT_KIND.SensorAppeared, self._sensors[spath].id, now)
+                self._sensors[spath]._status = SENSOR_STATUS.Available
+                self._snapshots.setSensor(self._sensors[spath].id, repr(SENSOR_STATUS.Available))
+                foundSensors.append(foundSensor)
+            elif isDesiredSensor(spath, self._desiredFeatures):
+                foundSensors.append(foundSensor)
+        # anything left in knownSensors?
+        if len(knownSensors) > 0:
+            for spath in knownSensors:
+                sensor = self._sensors[spath]
+                if sensor.status != SENSOR_STATUS.Missing:
+                    self._stats.increment('missingSensors', 1, sensor.id)
+                    self._queueEvent(EVENT_KIND.SensorMissing, sensor.id, now)
+                sensor._status = SENSOR_STATUS.Missing
+                self._snapshots.setSensor(sensor.id, repr(SENSOR_STATUS.Missing))
+        self._foundSensors = foundSensors
+        self._topology = topology
+
+    def _refreshSensor(self, foundSensor, now, force, latched=False, alarmed=False):
+        start = clock()
+        spath = foundSensor.path
+        existing = self._sensors.get(spath)
+        if existing is not None:
+            existing.update(foundSensor, now, force, latched, alarmed)
+            if alarmed:
+                existing.clearLatches(foundSensor)
+            sensorId = existing.id
+        else:
+            sensor = OneWireNeoSensor(foundSensor, self._desiredFeatures, self._schemaCache, self._pollSchedule,
+                                      self._readPolicy, self._maxAge, self._propertyUpdated, self._stats, latched,
+                                      self._resolutionFor(spath.strip('/').split('/')[-1]), self._lazy)
+            if self._alarmPolling and sensor.id[:2] in ALARM_FAMILIES:
+                sensor.setAlarmInterval(self._alarmSafetyInterval)
+            with self._sensorLock:
+                self._sensors[spath] = sensor
+            self._snapshots.setSensor(sensor.id, repr(sensor.status))
+            if self._lazy:
+                for prop in sensor._properties.values():
+                    self._snapshotProperty(sensor, prop)
+            self._queueEvent(EVENT_KIND.SensorAppeared, sensor.id, now)
+            sensorId = sensor.id
+        self._stats.record('sensor', clock() - start, sensorId)
+
+    '''
+        Start a temperature conversion on every bus holding a thermometer with a reading due, then wait for it to
+        finish.  Returns the buses (None standing for the root) whose thermometers now hold latched readings.
+    '''
+    def _convertTemperatures(self, foundSensors, topology, now, force):
+        buses = set()
+        for foundSensor in foundSensors:
+            if self._needsConversion(foundSensor, now, force):
+                buses.add(topology.get(foundSensor.path))
+        converted = set()
+        if not buses:
+            return converted
+        start = clock()
+        for bus in buses:
+            path = '/%s/%s' % (bus, _SIMULTANEOUS_PATH) if bus is not None else '/' + _SIMULTANEOUS_PATH
+            try:
+                if self._root.capi.put(path, '1'):
+                    converted.add(bus)
+            except Exception as e:
+                print("Simultaneous conversion failed on %s: %s" % (path, e))
+        if converted:
+            time.sleep(self._conversionTime)
+        self._stats.record('conversion', clock() - start)
+        return converted
+
+    '''
+        One conditional search: paths of the switches listed in the owfs alarm directory
+    '''
+    def _searchAlarms(self):
+        start = clock()
+        alarmed = set()
+        try:
+            # owserver caches directory listings too; a cached listing would hide new alarms for the cache lifetime
+            listing = self._root.capi.get(_UNCACHED_ROOT + _ALARM_PATH, cached=False)
+            if listing:
+                for item in listing.split(','):
+                    if _SENSOR_ENTRY.match(item) and item[:2] in ALARM_FAMILIES:
+                        alarmed.add(self._root.path + item)
+        except Exception as e:
+            print("Alarm search failed: %s" % e)
+        self._stats.record('alarmSearch', clock() - start)
+        return alarmed
+
+    def _needsConversion(self, foundSensor, now, force):
+        if foundSensor.path.strip('/').split('/')[-1][:2] not in SIMULTANEOUS_FAMILIES:
+            return False
+        sensor = self._sensors.get(foundSensor.path)
+        if sensor is None:
+            # lazily discovered sensors read nothing yet
+            return not self._lazy
+        if force:
+            return True
+        for prop in sensor._properties.values():
+            if prop.feature is FEATURES.Temperature and prop.isDue(now):
+                return True
+        return False
+
+    '''
+        Called by sensors for every property read, and once when a property goes missing, possibly from several
+        worker threads at once
+    '''
+    def _propertyUpdated(self, sensor, prop, previous, now):
+        self._snapshotProperty(sensor, prop)
+        recorder = self._recorder
+        if recorder is not None and prop.kind is PROPERTY_KIND.Numeric:
+            recorder.record(sensor.id, prop.name, now, prop.rawValue, prop.status.Value)
+        readings = self._readings
+        if readings is not None and prop.kind is PROPERTY_KIND.Numeric:
+            readings.update(sensor.id, prop.name, prop.feature, now, self._readingValue(prop))
+        if prop.status is PROPERTY_STATUS.Missing:
+            return
+        if self._subscriptions and previous is not None and prop.status in _CHANGE_STATUSES:
+            self._pendingEvents.append(OneWireNeoEvent(EVENT_KIND.Changed, sensor.id, now, prop, previous))
+        if self._historyRules:
+            if prop._history is None:
+                for rule in self._historyRules:
+                    if self._historyRuleMatches(rule, sensor, prop):
+                        prop._history = OneWireNeoHistory(rule[2], rule[3])
+                        break
+            # a failed read leaves the last value in place; it is not a new sample
+            if prop._history is not None and prop.value is not None and prop.status is not PROPERTY_STATUS.Indeterminate:
+                prop._history.append(now, prop.value)
+
+    def _readingValue(self, prop):
+        return None if prop.status is PROPERTY_STATUS.Missing else prop.rawValue
+
+    def _snapshotProperty(self, sensor, prop):
+        self._snapshots.update(sensor.id, prop.name, prop.rawValue, repr(prop.status), prop._lastRead, repr(prop.kind))
+
+    def _historyRuleMatches(self, rule, sensor, prop):
+        sensorId, feature = rule[0], rule[1]
+        return prop.kind == PROPERTY_KIND.Numeric and (sensorId is None or sensorId == sensor.id) and \
+            (feature is None or feature == prop.feature)
 
+    def _queueEvent(self, kind, sensorId, now):
+        if self._subscriptions:
+            self._pendingEvents.append(OneWireNeoEvent(kind, sensorId, now))
+
+    def _dispatchEvents(self):
+        events = self._pendingEvents
+        self._pendingEvents = list()
+        for event in events:
+            for subscription in self._subscriptions:
+                try:
+                    subscription.offer(event)
+                except Exception as e:
+                    print("Subscriber failed on %r: %s" % (event, e))
 
     def __str__(self):
         retval = '\nOneWireNeo: Server'
@@ -137,7 +1109,8 @@ class OneWireNeo:
                 desc = str('%-35s' % (getSensorDescription(sensor.id)))
                 if len(desc) > 35:
                     desc = desc[:35]
-                retval += str("\n%s\t%s\t%s\t%s" % (sensor.id, desc, sensor.status, sensor.lastRead.strftime('%m/%d/%y %H:%M:%S')))
+                lastRead = '-' if sensor.lastRead is None else sensor.lastRead.strftime('%m/%d/%y %H:%M:%S')
+                retval += str("\n%s\t%s\t%s\t%s" % (sensor.id, desc, sensor.status, lastRead))
                 for propkey in sorted(sensor._properties.keys()):
                     prop = sensor._properties[propkey]
                     if prop is not None:
@@ -155,53 +1128,546 @@ class OneWireNeo:
     # DONE: use case: display memory as clean hex
     # DONE: use case: indicate whether property has changed.  if numeric, indicate whether it has gone up or down.
     # DONE: use case: ensure property values are trimmed (on display).
-    # TODO: use case: allow single property to be changed
-    # TODO: use case: allow cached property to be specified per sensor
+    # DONE: use case: allow single property to be changed (OneWireNeo.write)
+    # DONE: use case: allow cached property to be specified per sensor (read policies)
 
-class OneWireNeoSensor:
-    def __init__(self, sensor, desiredFeatures=None):
+'''
+    Health state and OneWireNeo instance of one owserver in an aggregate.  The instance, and with it the connection,
+    is created on the first successful refresh and reused afterwards.
+'''
+class OneWireNeoServer:
+    def __init__(self, address, connection=None, connectionOptions=None):
+        self._address = address
+        # see OneWireNeoAggregate on why this is not a pyowfs Connection
+        self._ownsConnection = connection is None
+        self._connection = connection if connection is not None else \
+            OwserverConnection(address, **(connectionOptions or dict()))
+        self._neo = None
+        self._status = SERVER_STATUS.New
+        self._busy = False
+        self._lastRefresh = None
+        self._lastDuration = None
+        self._lastError = None
+        self._failures = 0
+
+    address = property(lambda self: self._address)
+    neo = property(lambda self: self._neo)
+    status = property(lambda self: self._status)
+    busy = property(lambda self: self._busy)
+    lastRefresh = property(lambda self: self._lastRefresh)
+    lastDuration = property(lambda self: self._lastDuration)
+    lastError = property(lambda self: self._lastError)
+    failures = property(lambda self: self._failures)
+    sensors = property(lambda self: self._neo.sensors if self._neo is not None else tuple())
+
+    def __str__(self):
+        return '%s: %s' % (self._address, self._status)
+
+
+'''
+    Polls several owservers concurrently, one worker and one connection per server, and presents their sensors as
+    one view keyed by server address and device path (see sensorKey).  refresh() waits at most timeout seconds;
+    a server still busy then is marked Slow and finishes in the background, and is skipped by later refreshes until
+    it does, so a slow or hung host never holds up the others.  Remaining keyword options are passed to each
+    OneWireNeo.
+
+    Servers without a connection in connections get an owprotocol.OwserverConnection (built with
+    connectionOptions), not a pyowfs Connection: libowcapi holds one owlib state for the whole process, so pyowfs
+    cannot talk to several owservers side by side.
+'''
+class OneWireNeoAggregate:
+    def __init__(self, addresses, desiredFeatures=None, connections=None, timeout=30.0, connectionOptions=None,
+                 **options):
+        if not addresses:
+            raise OneWireNeoException('At least one owserver address is needed')
+        connections = connections if connections is not None else dict()
+        self._desiredFeatures = desiredFeatures
+        self._timeout = timeout
+        self._options = options
+        self._servers = [OneWireNeoServer(address, connections.get(address), connectionOptions)
+                         for address in addresses]
+        self._lock = threading.Lock()
+        self._pool = ThreadPool(len(self._servers))
+        self.refresh(force=True)
+
+    desiredFeatures = property(lambda self: self._desiredFeatures)
+    timeout = property(lambda self: self._timeout)
+    servers = property(lambda self: tuple(self._servers))
+    sensors = property(lambda self: self._mergedSensors())
+
+    def getServer(self, address):
+        for server in self._servers:
+            if server.address == address:
+                return server
+        raise OneWireNeoException('Unknown owserver %s' % address)
+
+    def getSensor(self, address, path):
+        neo = self.getServer(address).neo
+        return neo._sensors.get(path) if neo is not None else None
+
+    '''
+        Refresh every server that is not still busy with an earlier cycle, in parallel
+    '''
+    def refresh(self, force=False):
+        pending = list()
+        with self._lock:
+            for server in self._servers:
+                if not server._busy:
+                    server._busy = True
+                    pending.append((server, self._pool.apply_async(self._refreshServer, (server, force))))
+        deadline = None if self._timeout is None else time.time() + self._timeout
+        for server, result in pending:
+            result.wait(None if deadline is None else max(deadline - time.time(), 0))
+        with self._lock:
+            for server, result in pending:
+                if server._busy:
+                    server._status = SERVER_STATUS.Slow
+
+    def close(self):
+        self._pool.terminate()
+        for server in self._servers:
+            if server.neo is not None:
+                server.neo.close()
+            if server._ownsConnection:
+                server._connection.finish()
+
+    '''
+        Merged view of every server's sensors, keyed by sensorKey(address, path)
+    '''
+    def _mergedSensors(self):
+        retval = dict()
+        for server in self._servers:
+            for sensor in server.sensors:
+                retval[sensorKey(server.address, sensor.path)] = sensor
+        return retval
+
+    def _refreshServer(self, server, force):
+        start = time.time()
+        try:
+            if server._neo is None:
+                server._neo = OneWireNeo(server.address, self._desiredFeatures, server._connection, **self._options)
+            else:
+                server._neo.refresh(force)
+        except Exception as e:
+            with self._lock:
+                server._status = SERVER_STATUS.Offline
+                server._lastError = e
+                server._failures += 1
+                server._lastDuration = time.time() - start
+                server._busy = False
+            return
+        with self._lock:
+            server._status = SERVER_STATUS.Online
+            server._lastError = None
+            server._failures = 0
+            server._lastRefresh = start
+            server._lastDuration = time.time() - start
+            server._busy = False
+
+    def __str__(self):
+        return '\n'.join([str(server.neo) if server.neo is not None else '\nOneWireNeo: %s' % server
+                          for server in self._servers])
+
+
+'''
+    Caches the filtered property list of each device so refreshes do not re-walk the owfs directory tree.  Lists
+    are kept per device id and, for families whose layout is fixed by the chip, shared between devices of the
+    same family and type; the type is a single read instead of a full walk.
+'''
+class OneWireNeoSchemaCache:
+    def __init__(self):
+        self._byDevice = dict()
+        self._byType = dict()
+        self._deviceTypes = dict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._byDevice)
+
+    def getPropertyList(self, sensor, desiredFeatures, loader):
+        sensorId = sensor.path.strip('/').split('/')[-1]
+        cached = self._byDevice.get(sensorId)
+        if cached is not None:
+            return cached
+        typeKey = None
+        familyCode = sensorId.partition('.')[0]
+        if familyCode not in _VARIABLE_LAYOUT_FAMILIES:
+            featureKey = None if desiredFeatures is None else frozenset(desiredFeatures)
+            typeKey = (familyCode, sensor.capi.get(sensor.path + 'type'), featureKey)
+            cached = self._byType.get(typeKey)
+        if cached is None:
+            cached = tuple(loader(sensor))
+            if typeKey is not None:
+                with self._lock:
+                    self._byType[typeKey] = cached
+        with self._lock:
+            self._byDevice[sensorId] = cached
+            self._deviceTypes[sensorId] = typeKey
+        return cached
+
+    '''
+        Forget a single device, e.g. when it disappears and comes back.  Lists shared by family and type are kept.
+    '''
+    def invalidate(self, sensorId):
+        with self._lock:
+            self._byDevice.pop(sensorId, None)
+            self._deviceTypes.pop(sensorId, None)
+
+    '''
+        Drop cached lists; everything if no sensor id is given, otherwise the device and the list it shares.
+    '''
+    def flush(self, sensorId=None):
+        with self._lock:
+            if sensorId is None:
+                self._byDevice.clear()
+                self._byType.clear()
+                self._deviceTypes.clear()
+            else:
+                self._byDevice.pop(sensorId, None)
+                typeKey = self._deviceTypes.pop(sensorId, None)
+                if typeKey is not None:
+                    self._byType.pop(typeKey, None)
+
+
+class OneWireNeoSensor(object):
+    __slots__ = ('_status', '_properties', '_path', '_id', '_readPolicy', '_maxAge', '_lastRead', '_desiredFeatures',
+                 '_schemaCache', '_pollSchedule', '_listener', '_stats', '_temperatureResolution', '_readPlan',
+                 '_alarmInterval', '_capi', '_lock')
+
+    def __init__(self, sensor, desiredFeatures=None, schemaCache=None, pollSchedule=None,
+                 readPolicy=READ_POLICY.Cached, maxAge=None, listener=None, stats=None, latched=False,
+                 temperatureResolution=None, lazy=False):
+        checkReadPolicy(readPolicy, maxAge)
+        checkTemperatureResolution(temperatureResolution)
         self._status = SENSOR_STATUS.New
         self._properties = dict()
-        self._path = sensor.path
-        self._id = sensor.path.strip('/')
-        self._cached = True
+        self._path = intern(sensor.path)
+        self._id = self._path.strip('/')
+        self._readPolicy = readPolicy
+        self._maxAge = maxAge
         self._lastRead = None
         self._desiredFeatures = desiredFeatures
-        self.update(sensor)
+        self._schemaCache = schemaCache
+        self._pollSchedule = pollSchedule
+        self._listener = listener
+        self._stats = stats
+        self._temperatureResolution = temperatureResolution
+        self._readPlan = None
+        self._alarmInterval = None
+        self._capi = sensor.capi
+        # held while properties are read, so a refresh and a first access never update a property at once
+        self._lock = threading.Lock()
+        if lazy:
+            # record the catalog only; values are read on first access or by the next refresh
+            propList = self._getFlatPropertyList(sensor)
+            self._readPlan = _sharedReadPlan(propList)
+            for propName in propList:
+                prop = OneWireNeoProperty(sensor, self._sourceFor(propName), name=propName, lazy=True)
+                prop._owner = self
+                self._properties[propName] = prop
+        else:
+            self.update(sensor, latched=latched)
 
     status = property(lambda self: self._status)
     path = property(lambda self: self._path)
     id = property(lambda self: self._id)
-    # TODO setter for cached, ensure path read uses uncached path if false
-    cached = property(lambda self: self._cached)
-    lastRead = property(lambda self: self._lastRead)
+    lastRead = property(lambda self: _asDatetime(self._lastRead))
+    readPolicy = property(lambda self: self._readPolicy)
+    maxAge = property(lambda self: self._maxAge)
+    cacheHits = property(lambda self: sum([prop.cacheHits for prop in self._properties.values()]))
+    cacheMisses = property(lambda self: sum([prop.cacheMisses for prop in self._properties.values()]))
+    temperatureResolution = property(lambda self: self._temperatureResolution)
+    alarmInterval = property(lambda self: self._alarmInterval)
+    capi = property(lambda self: self._capi)
 
+    def _setCached(self, cached):
+        self.setReadPolicy(READ_POLICY.Cached if cached else READ_POLICY.Uncached)
+
+    cached = property(lambda self: self._readPolicy != READ_POLICY.Uncached, _setCached)
+
+    '''
+        Set the read policy for every property of this sensor which has no policy of its own
+    '''
+    def setReadPolicy(self, readPolicy, maxAge=None):
+        checkReadPolicy(readPolicy, maxAge)
+        self._readPolicy = readPolicy
+        self._maxAge = maxAge
+
+    '''
+        Read temperature at the given resolution in bits (9 to 12) through owfs temperature9..temperature12, or at
+        the device's own setting when None.  The property keeps its normalized name, and the other variants
+        (RESOLUTION_VARIANTS) are no longer read.  Only thermometers with selectable resolution are affected.
+    '''
+    def setTemperatureResolution(self, bits):
+        checkTemperatureResolution(bits)
+        self._temperatureResolution = bits
+        propName = FEATURE_DEFAULT_PROPERTIES[FEATURES.Temperature]
+        prop = self._properties.get(propName)
+        if prop is not None:
+            prop._source = intern(self._sourceFor(propName))
+        if bits is not None and self._id[:2] in RESOLUTION_FAMILIES:
+            for variant in RESOLUTION_VARIANTS:
+                self._properties.pop(variant, None)
+
+    '''
+        Poll sense and PIO properties no more often than every seconds (None for their normal interval); used when
+        alarms tell when they change
+    '''
+    def setAlarmInterval(self, seconds):
+        self._alarmInterval = seconds
+        self._reschedule()
+
+    '''
+        Make a written property (or the channels of a written aggregate) due, so the next refresh reads it back
+    '''
+    def _markWritten(self, propName):
+        plan = self._readPlan[1] if self._readPlan is not None else dict()
+        for prop in self._properties.values():
+            if prop.name == propName or (plan.has_key(prop.name) and plan[prop.name][0] == propName):
+                prop._polledAt = None
+
+    '''
+        Reset the activity latches of a switch which was found in the alarm directory, so it leaves the alarm state
+    '''
+    def clearLatches(self, sensor):
+        if self._id[:2] not in _LATCHING_FAMILIES:
+            return
+        try:
+            sensor.capi.put(self._path + _LATCH_RESET, '1')
+        except Exception as e:
+            print("Clearing latches of %s failed: %s" % (self._id, e))
+
+    '''
+        Look up a property by name, reading it first if it has never been read (lazy mode)
+    '''
     def getProperty(self, propName):
         if self._properties.has_key(propName):
-            return self._properties[propName]
+            prop = self._properties[propName]
+            prop.materialize()
+            return prop
         else:
             raise OneWireNeoException(str('Unknown property %s' % propName))
 
-    def update(self, sensor):
+    '''
+        Read the properties which are due (all of them if force is set or the sensor has no poll schedule).  latched
+        means a simultaneous conversion has just finished on this sensor's bus; alarmed that the sensor was found
+        in the alarm directory, which makes its sense and PIO properties due.
+    '''
+    def update(self, sensor, now=None, force=False, latched=False, alarmed=False):
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self._capi = sensor.capi
+            self._update(sensor, now, force, latched, alarmed)
+
+    def _update(self, sensor, now, force, latched, alarmed):
         knownProperties = set(self._properties)
-        for propName in self._getFlatPropertyList(sensor):
-            if self._properties.has_key(propName):
-                knownProperties.remove(propName)
-                self._properties[propName].update(sensor)
+        duePropNames = list()
+        propList = self._getFlatPropertyList(sensor)
+        for propName in propList:
+            prop = self._properties.get(propName)
+            if prop is None:
+                duePropNames.append(propName)
             else:
-                self._properties[propName] = OneWireNeoProperty(sensor, propName)
+                knownProperties.discard(propName)
+                if force or prop.isDue(now) or (alarmed and prop.feature in ALARM_FEATURES):
+                    duePropNames.append(propName)
+        self._readProperties(sensor, duePropNames, propList, now, latched, alarmed)
         if (len(knownProperties) > 0):
-            print("Some properties seem to have gone missing!")
             for propName in knownProperties:
-                self._properties[propName]._status = PROPERTY_STATUS.Missing
-        self._lastRead = datetime.now()
+                prop = self._properties[propName]
+                if prop.status != PROPERTY_STATUS.Missing:
+                    prop._status = PROPERTY_STATUS.Missing
+                    if self._stats is not None:
+                        self._stats.increment('missingProperties', 1, prop.path)
+                    if self._listener is not None:
+                        self._listener(self, prop, prop.rawValue, now)
+        if duePropNames:
+            self._lastRead = time.time()
+
+    '''
+        Read a property which has never been read (lazy mode) as a refresh would: by its read policy, through its
+        aggregate if it has one, rescheduled and reported to the listener
+    '''
+    def _materialize(self, prop):
+        with self._lock:
+            if not prop.materialized:
+                # reads need only the path and capi of the owfs node, which the sensor has as well
+                self._readProperties(self, [prop.name], self._readPlan[0], time.time())
+                self._lastRead = time.time()
+
+    '''
+        Read propNames (the aggregates of planned channels are added) and apply the values
+    '''
+    def _readProperties(self, sensor, propNames, propList, now, latched=False, alarmed=False):
+        fanOut = self._planReads(propNames, propList)
+        values, uncached = self._readValues(sensor, propNames, now, latched, fanOut, alarmed)
+        for propName in propNames:
+            propval = values[propName]
+            prop = self._properties.get(propName)
+            previous = None
+            if prop is not None:
+                previous = prop.rawValue
+                prop.update(sensor, propval)
+            else:
+                prop = OneWireNeoProperty(sensor, self._sourceFor(propName), propval, propName)
+                self._properties[propName] = prop
+            if propName in uncached:
+                prop._cacheMisses += 1
+                prop._busReadAt = now
+            else:
+                prop._cacheHits += 1
+            prop._polledAt = now
+            prop._pollInterval = self._intervalFor(prop, True)
+            if self._listener is not None:
+                self._listener(self, prop, previous, now)
+
+    '''
+        Fetch values for propNames, split into one batch through the owserver cache and one through /uncached/
+        according to each property's read policy.  Returns the values by name and the set of names read uncached.
+        Latched thermometer readings, and the sense and PIO properties of an alarmed sensor, always go to the bus so
+        the fresh conversion or the alarm edge is picked up.  Channels listed in fanOut (see _planReads) are not
+        fetched themselves but taken from their aggregate.
+    '''
+    def _readValues(self, sensor, propNames, now, latched=False, fanOut=None, alarmed=False):
+        cachedNames = list()
+        uncachedNames = list()
+        latched = latched and self._id[:2] in SIMULTANEOUS_FAMILIES
+        for propName in propNames:
+            if fanOut and fanOut.has_key(propName):
+                continue
+            prop = self._properties.get(propName)
+            if latched or alarmed:
+                feature = prop.feature if prop is not None else findFeatureForProperty(propName)
+                if (latched and feature is FEATURES.Temperature) or (alarmed and feature in ALARM_FEATURES):
+                    uncachedNames.append(propName)
+                    continue
+            if prop is not None:
+                readPolicy, maxAge = prop.effectiveReadPolicy(self)
+                busReadAt = prop._busReadAt
+            else:
+                readPolicy, maxAge = self._readPolicy, self._maxAge
+                busReadAt = None
+            if readPolicy == READ_POLICY.Cached or \
+                    (readPolicy == READ_POLICY.MaxAge and busReadAt is not None and now - busReadAt < maxAge):
+                cachedNames.append(propName)
+            else:
+                uncachedNames.append(propName)
+        # fetch each group in one batch; pipelining clients answer a whole batch in a few round trips
+        cachedPaths = [sensor.path + self._sourceFor(name) for name in cachedNames]
+        values = dict(zip(cachedNames, readPaths(sensor.capi, cachedPaths, stats=self._stats)))
+        if uncachedNames:
+            uncachedPaths = [_UNCACHED_ROOT + sensor.path + self._sourceFor(name) for name in uncachedNames]
+            values.update(zip(uncachedNames, readPaths(sensor.capi, uncachedPaths, False, self._stats)))
+        uncached = set(uncachedNames)
+        if fanOut:
+            self._fanOut(sensor, fanOut, values, uncached)
+        return values, uncached
+
+    '''
+        Channels among propNames which are read through their aggregate (see planAggregateReads), as a dictionary
+        of channel name -> plan entry.  Aggregates that are needed but not due are added to propNames, so that the
+        aggregate property is refreshed together with its channels.
+    '''
+    def _planReads(self, propNames, propList):
+        if self._readPlan is None or self._readPlan[0] is not propList:
+            self._readPlan = _sharedReadPlan(propList)
+        plan = self._readPlan[1]
+        if not plan:
+            return None
+        fanOut = dict()
+        for propName in propNames:
+            entry = plan.get(propName)
+            if entry is not None:
+                fanOut[propName] = entry
+        for aggregate in set([entry[0] for entry in fanOut.values()]):
+            if aggregate not in propNames:
+                propNames.append(aggregate)
+        return fanOut
+
+    '''
+        Fill in channel values from their aggregate's value: comma separated fields, or for memory pages memoryview
+        slices of the page.ALL block, so pages share the block's bytes.  Channels follow their aggregate's read
+        policy.  Channels which cannot be found in the aggregate's value are read on their own.
+    '''
+    def _fanOut(self, sensor, fanOut, values, uncached):
+        unsplit = list()
+        fields = dict()
+        for propName, (aggregate, number, count, binary) in fanOut.items():
+            block = values.get(aggregate)
+            if not isinstance(block, str) or not block:
+                unsplit.append(propName)
+            elif binary:
+                if len(block) % count:
+                    unsplit.append(propName)
+                    continue
+                size = len(block) // count
+                values[propName] = memoryview(block)[number * size:(number + 1) * size]
+            else:
+                if not fields.has_key(aggregate):
+                    fields[aggregate] = block.split(',')
+                if number >= len(fields[aggregate]):
+                    unsplit.append(propName)
+                    continue
+                values[propName] = fields[aggregate][number]
+            if aggregate in uncached:
+                uncached.add(propName)
+        cachedNames = [name for name in unsplit if fanOut[name][0] not in uncached]
+        uncachedNames = [name for name in unsplit if fanOut[name][0] in uncached]
+        if cachedNames:
+            paths = [sensor.path + name for name in cachedNames]
+            values.update(zip(cachedNames, readPaths(sensor.capi, paths, stats=self._stats)))
+        if uncachedNames:
+            paths = [_UNCACHED_ROOT + sensor.path + name for name in uncachedNames]
+            values.update(zip(uncachedNames, readPaths(sensor.capi, paths, False, self._stats)))
+            uncached.update(uncachedNames)
+
+    '''
+        owfs file a property is read from, relative to the sensor
+    '''
+    def _sourceFor(self, propName):
+        if self._temperatureResolution is not None and propName == FEATURE_DEFAULT_PROPERTIES[FEATURES.Temperature] \
+                and self._id[:2] in RESOLUTION_FAMILIES:
+            return '%s%d' % (propName, self._temperatureResolution)
+        return propName
+
+    '''
+        Poll interval of prop; adapt means it has just been read, so an adaptive interval takes a step
+    '''
+    def _intervalFor(self, prop, adapt=False):
+        if self._pollSchedule is None:
+            return 0
+        interval = self._pollSchedule.intervalFor(self._id, prop.name, prop.feature, prop._pollInterval,
+                                                  prop.status if adapt else None)
+        if self._alarmInterval is not None and prop.feature in ALARM_FEATURES:
+            return max(interval, self._alarmInterval)
+        return interval
+
+    def _reschedule(self):
+        for prop in self._properties.values():
+            prop._pollInterval = self._intervalFor(prop)
 
     '''
         Generate a flat property name list which only contains properties in our set of desired features.
     '''
     def _getFlatPropertyList(self, sensor):
-        inProperties = list()
-        self._fetchFlatProperties(sensor, sensor, inProperties)
+        if self._schemaCache is not None:
+            propList = self._schemaCache.getPropertyList(sensor, self._desiredFeatures, self._loadFlatPropertyList)
+        else:
+            propList = self._loadFlatPropertyList(sensor)
+        if self._temperatureResolution is not None and self._id[:2] in RESOLUTION_FAMILIES:
+            return _withoutResolutionVariants(propList)
+        return propList
+
+    def _loadFlatPropertyList(self, sensor):
+        start = clock()
+        if hasattr(sensor.capi, 'walk'):
+            inProperties = sensor.capi.walk(sensor.path)
+        else:
+            inProperties = list()
+            self._fetchFlatProperties(sensor, sensor, inProperties)
+        if self._stats is not None:
+            self._stats.record('dirWalk', clock() - start, self._id)
         outProperties = getDesiredAttributes(inProperties, self._desiredFeatures)
         return outProperties
 
@@ -221,56 +1687,127 @@ class OneWireNeoSensor:
             else:
                 propList.append(basepath + str(item))
 
-class OneWireNeoProperty:
-    def __init__(self, sensor, path):
-        self._path = sensor.path + path
+'''
+    One property of a sensor.  path is the owfs file it is read from, relative to the sensor; name defaults to the
+    same and differs only where a file stands in for a normalized property (e.g. temperature9 for temperature).
+
+    Lazy properties start out unread and are read through their sensor, as a refresh would read them, the first
+    time their value is asked for.  Instances are slotted and keep no per-instance dict.  The full path is built on
+    access from the sensor path and the source file, both interned so every device of a family shares the same name
+    strings, and read times are kept as epoch floats rather than datetime objects.
+'''
+class OneWireNeoProperty(object):
+    __slots__ = ('_sensorPath', '_source', '_name', '_status', '_lastRead', '_value', '_feature', '_kind',
+                 '_writable', '_pollInterval', '_polledAt', '_readPolicy', '_maxAge', '_busReadAt', '_cacheHits',
+                 '_cacheMisses', '_history', '_owner', '_hex')
+
+    def __init__(self, sensor, path, propval=_NOT_READ, name=None, lazy=False):
+        self._owner = None
+        self._sensorPath = intern(sensor.path)
+        self._source = intern(path)
         self._status = PROPERTY_STATUS.New
         self._lastRead = None
         self._value = None
-        self._name = path
+        self._name = intern(name) if name is not None else self._source
+        self._feature = findFeatureForProperty(self._name)
+        self._pollInterval = 0
+        self._polledAt = None
+        self._readPolicy = None
+        self._maxAge = None
+        self._busReadAt = None
+        self._cacheHits = 0
+        self._cacheMisses = 0
+        self._history = None
+        self._hex = None
         self._kind = self._determinePropertyKind(sensor, path)
         self._writable = self._determinePropertyMutability(sensor, path)
-        self._updateValue(sensor)
+        if lazy and propval is _NOT_READ:
+            self._value = _NOT_READ
+        else:
+            self._updateValue(sensor, propval)
 
-    path = property(lambda self: self._path)
+    path = property(lambda self: self._sensorPath + self._source)
     status = property(lambda self: self._status)
-    lastRead = property(lambda self: self._lastRead)
-    # TODO writer for value
-    value = property(lambda self: self._value)
+    lastRead = property(lambda self: _asDatetime(self._lastRead))
+    # writes go through OneWireNeo.write, which queues and coalesces them
+    value = property(lambda self: self.materialize())
+    rawValue = property(lambda self: None if self._value is _NOT_READ else self._value)
+    materialized = property(lambda self: self._value is not _NOT_READ)
     name = property(lambda self: self._name)
     kind = property(lambda self: self._kind)
     writable = property(lambda self: self._writable)
+    feature = property(lambda self: self._feature)
+    pollInterval = property(lambda self: self._pollInterval)
+    pollRate = property(lambda self: 1.0 / self._pollInterval if self._pollInterval else None)
+    nextPoll = property(lambda self: None if self._polledAt is None else self._polledAt + self._pollInterval)
+    readPolicy = property(lambda self: self._readPolicy)
+    maxAge = property(lambda self: self._maxAge)
+    cacheHits = property(lambda self: self._cacheHits)
+    cacheMisses = property(lambda self: self._cacheMisses)
+    history = property(lambda self: self._history)
+
+    '''
+        Give this property its own read policy; None reverts to the owning sensor's policy
+    '''
+    def setReadPolicy(self, readPolicy, maxAge=None):
+        if readPolicy is not None:
+            checkReadPolicy(readPolicy, maxAge)
+        self._readPolicy = readPolicy
+        self._maxAge = maxAge
+
+    def effectiveReadPolicy(self, sensor):
+        if self._readPolicy is None:
+            return sensor.readPolicy, sensor.maxAge
+        return self._readPolicy, self._maxAge
+
+    def isDue(self, now):
+        return self._polledAt is None or now >= self._polledAt + self._pollInterval
 
-    def update(self, sensor):
+    def update(self, sensor, propval=_NOT_READ):
         self._status = PROPERTY_STATUS.Indeterminate
-        self._updateValue(sensor)
+        self._updateValue(sensor, propval)
 
-    def _updateValue(self, sensor):
-        print("Fetching property [%s]" % self._path)
-        propval = sensor.capi.get(self._path)
+    '''
+        Value of the property, reading it now if it has never been read
+    '''
+    def materialize(self):
+        if self._value is _NOT_READ:
+            self._owner._materialize(self)
+        return self._value
+
+    def _updateValue(self, sensor, propval=_NOT_READ):
+        if propval is _NOT_READ:
+            propval = readPaths(sensor.capi, [self.path])[0]
+        if self._value is _NOT_READ:
+            self._value = None
         if self._kind == PROPERTY_KIND.Numeric:
             try:
                 testVal = float(propval)
-            except TypeError:
-                testVal = self._value
-
-            if self._value is None:
-                self._status = PROPERTY_STATUS.Changed
+            except (TypeError, ValueError):
+                # failed read: keep the last value but don't report it as current
+                self._status = PROPERTY_STATUS.Indeterminate
             else:
-                if testVal == self._value:
-                    self._status = PROPERTY_STATUS.Stable
+                if self._value is None:
+                    self._status = PROPERTY_STATUS.Changed
                 else:
-                    self._status = PROPERTY_STATUS.Decreased if testVal < self._value else PROPERTY_STATUS.Increased
-            self._value = testVal
+                    if testVal == self._value:
+                        self._status = PROPERTY_STATUS.Stable
+                    else:
+                        self._status = PROPERTY_STATUS.Decreased if testVal < self._value else PROPERTY_STATUS.Increased
+                self._value = testVal
         else:
-            self._status = PROPERTY_STATUS.Stable if propval == self._value else PROPERTY_STATUS.Changed
+            if propval == self._value:
+                self._status = PROPERTY_STATUS.Stable
+            else:
+                self._status = PROPERTY_STATUS.Changed
+                self._hex = None
             self._value = propval
 
-        self._lastRead = datetime.now()
+        self._lastRead = time.time()
 
     # TODO: unit test to keep devs from screwing up rules <g>
     def _determinePropertyKind(self, sensor, path):
-        propfeature = findFeatureForProperty(self._name)
+        propfeature = self._feature
         if (propfeature is None):
             return PROPERTY_KIND.String
         if (propfeature == FEATURES.Sense):
@@ -285,15 +1822,103 @@ class OneWireNeoProperty:
             return PROPERTY_KIND.Numeric
 
     def _determinePropertyMutability(self, sensor, path):
-        #TODO: determine property mutability
-        return False
+        return _WRITABLE_MATCHER.match(self._name) is not None
 
     def getFormattedValue(self):
+        if self._value is _NOT_READ:
+            return '-'
         if (self._kind == PROPERTY_KIND.Binary):
-            return str(self._value).encode("hex")
+            # hex form is kept until the content changes
+            if self._hex is None and self._value is not None:
+                self._hex = binaryBytes(self._value).encode("hex")
+            return self._hex
         else:
             return self._value
 
+'''
+    Classifies property names into features.  All patterns are compiled into one alternation with a named group per
+    feature, so a name which belongs to no feature costs a single regex call, and results are memoized in a bounded
+    cache (cleared when full - the set of distinct property names on a bus is small).  Results match a plain walk
+    over every pattern of every feature: classify() gives the first matching feature in pattern-table order, and
+    features() every feature with a matching pattern.
+'''
+class OneWireNeoClassifier:
+    def __init__(self, sourcePatterns, cacheSize=4096):
+        self._cacheSize = cacheSize
+        self._cache = dict()
+        self._groupFeatures = dict()
+        self._featureMatchers = list()
+        groups = list()
+        for index, (feature, patterns) in enumerate(sourcePatterns.items()):
+            if not patterns:
+                continue
+            # the patterns' own groups are not needed and would count towards the regex group limit
+            alternation = '|'.join(['(?:%s)' % _CAPTURE_GROUP.sub('(?:', pattern) for pattern in patterns])
+            groupName = 'f%d' % index
+            groups.append('(?P<%s>%s)' % (groupName, alternation))
+            self._groupFeatures[groupName] = feature
+            self._featureMatchers.append((feature, re.compile(alternation, re.IGNORECASE)))
+        self._combined = re.compile('|'.join(groups), re.IGNORECASE)
+
+    cacheSize = property(lambda self: self._cacheSize)
+
+    def classify(self, propName):
+        return self._lookup(propName)[0]
+
+    def features(self, propName):
+        return self._lookup(propName)[1]
+
+    '''
+        Classify a whole attribute list in one pass; returns a dictionary of name -> first matching feature (or None)
+    '''
+    def classifyAttributes(self, attributeList):
+        lookup = self._lookup
+        return dict([(attr, lookup(attr)[0]) for attr in attributeList])
+
+    '''
+        Group an attribute list by feature in one pass; returns a dictionary of feature -> list of names.  A name
+        matched by several features appears under each of them.
+    '''
+    def groupAttributes(self, attributeList):
+        retval = defaultdict(list)
+        for attr in attributeList:
+            for feature in self._lookup(attr)[1]:
+                retval[feature].append(attr)
+        return dict(retval)
+
+    def selectAttributes(self, attributeList, desiredFeatures):
+        desired = frozenset(desiredFeatures)
+        retval = set([attr for attr in IDENT_PROPERTIES if attr in attributeList])
+        if desired:
+            lookup = self._lookup
+            for attr in attributeList:
+                if lookup(attr)[1] & desired:
+                    retval.add(attr)
+        return list(retval)
+
+    def clearCache(self):
+        self._cache = dict()
+
+    def _lookup(self, propName):
+        result = self._cache.get(propName)
+        if result is None:
+            result = self._classify(propName)
+            if len(self._cache) >= self._cacheSize:
+                self._cache = dict()
+            self._cache[propName] = result
+        return result
+
+    def _classify(self, propName):
+        match = self._combined.match(propName)
+        if match is None:
+            return None, frozenset()
+        first = self._groupFeatures[match.lastgroup]
+        features = set([first])
+        for feature, matcher in self._featureMatchers:
+            if feature not in features and matcher.match(propName):
+                features.add(feature)
+        return first, frozenset(features)
+
 '''
     Placeholder for unknown family code
 '''
@@ -366,8 +1991,8 @@ _FAMILY_FEATURES = {
     Map property names to default features; this is the main associative element in this code.
 '''
 _SOURCE_PATTERNS = {
-    # TODO: temp: determine how to handle multiple resolutions without pre-loading all, it takes too long
-    FEATURES.Temperature: ['(TAI8570/)?temperature','fasttemp','type[A-Z]/temperature'],
+    # resolution variants (temperature9 .. temperature12) are deliberately not matched; see setTemperatureResolution
+    FEATURES.Temperature: ['(TAI8570/)?temperature(?!\d)','fasttemp','type[A-Z]/temperature'],
     FEATURES.Humidity: ['(HIH4000/)?(HTM1735/)?humidity'],
     FEATURES.Pressure: ['(TAI8570/)?(B1-R1-A/)?pressure'],
     FEATURES.Counter: ['counter(s)?\.[AB]', 'counter(s)\.ALL', '(readonly/)?(counter/)?cycle(s)?', 'counter', 'page(s)?/count(er)?(s?)\.[\d]+', 'page(s)?/count(er)?(s)?.ALL'],
@@ -375,7 +2000,7 @@ _SOURCE_PATTERNS = {
     FEATURES.Current: ['current','amphours'],
     FEATURES.Sense: ['sensed', 'sensed\.[a-z]', 'sensed\.all', 'sensed\.byte'],
     FEATURES.Pio: ['pio', 'pio\.[a-z]', 'pio\.(all)?(byte)?', 'latch\.[a-z]','latch\.(all)?(byte)?', 'branch','channels','flipflop\.[AB]?(ALL)?(BYTE)?'],
-    FEATURES.Memory: ['application', 'page\.[\d]+', 'pages/page\.[\d]+'],
+    FEATURES.Memory: ['application', 'page\.[\d]+', 'pages/page\.[\d]+', '(pages/)?page\.ALL'],
     FEATURES.Clock: ['(u)?date', 'readonly/clock', 'disconnect/(u)?date', 'endcharge/(u)?date', 'clock/(u)?date' ],
     FEATURES.Illumination: ['S3-R1-A/(illumination)?(current)?(gain)?'],
     FEATURES.UV: ['uvi/uvi','uvi/uvi-offset','uvi/in_case', 'uvi/valid'],
@@ -383,6 +2008,65 @@ _SOURCE_PATTERNS = {
     FEATURES.LCD: []
 }
 
+'''
+    Families commonly used as the base of third-party boards (TAI8570, Hobby Boards, DS2438 multisensors) whose
+    property layout varies between devices of the same type; their property lists are never shared.
+'''
+_VARIABLE_LAYOUT_FAMILIES = frozenset(['12', '1D', '26', 'EE', 'EF'])
+
+'''
+    Prefix of the owfs tree which bypasses the owserver cache
+'''
+_UNCACHED_ROOT = '/uncached'
+
+'''
+    Thermometer families which take part in a simultaneous conversion, and the owfs file (at the root or below a
+    bus directory) which starts one
+'''
+SIMULTANEOUS_FAMILIES = frozenset(['10', '22', '28', '3B', '42'])
+_SIMULTANEOUS_PATH = 'simultaneous/temperature'
+
+'''
+    Thermometer families whose resolution can be chosen per read (owfs temperature9 .. temperature12), and the
+    resolutions in bits
+'''
+RESOLUTION_FAMILIES = frozenset(['22', '28', '3B', '42'])
+TEMPERATURE_RESOLUTIONS = (9, 10, 11, 12)
+
+'''
+    Temperature files of those families which read at a resolution of their own; each read starts a conversion of
+    its own, so they are left out once a resolution is chosen (temperature9..12 never match the Temperature patterns)
+'''
+RESOLUTION_VARIANTS = frozenset(['fasttemp'])
+
+'''
+    Switch families which answer the conditional search when an input changes, the features read when they do,
+    the families among them with activity latches, and the owfs files listing alarmed devices and clearing latches
+'''
+ALARM_FAMILIES = frozenset(['05', '12', '1C', '29', '3A'])
+ALARM_FEATURES = frozenset([FEATURES.Sense, FEATURES.Pio])
+_LATCHING_FAMILIES = frozenset(['12', '1C', '29'])
+_ALARM_PATH = '/alarm/'
+_LATCH_RESET = 'latch.BYTE'
+
+'''
+    Channel properties (pio.A, sensed.0, T8A/volt.3, pages/page.12, ...): everything up to the last dot, and the
+    channel letter or number
+'''
+_CHANNEL_NAME = re.compile('^(.+\.)([A-Z]|\d+)$', re.IGNORECASE)
+
+'''
+    Properties which can be written: PIO outputs, activity latches and clocks.  LCD displays are not discovered (their
+    feature has no source patterns), so they are not listed.
+'''
+_WRITABLE_MATCHER = re.compile('^(pio(\.[a-z0-9]+)?|latch\.[a-z0-9]+|(clock/)?u?date)$', re.IGNORECASE)
+
+'''
+    Matches bus directories (/bus.0/, /bus.1/, ...) and sensor entries in owfs directory listings
+'''
+_BUS_MATCHER = re.compile('^/bus\.\d+/$')
+_SENSOR_ENTRY = re.compile('[0-9A-F]{2}\.[0-9A-F]{12}/')
+
 '''
     Compiles property matchers from _SOURCE_PATTERNS into regex matchers to improve performance
 '''
@@ -394,6 +2078,12 @@ for key, value in _SOURCE_PATTERNS.items():
         matcherList.append(re.compile(pattern, re.IGNORECASE))
     _finderMatchers[key] = matcherList
 
+'''
+    Shared classifier used by the attribute and property lookups below
+'''
+_CAPTURE_GROUP = re.compile(r'(?<!\\)\((?!\?)')
+_classifier = OneWireNeoClassifier(_SOURCE_PATTERNS)
+
 '''
     Retrieve family information for a given 1-Wire family code.
     Use this method rather than accessing _FAMILY_MEMBERS directly.
@@ -401,6 +2091,13 @@ for key, value in _SOURCE_PATTERNS.items():
 def getFamilyInfo(code):
     return _FAMILY_FEATURES.get(code, _UNKNOWN_FAMILY)
 
+'''
+    All families in the family table, ordered by family code
+'''
+def getKnownFamilies():
+    families = [_FAMILY_FEATURES[code] for code in sorted(_FAMILY_FEATURES)]
+    return tuple([family for family in families if family is not _UNKNOWN_FAMILY])
+
 '''
     Retrieve list of attribute names which match the desired features
     This method normalizes output - property names will always be all lowercase.
@@ -409,36 +2106,32 @@ def getMatchingAttributes(inputData, desiredFeatures=None):
     # TODO: add sensor alias if found!
     # TODO - handle 'None' for desiredFeatures - implies "all"
     retval = dict()
-    # Add default properties - these are always present
-    for attr in IDENT_PROPERTIES:
-        if inputData.has_key(attr):
-            retval[attr.lower()] = inputData[attr]
-    # Then add matching entries for each feature in desiredFeatures
-    for feature in desiredFeatures:
-        # Determine list of keys for requested feature
-        featureKeys = set()
-        for key in inputData.iterkeys():
-            for matcher in _finderMatchers[feature]:
-                if matcher.match(key):
-                    featureKeys.add(key)
-                    break
-        # Then add matching properties for this feature to dictionary
-        for attr in featureKeys:
-            if inputData.has_key(attr):
-                retval[attr.lower()] = inputData[attr]
+    # Default properties are always present, followed by entries matching any of desiredFeatures
+    for attr in _classifier.selectAttributes(inputData.keys(), desiredFeatures):
+        retval[attr.lower()] = inputData[attr]
     return retval
 
 def getDesiredAttributes(attributeList, desiredFeatures=None):
-    retval = set()
-    for attr in IDENT_PROPERTIES:
-        if attr in attributeList:
-            retval.add(attr)
-    for feature in desiredFeatures:
-        for attr in attributeList:
-            for matcher in _finderMatchers[feature]:
-                if matcher.match(attr):
-                    retval.add(attr)
-    return list(retval)
+    return _classifier.selectAttributes(attributeList, desiredFeatures)
+
+'''
+    Bytes of a binary property value, which is either a str or a memoryview slice of a memory block
+'''
+def binaryBytes(value):
+    return value.tobytes() if isinstance(value, memoryview) else str(value)
+
+'''
+    Key of a sensor in an aggregate's merged view: server address followed by device path, e.g.
+    'zone1:4304/28.000000000001/'
+'''
+def sensorKey(address, path):
+    return address + path
+
+'''
+    Map each attribute name to the feature it belongs to (None if it matches no feature) in a single pass
+'''
+def classifyAttributes(attributeList):
+    return _classifier.classifyAttributes(attributeList)
 
 '''
     Determine which sensors in supplied list provide the desired features
@@ -468,8 +2161,174 @@ def getSensorDescription(sensorId):
     return familyMetadata.description
 
 def findFeatureForProperty(propName):
-    for key, value in _finderMatchers.items():
-        for matcher in value:
-            if matcher.match(propName):
-                return key
-    return None
+    return _classifier.classify(propName)
+
+'''
+    Aggregate read plan for a property list, as a dictionary of channel name -> (aggregate name, channel number,
+    channel count, binary) for every channel whose aggregate is listed too: pio.A and pio.B with pio.ALL, T8A/volt.0
+    to T8A/volt.7 with T8A/volt.ALL, pages/page.N with pages/page.ALL.  Channels are numbered A=0, B=1, ... or by
+    their digits, which is the order of the aggregate's comma separated fields.  Binary aggregates (memory) are
+    one block holding channel count equal pages instead.
+'''
+def planAggregateReads(propList):
+    channels = defaultdict(list)
+    for propName in propList:
+        match = _CHANNEL_NAME.match(propName)
+        if match is not None:
+            channels[match.group(1)].append((propName, match.group(2)))
+    plan = dict()
+    if not channels:
+        return plan
+    names = dict([(propName.lower(), propName) for propName in propList])
+    for prefix, members in channels.items():
+        aggregate = names.get((prefix + 'all').lower())
+        if aggregate is None:
+            continue
+        binary = findFeatureForProperty(aggregate) is FEATURES.Memory
+        for propName, channel in members:
+            number = int(channel) if channel.isdigit() else ord(channel.upper()) - ord('A')
+            plan[propName] = (aggregate, number, len(members), binary)
+    return plan
+
+'''
+    (property list, plan) pairs shared by every sensor with an equal property list, so that sensors keep a
+    reference rather than a plan of their own.  Cleared when full.
+'''
+_readPlans = dict()
+_READ_PLAN_CACHE_SIZE = 1024
+
+'''
+    propList without RESOLUTION_VARIANTS.  The filtered list is kept per source list, so sensors sharing a cached
+    property list share the filtered one too and their read plans stay shared.
+'''
+_resolutionLists = dict()
+
+def _withoutResolutionVariants(propList):
+    entry = _resolutionLists.get(id(propList))
+    if entry is None or entry[0] is not propList:
+        if len(_resolutionLists) >= _READ_PLAN_CACHE_SIZE:
+            _resolutionLists.clear()
+        filtered = [name for name in propList if name not in RESOLUTION_VARIANTS]
+        entry = _resolutionLists[id(propList)] = (propList, filtered if len(filtered) < len(propList) else propList)
+    return entry[1]
+
+def _sharedReadPlan(propList):
+    key = tuple(propList)
+    entry = _readPlans.get(key)
+    if entry is None or entry[0] is not propList:
+        if len(_readPlans) >= _READ_PLAN_CACHE_SIZE:
+            _readPlans.clear()
+        entry = _readPlans[key] = (propList, entry[1] if entry is not None else planAggregateReads(propList))
+    return entry
+
+'''
+    owfs text for a written value: booleans as 1 or 0, anything else as its string form
+'''
+def formatWriteValue(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    return str(value)
+
+'''
+    Combine queued writes, given as (property name, value, futures) in queue order, into the writes to send.  When
+    the writes cover every channel of a comma separated aggregate in propList (PIO.A and PIO.B with PIO.ALL), they
+    are merged into one write of the aggregate, on top of a queued write of the aggregate itself if there is one.
+    Returns a list of (property name, value, futures).
+'''
+def mergeChannelWrites(writes, propList):
+    plan = planAggregateReads(propList) if writes else dict()
+    groups = defaultdict(list)
+    for write in writes:
+        entry = plan.get(write[0])
+        if entry is not None and not entry[3]:
+            groups[entry[0]].append(write)
+    merged = dict()
+    for aggregate, channelWrites in groups.items():
+        count = plan[channelWrites[0][0]][2]
+        base = [write for write in writes if write[0] == aggregate]
+        if len(channelWrites) != count or (base and len(base[0][1].split(',')) != count):
+            continue
+        fields = base[0][1].split(',') if base else [None] * count
+        futures = list(base[0][2]) if base else list()
+        for propName, value, channelFutures in channelWrites:
+            number = plan[propName][1]
+            if number >= count:
+                break
+            fields[number] = value
+            futures.extend(channelFutures)
+        else:
+            merged[aggregate] = (aggregate, ','.join(fields), futures)
+    retval = list()
+    for write in writes:
+        entry = plan.get(write[0])
+        aggregate = entry[0] if entry is not None else write[0]
+        if merged.has_key(aggregate):
+            if merged[aggregate] is not None:
+                retval.append(merged[aggregate])
+                merged[aggregate] = None
+        else:
+            retval.append(write)
+    return retval
+
+'''
+    Read a batch of absolute owfs paths, returning values in the same order.  Uses the connection's pipelined
+    getMany when it has one (owprotocol.OwserverClient), otherwise one capi.get per path as pyowfs requires.
+'''
+def readPaths(capi, paths, cached=True, stats=None):
+    if not paths:
+        return list()
+    batched = hasattr(capi, 'getMany')
+    if stats is None:
+        if batched:
+            return capi.getMany(paths, cached)
+        return [capi.get(path, cached=cached) for path in paths]
+    if batched:
+        start = clock()
+        values = capi.getMany(paths, cached)
+        stats.record('readBatch', clock() - start, paths[0])
+    else:
+        values = list()
+        for path in paths:
+            start = clock()
+            values.append(capi.get(path, cached=cached))
+            stats.record('read', clock() - start, path)
+    stats.increment('reads', len(paths))
+    failures = values.count(None)
+    if failures:
+        stats.increment('readFailures', failures)
+    return values
+
+def checkReadPolicy(readPolicy, maxAge):
+    if not [policy for policy in READ_POLICY if policy is readPolicy]:
+        raise OneWireNeoException('Unknown read policy %s' % readPolicy)
+    if readPolicy == READ_POLICY.MaxAge and (maxAge is None or maxAge < 0):
+        raise OneWireNeoException('The MaxAge read policy needs a max age of zero or more seconds')
+
+'''
+    Convert an epoch timestamp as stored by sensors and properties into the datetime their API returns
+'''
+def _asDatetime(timestamp):
+    return None if timestamp is None else datetime.fromtimestamp(timestamp)
+
+'''
+    Validate a temperature resolution in bits; None stands for the device's own setting
+'''
+def checkTemperatureResolution(bits):
+    if bits is not None and bits not in TEMPERATURE_RESOLUTIONS:
+        raise OneWireNeoException('Temperature resolution must be one of %s bits' % (TEMPERATURE_RESOLUTIONS,))
+
+'''
+    Map each sensor path (as returned by iter_sensors, e.g. '/10.5D4470010800/') to the name of the bus it sits on
+    ('bus.0', 'bus.1', ...).  Sensors on a server that does not expose bus directories are left out of the map.
+'''
+def getBusTopology(root):
+    topology = dict()
+    for entry in root.iter_entries():
+        if type(entry).__name__ == 'Dir' and _BUS_MATCHER.match(entry.path):
+            busName = entry.path.strip('/')
+            listing = root.capi.get(entry.path)
+            if listing:
+                for item in listing.split(','):
+                    if _SENSOR_ENTRY.match(item):
+                        topology[root.path + item] = busName
+    return topology
@@ -0,0 +1,194 @@
+__author__ = 'sdavidson'
+
+import math
+from array import array
+from collections import deque
+
+'''
+    Fixed-capacity sample history for numeric properties.  Timestamps and values live in two preallocated
+    array('d') rings (16 bytes per sample), and rolling statistics are kept for any number of sample-count windows
+    so min/max/mean/stddev over a window are O(1) to read and amortized O(1) to maintain.
+'''
+
+
+'''
+    Snapshot of rolling statistics over a window
+'''
+class OneWireNeoRollingStats(object):
+    __slots__ = ('count', 'min', 'max', 'mean', 'stddev')
+
+    def __init__(self, count, minimum, maximum, mean, stddev):
+        self.count = count
+        self.min = minimum
+        self.max = maximum
+        self.mean = mean
+        self.stddev = stddev
+
+    def __repr__(self):
+        return '<OneWireNeoRollingStats n=%d min=%s max=%s mean=%s stddev=%s>' % (self.count, self.min, self.max,
+                                                                                 self.mean, self.stddev)
+
+
+'''
+    Rolling statistics over the last size samples.  Min and max use monotonic queues; sum and sum of squares are
+    re-added exactly every time the ring wraps so floating point drift cannot build up.
+'''
+class OneWireNeoRollingWindow(object):
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError('Window size must be at least 1')
+        self._size = size
+        self._ring = array('d', [0.0]) * size
+        self._pos = 0
+        self._count = 0
+        self._seq = 0
+        self._sum = 0.0
+        self._sumSquares = 0.0
+        self._minQueue = deque()
+        self._maxQueue = deque()
+
+    size = property(lambda self: self._size)
+    count = property(lambda self: self._count)
+
+    def push(self, value):
+        ring = self._ring
+        if self._count == self._size:
+            old = ring[self._pos]
+            self._sum -= old
+            self._sumSquares -= old * old
+        else:
+            self._count += 1
+        ring[self._pos] = value
+        self._pos += 1
+        if self._pos == self._size:
+            self._pos = 0
+            self._sum = math.fsum(ring)
+            self._sumSquares = math.fsum([v * v for v in ring])
+        else:
+            self._sum += value
+            self._sumSquares += value * value
+        self._seq += 1
+        expired = self._seq - self._size
+        minQueue = self._minQueue
+        while minQueue and minQueue[-1][1] >= value:
+            minQueue.pop()
+        minQueue.append((self._seq, value))
+        if minQueue[0][0] <= expired:
+            minQueue.popleft()
+        maxQueue = self._maxQueue
+        while maxQueue and maxQueue[-1][1] <= value:
+            maxQueue.pop()
+        maxQueue.append((self._seq, value))
+        if maxQueue[0][0] <= expired:
+            maxQueue.popleft()
+
+    def stats(self):
+        count = self._count
+        if count == 0:
+            return OneWireNeoRollingStats(0, None, None, None, None)
+        mean = self._sum / count
+        variance = max(self._sumSquares / count - mean * mean, 0.0)
+        return OneWireNeoRollingStats(count, self._minQueue[0][1], self._maxQueue[0][1], mean, math.sqrt(variance))
+
+
+class OneWireNeoHistory(object):
+    def __init__(self, capacity, windows=()):
+        if capacity < 1:
+            raise ValueError('History capacity must be at least 1')
+        self._capacity = capacity
+        self._times = array('d', [0.0]) * capacity
+        self._values = array('d', [0.0]) * capacity
+        self._start = 0
+        self._count = 0
+        self._windows = dict()
+        for size in windows:
+            self.addWindow(size)
+
+    capacity = property(lambda self: self._capacity)
+    windows = property(lambda self: tuple(sorted(self._windows)))
+
+    def __len__(self):
+        return self._count
+
+    '''
+        Add a rolling window of size samples, seeded from the samples already held
+    '''
+    def addWindow(self, size):
+        if size not in self._windows:
+            window = OneWireNeoRollingWindow(size)
+            for value in self.values()[-size:]:
+                window.push(value)
+            self._windows[size] = window
+
+    def append(self, timestamp, value):
+        if self._count < self._capacity:
+            index = (self._start + self._count) % self._capacity
+            self._count += 1
+        else:
+            index = self._start
+            self._start = (self._start + 1) % self._capacity
+        self._times[index] = timestamp
+        self._values[index] = value
+        for window in self._windows.values():
+            window.push(value)
+
+    def latest(self):
+        if self._count == 0:
+            return None
+        index = (self._start + self._count - 1) % self._capacity
+        return self._times[index], self._values[index]
+
+    def stats(self, window):
+        if window not in self._windows:
+            raise KeyError('No rolling window of %d samples' % window)
+        return self._windows[window].stats()
+
+    '''
+        Statistics over samples taken at or after timestamp.  This walks the samples, unlike stats().
+    '''
+    def statsSince(self, timestamp):
+        values = self.values(self._firstIndexSince(timestamp))
+        count = len(values)
+        if count == 0:
+            return OneWireNeoRollingStats(0, None, None, None, None)
+        mean = math.fsum(values) / count
+        variance = max(math.fsum([v * v for v in values]) / count - mean * mean, 0.0)
+        return OneWireNeoRollingStats(count, min(values), max(values), mean, math.sqrt(variance))
+
+    '''
+        Timestamps in order, oldest first, from the given logical position
+    '''
+    def timestamps(self, first=0):
+        return self._ordered(self._times, first)
+
+    def values(self, first=0):
+        return self._ordered(self._values, first)
+
+    def clear(self):
+        self._start = 0
+        self._count = 0
+        self._windows = dict([(size, OneWireNeoRollingWindow(size)) for size in self._windows])
+
+    def _ordered(self, ring, first):
+        first = max(first, 0)
+        if first >= self._count:
+            return array('d')
+        begin = (self._start + first) % self._capacity
+        end = (self._start + self._count) % self._capacity
+        if begin < end:
+            return ring[begin:end]
+        return ring[begin:] + ring[:end]
+
+    '''
+        Binary search for the logical position of the first sample at or after timestamp
+    '''
+    def _firstIndexSince(self, timestamp):
+        low, high = 0, self._count
+        times = self._times
+        while low < high:
+            middle = (low + high) // 2
+            if times[(self._start + middle) % self._capacity] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
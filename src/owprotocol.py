@@ -0,0 +1,373 @@
+__author__ = 'sdavidson'
+
+import re
+import socket
+import struct
+import threading
+from collections import deque
+
+'''
+    Pure-Python owserver network protocol client.
+
+    OwserverClient keeps a pool of persistent owserver connections and pipelines requests over them, so a batch of
+    reads costs one round trip per pipeline window rather than one per value.  OwserverConnection wraps a client in
+    the same Connection / Sensor / Dir shape pyowfs provides, and can be handed to OneWireNeo in its place:
+
+        neo = OneWireNeo(desiredFeatures=features, connection=OwserverConnection('192.168.0.42:4304'))
+
+    See http://owfs.org/index.php?page=owserver-protocol for the wire format.
+'''
+
+'''
+    Message types
+'''
+MSG_ERROR = 0
+MSG_NOP = 1
+MSG_READ = 2
+MSG_WRITE = 3
+MSG_DIR = 4
+MSG_SIZE = 5
+MSG_PRESENCE = 6
+MSG_DIRALL = 7
+MSG_GET = 8
+MSG_DIRALLSLASH = 9
+MSG_GETSLASH = 10
+
+'''
+    Control flags
+'''
+FLG_BUS_RET = 0x00000002
+FLG_PERSISTENCE = 0x00000004
+FLG_ALIAS = 0x00000008
+FLG_SAFEMODE = 0x00000010
+FLG_UNCACHED = 0x00000020
+FLG_OWNET = 0x00000100
+
+'''
+    Request and response headers are six network-order 32 bit integers:
+    request:  version, payload length, message type, control flags, expected size, offset
+    response: version, payload length, return value, control flags, size, offset
+'''
+HEADER = struct.Struct('>iiiiii')
+MAX_PAYLOAD = 65536
+
+'''
+    Payload length used by owserver for keep-alive "ping" responses, which carry no data
+'''
+PING_PAYLOAD = -1
+
+_SENSOR_ENTRY = re.compile('[0-9A-F]{2}\.[0-9A-F]{12}/')
+
+
+class OwserverException(Exception):
+    """
+    owserver protocol or transport error
+    """
+    def __init__(self, value):
+        Exception.__init__(self)
+        self.value = value
+
+    def __str__(self):
+        return repr(self.value)
+
+
+'''
+    Split an address of the form 'host:port' (port defaults to 4304)
+'''
+def parseAddress(address):
+    host, sep, port = address.rpartition(':')
+    if not sep:
+        return address, 4304
+    return host or 'localhost', int(port)
+
+'''
+    Convert a DIRALLSLASH response into entry names relative to the directory that was listed, keeping the
+    trailing slash on directories (the same form libowcapi returns).
+'''
+def parseListing(listing):
+    entries = list()
+    if listing:
+        for item in listing.rstrip('\0').split(','):
+            if not item:
+                continue
+            isDir = item.endswith('/')
+            name = item.rstrip('/').rsplit('/', 1)[-1]
+            entries.append(name + '/' if isDir else name)
+    return entries
+
+
+'''
+    One TCP connection to owserver.  Tracks whether the server granted persistence; until it has, callers must not
+    have more than one request in flight since a non-persistent server closes the socket after each response.
+'''
+class OwserverChannel:
+    def __init__(self, host, port, timeout):
+        self._socket = socket.create_connection((host, port), timeout)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._persistent = False
+
+    persistent = property(lambda self: self._persistent)
+
+    def send(self, msgType, payload, flags, size, offset=0):
+        header = HEADER.pack(0, len(payload), msgType, flags | FLG_PERSISTENCE, size, offset)
+        self._socket.sendall(header + payload)
+
+    def receive(self):
+        while True:
+            version, payloadLength, ret, flags, size, offset = HEADER.unpack(self._recvExact(HEADER.size))
+            if payloadLength != PING_PAYLOAD:
+                break
+        data = self._recvExact(payloadLength) if payloadLength > 0 else ''
+        if 0 <= size < len(data):
+            data = data[:size]
+        self._persistent = bool(flags & FLG_PERSISTENCE)
+        return ret, data
+
+    def close(self):
+        try:
+            self._socket.close()
+        except socket.error:
+            pass
+
+    def _recvExact(self, count):
+        chunks = list()
+        remaining = count
+        while remaining > 0:
+            chunk = self._socket.recv(remaining)
+            if not chunk:
+                raise OwserverException('owserver closed the connection')
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return ''.join(chunks)
+
+
+'''
+    Pooled, pipelining owserver client.  get/put follow the libowcapi signatures used through pyowfs (capi.get,
+    capi.put); getMany and walk are the batch calls OneWireNeo uses when they are available.
+'''
+class OwserverClient:
+    def __init__(self, address='localhost:4304', poolSize=4, pipelineDepth=16, timeout=5.0, flags=FLG_OWNET):
+        if poolSize < 1:
+            raise OwserverException('poolSize must be at least 1')
+        if pipelineDepth < 1:
+            raise OwserverException('pipelineDepth must be at least 1')
+        self._address = address
+        self._host, self._port = parseAddress(address)
+        self._poolSize = poolSize
+        self._pipelineDepth = pipelineDepth
+        self._timeout = timeout
+        self._flags = flags
+        self._idle = list()
+        self._open = 0
+        self._poolCondition = threading.Condition()
+        self._requests = 0
+        self._roundTrips = 0
+
+    address = property(lambda self: self._address)
+    poolSize = property(lambda self: self._poolSize)
+    pipelineDepth = property(lambda self: self._pipelineDepth)
+    requests = property(lambda self: self._requests)
+    roundTrips = property(lambda self: self._roundTrips)
+
+    def get(self, path, cached=True):
+        return self.getMany([path], cached)[0]
+
+    def getMany(self, paths, cached=True):
+        requests = [self._readRequest(path, cached) for path in paths]
+        results = list()
+        for path, (ret, data) in zip(paths, self._transact(requests)):
+            if ret < 0:
+                results.append(None)
+            elif self._isDirPath(path):
+                results.append(','.join(parseListing(data)))
+            else:
+                results.append(data)
+        return results
+
+    def put(self, path, value):
+        data = str(value)
+        ret, reply = self._transact([(MSG_WRITE, path + '\0' + data, self._flags, len(data))])[0]
+        return ret >= 0
+
+    def dir(self, path='/', cached=True):
+        ret, data = self._transact([self._readRequest(self._asDirPath(path), cached)])[0]
+        if ret < 0:
+            raise OwserverException('Unable to list %s (error %d)' % (path, -ret))
+        return parseListing(data)
+
+    '''
+        List every file below path, breadth first, pipelining the directory listings of each level.  Names are
+        relative to path (e.g. 'temperature', 'pages/page.0'); nested sensors (couplers) are not followed.
+    '''
+    def walk(self, path, cached=True):
+        path = self._asDirPath(path)
+        files = list()
+        level = [path]
+        while level:
+            replies = self._transact([self._readRequest(dirPath, cached) for dirPath in level])
+            nextLevel = list()
+            for dirPath, (ret, data) in zip(level, replies):
+                if ret < 0:
+                    continue
+                for entry in parseListing(data):
+                    if entry.endswith('/'):
+                        if not _SENSOR_ENTRY.match(entry):
+                            nextLevel.append(dirPath + entry)
+                    else:
+                        files.append(dirPath[len(path):] + entry)
+            level = nextLevel
+        return files
+
+    def close(self):
+        with self._poolCondition:
+            idle = self._idle
+            self._idle = list()
+            self._open -= len(idle)
+        for channel in idle:
+            channel.close()
+
+    def _readRequest(self, path, cached):
+        flags = self._flags if cached else self._flags | FLG_UNCACHED
+        if self._isDirPath(path):
+            return MSG_DIRALLSLASH, path + '\0', flags, 0
+        return MSG_READ, path + '\0', flags, MAX_PAYLOAD
+
+    def _isDirPath(self, path):
+        return path.endswith('/')
+
+    def _asDirPath(self, path):
+        return path if path.endswith('/') else path + '/'
+
+    '''
+        Send a batch of (type, payload, flags, size) requests and return their (ret, data) replies in order.  Up to
+        pipelineDepth requests are kept in flight once the server has granted persistence.  A connection that drops
+        mid-batch (owserver times out idle persistent sockets) is replaced once and the unanswered requests resent.
+    '''
+    def _transact(self, requests):
+        results = list()
+        channel = self._acquire()
+        retried = False
+        try:
+            while len(results) < len(requests):
+                if channel is None:
+                    channel = self._connect()
+                try:
+                    self._pipeline(channel, requests, results)
+                except (socket.error, OwserverException) as e:
+                    channel.close()
+                    channel = None
+                    if retried:
+                        raise OwserverException('owserver request failed: %s' % e)
+                    retried = True
+                    continue
+                if not channel.persistent:
+                    # server answered without persistence and will close this socket; continue on a fresh one
+                    channel.close()
+                    channel = None
+        finally:
+            self._release(channel)
+        return results
+
+    def _pipeline(self, channel, requests, results):
+        pending = deque()
+        nextRequest = len(results)
+        roundTrips = 0
+        try:
+            while len(results) < len(requests):
+                while nextRequest < len(requests) and len(pending) < self._pipelineDepth and \
+                        (channel.persistent or not pending):
+                    msgType, payload, flags, size = requests[nextRequest]
+                    channel.send(msgType, payload, flags, size)
+                    pending.append(nextRequest)
+                    nextRequest += 1
+                results.append(channel.receive())
+                pending.popleft()
+                if not pending:
+                    roundTrips += 1
+                if not channel.persistent:
+                    return
+        finally:
+            with self._poolCondition:
+                self._roundTrips += roundTrips
+                self._requests += len(results)
+
+    def _connect(self):
+        try:
+            return OwserverChannel(self._host, self._port, self._timeout)
+        except socket.error as e:
+            raise OwserverException('Unable to connect to owserver at %s: %s' % (self._address, e))
+
+    def _acquire(self):
+        with self._poolCondition:
+            while not self._idle and self._open >= self._poolSize:
+                self._poolCondition.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._open += 1
+        try:
+            return self._connect()
+        except:
+            with self._poolCondition:
+                self._open -= 1
+                self._poolCondition.notify()
+            raise
+
+    def _release(self, channel):
+        with self._poolCondition:
+            if channel is not None and channel.persistent:
+                self._idle.append(channel)
+            else:
+                self._open -= 1
+                if channel is not None:
+                    channel.close()
+            self._poolCondition.notify()
+
+
+'''
+    pyowfs-compatible directory node.  OneWireNeo recognises directories by class name, so it must stay 'Dir'.
+'''
+class Dir(object):
+    def __init__(self, path, capi):
+        self._path = path
+        self.capi = capi
+
+    path = property(lambda self: self._path)
+
+    def __repr__(self):
+        return "<Dir %r>" % self._path
+
+    def iter_entries(self, cached=True):
+        entries = self.capi.get(self.path, cached=cached)
+        if entries:
+            for e in entries.split(','):
+                if not _SENSOR_ENTRY.match(e):
+                    if e.endswith('/'):
+                        yield Dir(self.path + e, self.capi)
+                    else:
+                        yield e
+
+
+class Sensor(Dir):
+    def __repr__(self):
+        return "<Sensor %s>" % self._path
+
+    def iter_sensors(self, cached=True):
+        sensors = self.capi.get(self.path, cached=cached)
+        if sensors:
+            for e in sensors.split(','):
+                if _SENSOR_ENTRY.match(e):
+                    yield Sensor("%s%s" % (self.path, e), self.capi)
+
+
+'''
+    Root node for an owserver, usable wherever OneWireNeo expects a pyowfs Connection
+'''
+class OwserverConnection(Sensor):
+    def __init__(self, address='localhost:4304', client=None, **clientOptions):
+        Sensor.__init__(self, '/', client if client is not None else OwserverClient(address, **clientOptions))
+
+    def __repr__(self):
+        return "<OwserverConnection %s>" % self.capi.address
+
+    def finish(self):
+        self.capi.close()
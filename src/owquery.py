@@ -0,0 +1,251 @@
+__author__ = 'sdavidson'
+
+import threading
+import time
+import numpy
+
+'''
+    Vectorized queries over numeric readings.  OneWireNeoReadings keeps one row per (sensor id, property name) in
+    NumPy arrays: the current value and read time of every numeric property, its feature and sensor id, and a ring
+    buffer of the last capacity samples.  OneWireNeo.startQueries() feeds it from every read.
+
+    select() filters rows by feature, family code, sensor id prefix or property name with array masks and returns a
+    OneWireNeoQuery over the current values; window() turns that into the samples of the last few seconds.  Both
+    aggregate with NumPy rather than looping over properties in Python.
+
+        readings = neo.startQueries()
+        readings.select(feature=FEATURES.Temperature, prefix='28.0000').window(3600).mean()
+        readings.select(feature=FEATURES.Voltage).outside(4.5, 5.5)
+
+    NaN stands for a property which is unread or missing; aggregations ignore it and return None when nothing is
+    left.
+'''
+
+DEFAULT_CAPACITY = 360
+
+'''
+    Rows allocated up front; the arrays double when they fill up
+'''
+INITIAL_ROWS = 256
+
+_NO_FEATURE = -1
+
+
+class OneWireNeoReadings(object):
+    def __init__(self, capacity=DEFAULT_CAPACITY, initialRows=INITIAL_ROWS):
+        self._lock = threading.Lock()
+        self._capacity = capacity
+        self._rows = dict()
+        self._keys = list()
+        self._size = 0
+        self._values = self._timestamps = self._features = self._sensorIds = self._families = self._names = None
+        self._heads = self._history = self._historyTimes = None
+        self._allocate(max(initialRows, 1))
+
+    capacity = property(lambda self: self._capacity)
+
+    def __len__(self):
+        return self._size
+
+    '''
+        Record one reading; value None (or anything not numeric) marks the property unread or missing and is kept
+        out of the history
+    '''
+    def update(self, sensorId, name, feature, timestamp, value):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            value = None
+        with self._lock:
+            row = self._rows.get((sensorId, name))
+            if row is None:
+                row = self._addRow(sensorId, name, feature)
+            if value is None:
+                self._values[row] = numpy.nan
+                return
+            self._values[row] = value
+            self._timestamps[row] = timestamp
+            head = self._heads[row]
+            self._history[row, head] = value
+            self._historyTimes[row, head] = timestamp
+            self._heads[row] = (head + 1) % self._capacity
+
+    '''
+        Rows matching every given filter: feature (a FEATURES value), family code, sensor id prefix and property
+        name
+    '''
+    def select(self, feature=None, family=None, prefix=None, name=None):
+        with self._lock:
+            size = self._size
+            mask = numpy.ones(size, dtype=bool)
+            if feature is not None:
+                mask &= self._features[:size] == feature.Value
+            if family is not None:
+                mask &= self._families[:size] == family.upper()
+            if prefix is not None:
+                mask &= numpy.char.startswith(self._sensorIds[:size], prefix)
+            if name is not None:
+                mask &= self._names[:size] == name
+            rows = numpy.flatnonzero(mask)
+            keys = [self._keys[row] for row in rows]
+            return OneWireNeoQuery(self, rows, keys, self._values[rows], self._timestamps[rows])
+
+    '''
+        Samples of the given rows read between start and end, NaN elsewhere
+    '''
+    def _samples(self, rows, start, end):
+        with self._lock:
+            times = self._historyTimes[rows]
+            history = self._history[rows]
+        with numpy.errstate(invalid='ignore'):
+            inside = (times >= start) & (times <= end)
+        return numpy.where(inside, history, numpy.nan)
+
+    def _addRow(self, sensorId, name, feature):
+        if self._size == len(self._values):
+            self._allocate(2 * self._size)
+        row = self._size
+        self._size += 1
+        self._rows[(sensorId, name)] = row
+        self._keys.append((sensorId, name))
+        self._sensorIds[row] = sensorId
+        self._families[row] = sensorId[:2].upper()
+        self._names[row] = name
+        self._features[row] = feature.Value if feature is not None else _NO_FEATURE
+        return row
+
+    def _allocate(self, rows):
+        capacity = self._capacity
+        self._values = self._grow(self._values, rows, numpy.float64, numpy.nan)
+        self._timestamps = self._grow(self._timestamps, rows, numpy.float64, numpy.nan)
+        self._features = self._grow(self._features, rows, numpy.int16, _NO_FEATURE)
+        self._sensorIds = self._grow(self._sensorIds, rows, 'S64', '')
+        self._families = self._grow(self._families, rows, 'S2', '')
+        self._names = self._grow(self._names, rows, object, None)
+        self._heads = self._grow(self._heads, rows, numpy.int32, 0)
+        self._history = self._grow(self._history, (rows, capacity), numpy.float64, numpy.nan)
+        self._historyTimes = self._grow(self._historyTimes, (rows, capacity), numpy.float64, numpy.nan)
+
+    '''
+        New array of the given shape holding the rows in use of old, the rest set to fill
+    '''
+    def _grow(self, old, shape, dtype, fill):
+        new = numpy.empty(shape, dtype=dtype)
+        new.fill(fill)
+        if old is not None:
+            new[:self._size] = old[:self._size]
+        return new
+
+
+'''
+    Readings selected by OneWireNeoReadings.select().  keys lists (sensor id, property name) in row order; values
+    and timestamps are the matching arrays, frozen at the time of the call.
+'''
+class OneWireNeoQuery(object):
+    def __init__(self, readings, rows, keys, values, timestamps):
+        self._readings = readings
+        self._rows = rows
+        self._keys = keys
+        self._values = values
+        self._timestamps = timestamps
+
+    keys = property(lambda self: list(self._keys))
+    values = property(lambda self: self._values)
+    timestamps = property(lambda self: self._timestamps)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def count(self):
+        return int(numpy.count_nonzero(~numpy.isnan(self._values)))
+
+    def min(self):
+        return _aggregate(self._values, numpy.min)
+
+    def max(self):
+        return _aggregate(self._values, numpy.max)
+
+    def mean(self):
+        return _aggregate(self._values, numpy.mean)
+
+    def percentile(self, q):
+        return _aggregate(self._values, lambda finite: numpy.percentile(finite, q))
+
+    '''
+        Boolean array marking current values below low or above high (either bound may be None)
+    '''
+    def mask(self, low=None, high=None):
+        return _outside(self._values, low, high)
+
+    '''
+        (sensor id, property name, value) of every current value below low or above high
+    '''
+    def outside(self, low=None, high=None):
+        return [self._keys[row] + (float(self._values[row]),) for row in numpy.flatnonzero(self.mask(low, high))]
+
+    '''
+        Samples read during the last seconds (up to now, the current time by default)
+    '''
+    def window(self, seconds, now=None):
+        now = time.time() if now is None else now
+        return OneWireNeoWindow(self._keys, self._readings._samples(self._rows, now - seconds, now))
+
+
+'''
+    Samples of a OneWireNeoQuery inside a time window, one row per property; aggregations run over every sample, or
+    per property with the row* methods
+'''
+class OneWireNeoWindow(object):
+    def __init__(self, keys, samples):
+        self._keys = keys
+        self._samples = samples
+
+    keys = property(lambda self: list(self._keys))
+    samples = property(lambda self: self._samples)
+
+    def count(self):
+        return int(numpy.count_nonzero(~numpy.isnan(self._samples)))
+
+    def min(self):
+        return _aggregate(self._samples, numpy.min)
+
+    def max(self):
+        return _aggregate(self._samples, numpy.max)
+
+    def mean(self):
+        return _aggregate(self._samples, numpy.mean)
+
+    def percentile(self, q):
+        return _aggregate(self._samples, lambda finite: numpy.percentile(finite, q))
+
+    '''
+        Mean of each property's samples, NaN for properties without any
+    '''
+    def rowMeans(self):
+        counts = numpy.count_nonzero(~numpy.isnan(self._samples), axis=1)
+        sums = numpy.where(numpy.isnan(self._samples), 0.0, self._samples).sum(axis=1)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            return numpy.where(counts > 0, sums / counts, numpy.nan)
+
+    '''
+        (sensor id, property name) of every property with a sample below low or above high
+    '''
+    def outside(self, low=None, high=None):
+        rows = numpy.flatnonzero(_outside(self._samples, low, high).any(axis=1))
+        return [self._keys[row] for row in rows]
+
+
+def _aggregate(values, function):
+    finite = values[~numpy.isnan(values)]
+    if not finite.size:
+        return None
+    return float(function(finite))
+
+def _outside(values, low, high):
+    mask = numpy.zeros(values.shape, dtype=bool)
+    with numpy.errstate(invalid='ignore'):
+        if low is not None:
+            mask |= values < low
+        if high is not None:
+            mask |= values > high
+    return mask
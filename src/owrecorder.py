@@ -0,0 +1,353 @@
+__author__ = 'sdavidson'
+
+import mmap
+import os
+import re
+import struct
+import threading
+from array import array
+from bisect import bisect_left
+from collections import deque
+
+'''
+    Append-only on-disk log of property readings.
+
+    A log directory holds a property dictionary (properties.tsv: one 'id<TAB>sensor id<TAB>property name' line per
+    property, appended as properties are first seen) and numbered segment files.  Each segment starts with a small
+    header followed by fixed-width records of (property id, status, timestamp, value); segments rotate once they
+    reach segmentSize bytes.  Records are appended in arrival order, which is not strictly timestamp order (reads
+    on first access, clock steps).
+
+    Next to each segment an index file lists its records in blocks of blockRecords: the first record and count of
+    each block, the lowest and highest timestamp in it, and the sorted ids of the properties it holds.  Readers only
+    unpack the blocks which hold the property asked for and overlap the time range; records not indexed yet (the
+    block being filled, or a segment whose recorder stopped without closing) are scanned in full.
+
+    OneWireNeoRecorder.record() only appends to an in-memory queue; a writer thread packs queued readings and writes
+    them in batches, so recording never blocks the refresh loop.  If the writer falls more than maxPending readings
+    behind, new readings are dropped and counted rather than queued without bound.
+'''
+
+MAGIC = 'OWNL'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHH8x')
+RECORD = struct.Struct('<IB3xdd')
+PROPERTIES_FILE = 'properties.tsv'
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+
+INDEX_MAGIC = 'OWNI'
+'''
+    Index entry: first record, record count, lowest and highest timestamp, number of property ids following it
+'''
+BLOCK = struct.Struct('<IIddI')
+BLOCK_RECORDS = 512
+
+_SEGMENT_NAME = re.compile('^segment-(\d{8})\.owlog$')
+
+
+def segmentName(number):
+    return 'segment-%08d.owlog' % number
+
+def indexName(number):
+    return 'segment-%08d.owidx' % number
+
+'''
+    Segment numbers present in directory, ascending
+'''
+def listSegments(directory):
+    numbers = list()
+    for name in os.listdir(directory):
+        match = _SEGMENT_NAME.match(name)
+        if match:
+            numbers.append(int(match.group(1)))
+    return sorted(numbers)
+
+'''
+    Property dictionary of a log directory as {id: (sensorId, name)}
+'''
+def loadProperties(directory):
+    properties = dict()
+    path = os.path.join(directory, PROPERTIES_FILE)
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                parts = line.rstrip('\n').split('\t')
+                if len(parts) == 3:
+                    properties[int(parts[0])] = (parts[1], parts[2])
+    return properties
+
+
+class OneWireNeoRecorder(object):
+    def __init__(self, directory, segmentSize=DEFAULT_SEGMENT_SIZE, flushInterval=0.25, maxPending=1000000,
+                 blockRecords=BLOCK_RECORDS):
+        if segmentSize < HEADER.size + RECORD.size:
+            raise ValueError('Segment size must hold at least one record')
+        if blockRecords < 1:
+            raise ValueError('Index blocks must hold at least one record')
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._directory = directory
+        self._segmentSize = segmentSize
+        self._flushInterval = flushInterval
+        self._maxPending = maxPending
+        self._pending = deque()
+        self._ids = dict([(key, propertyId) for propertyId, key in loadProperties(directory).items()])
+        self._propertiesFile = open(os.path.join(directory, PROPERTIES_FILE), 'a')
+        segments = listSegments(directory)
+        self._segmentNumber = segments[-1] if segments else 0
+        self._segment = None
+        self._segmentBytes = 0
+        self._index = None
+        self._blockRecords = blockRecords
+        self._block = None
+        self._written = 0
+        self._dropped = 0
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._writer = threading.Thread(target=self._writeLoop, name='OneWireNeo recorder')
+        self._writer.daemon = True
+        self._writer.start()
+
+    directory = property(lambda self: self._directory)
+    segmentSize = property(lambda self: self._segmentSize)
+    written = property(lambda self: self._written)
+    dropped = property(lambda self: self._dropped)
+    pending = property(lambda self: len(self._pending))
+
+    '''
+        Queue one reading; never blocks.  value must be numeric or None (stored as NaN); status is a small int.
+    '''
+    def record(self, sensorId, name, timestamp, value, status):
+        if len(self._pending) >= self._maxPending:
+            self._dropped += 1
+            return
+        self._pending.append((sensorId, name, timestamp, value, status))
+
+    '''
+        Wait until everything queued so far is on disk.  A marker queued behind the readings is set by the writer
+        once the readings before it have been written, so the queue running empty is not taken for completion.
+    '''
+    def flush(self):
+        if not self._writer.is_alive():
+            return
+        done = threading.Event()
+        self._pending.append(done)
+        self._wake.set()
+        while not done.wait(self._flushInterval):
+            if not self._writer.is_alive():
+                break
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        self._writer.join()
+        self._drain()
+        self._closeSegment()
+        self._propertiesFile.close()
+
+    def _writeLoop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self._flushInterval)
+            self._wake.clear()
+            self._drain()
+
+    def _drain(self):
+        pending = self._pending
+        records = list()
+        newProperties = list()
+        nan = float('nan')
+        while pending:
+            item = pending.popleft()
+            if not isinstance(item, tuple):
+                # a flush() marker
+                self._write(records, newProperties)
+                records, newProperties = list(), list()
+                item.set()
+                continue
+            sensorId, name, timestamp, value, status = item
+            key = (sensorId, name)
+            propertyId = self._ids.get(key)
+            if propertyId is None:
+                propertyId = self._ids[key] = len(self._ids)
+                newProperties.append('%d\t%s\t%s\n' % (propertyId, sensorId, name))
+            records.append((propertyId, timestamp,
+                            RECORD.pack(propertyId, status, timestamp, nan if value is None else value)))
+        self._write(records, newProperties)
+
+    def _write(self, records, newProperties):
+        if newProperties:
+            # ids must be on disk before any record that uses them
+            self._propertiesFile.write(''.join(newProperties))
+            self._propertiesFile.flush()
+        entries = list()
+        position = 0
+        while position < len(records):
+            if self._segment is None or self._segmentBytes + RECORD.size > self._segmentSize:
+                self._writeIndex(entries)
+                entries = list()
+                self._rotate()
+            block = self._block
+            count = min(max((self._segmentSize - self._segmentBytes) // RECORD.size, 1),
+                        self._blockRecords - block[1], len(records) - position)
+            batch = records[position:position + count]
+            position += count
+            self._segment.write(''.join([record[2] for record in batch]))
+            self._segmentBytes += count * RECORD.size
+            self._written += count
+            block[1] += count
+            timestamps = [record[1] for record in batch]
+            block[2] = min(block[2], min(timestamps))
+            block[3] = max(block[3], max(timestamps))
+            block[4].update([record[0] for record in batch])
+            if block[1] == self._blockRecords:
+                entries.append(self._endBlock())
+        if self._segment is not None:
+            self._segment.flush()
+        # index entries only ever describe records already on disk
+        self._writeIndex(entries)
+
+    def _rotate(self):
+        self._closeSegment()
+        self._segmentNumber += 1
+        self._segment = open(os.path.join(self._directory, segmentName(self._segmentNumber)), 'wb')
+        self._segment.write(HEADER.pack(MAGIC, FORMAT_VERSION, RECORD.size))
+        self._segmentBytes = HEADER.size
+        self._index = open(os.path.join(self._directory, indexName(self._segmentNumber)), 'wb')
+        self._index.write(HEADER.pack(INDEX_MAGIC, FORMAT_VERSION, BLOCK.size))
+        self._index.flush()
+        self._block = [0, 0, float('inf'), float('-inf'), set()]
+
+    def _closeSegment(self):
+        if self._segment is None:
+            return
+        self._segment.flush()
+        self._writeIndex([self._endBlock()] if self._block[1] else list())
+        self._segment.close()
+        self._index.close()
+        self._segment = self._index = None
+
+    '''
+        Index entry for the block being filled; a new block starts behind it
+    '''
+    def _endBlock(self):
+        first, count, low, high, ids = self._block
+        self._block = [first + count, 0, float('inf'), float('-inf'), set()]
+        ids = array('I', sorted(ids))
+        return BLOCK.pack(first, count, low, high, len(ids)) + ids.tostring()
+
+    def _writeIndex(self, entries):
+        if entries:
+            self._segment.flush()
+            self._index.write(''.join(entries))
+            self._index.flush()
+
+
+'''
+    Reads a log directory written by OneWireNeoRecorder; safe to use while the recorder is still writing.  Segments
+    are memory mapped, and their indexes say which blocks of records a query has to unpack.  Indexes are loaded
+    once and extended as the recorder appends to them.
+'''
+class OneWireNeoLogReader(object):
+    def __init__(self, directory):
+        self._directory = directory
+        self._properties = dict()
+        self._ids = dict()
+        self._indexes = dict()
+        self._scanned = 0
+        self.reload()
+
+    directory = property(lambda self: self._directory)
+
+    '''
+        Pick up properties and segments added since the reader was created
+    '''
+    def reload(self):
+        self._properties = loadProperties(self._directory)
+        self._ids = dict([(key, propertyId) for propertyId, key in self._properties.items()])
+
+    def properties(self):
+        return sorted(self._ids)
+
+    def segments(self):
+        return listSegments(self._directory)
+
+    '''
+        Readings of one property with start <= timestamp <= end (either bound may be None), as parallel arrays:
+        timestamps and values as array('d'), statuses as array('B')
+    '''
+    def read(self, sensorId, name, start=None, end=None):
+        timestamps, values, statuses = array('d'), array('d'), array('B')
+        propertyId = self._ids.get((sensorId, name))
+        if propertyId is None:
+            self.reload()
+            propertyId = self._ids.get((sensorId, name))
+            if propertyId is None:
+                return timestamps, values, statuses
+        for number in self.segments():
+            self._readSegment(number, propertyId, start, end, timestamps, values, statuses)
+        return timestamps, values, statuses
+
+    def _readSegment(self, number, propertyId, start, end, timestamps, values, statuses):
+        # the index first: every block it lists is on disk by the time the segment size is taken
+        blocks = self._loadIndex(number)
+        with open(os.path.join(self._directory, segmentName(number)), 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            count = (size - HEADER.size) // RECORD.size
+            if count <= 0:
+                return
+            data = mmap.mmap(f.fileno(), HEADER.size + count * RECORD.size, access=mmap.ACCESS_READ)
+            try:
+                magic, version, recordSize = HEADER.unpack_from(data, 0)
+                if magic != MAGIC or recordSize != RECORD.size:
+                    raise ValueError('%s is not a reading log segment' % segmentName(number))
+                indexed = 0
+                for first, blockCount, low, high, ids in blocks:
+                    indexed = first + blockCount
+                    if (start is not None and high < start) or (end is not None and low > end):
+                        continue
+                    position = bisect_left(ids, propertyId)
+                    if position < len(ids) and ids[position] == propertyId:
+                        self._scan(data, first, min(indexed, count), propertyId, start, end, timestamps, values,
+                                   statuses)
+                self._scan(data, indexed, count, propertyId, start, end, timestamps, values, statuses)
+            finally:
+                data.close()
+
+    '''
+        Append the records of propertyId within [start, end] among records first..last-1; records are not assumed
+        to be in timestamp order
+    '''
+    def _scan(self, data, first, last, propertyId, start, end, timestamps, values, statuses):
+        unpack = RECORD.unpack_from
+        for index in xrange(first, last):
+            recordId, status, timestamp, value = unpack(data, HEADER.size + index * RECORD.size)
+            if recordId == propertyId and (start is None or timestamp >= start) and (end is None or timestamp <= end):
+                timestamps.append(timestamp)
+                values.append(value)
+                statuses.append(status)
+        self._scanned += max(last - first, 0)
+
+    '''
+        Index blocks of a segment as (first record, count, lowest timestamp, highest timestamp, sorted ids), read on
+        from where the last call stopped; a trailing entry still being written is left for the next call
+    '''
+    def _loadIndex(self, number):
+        offset, blocks = self._indexes.get(number, (HEADER.size, list()))
+        path = os.path.join(self._directory, indexName(number))
+        if not os.path.exists(path):
+            return blocks
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        position = 0
+        while position + BLOCK.size <= len(data):
+            first, count, low, high, idCount = BLOCK.unpack_from(data, position)
+            end = position + BLOCK.size + 4 * idCount
+            if end > len(data):
+                break
+            ids = array('I')
+            ids.fromstring(data[position + BLOCK.size:end])
+            blocks.append((first, count, low, high, ids))
+            position = end
+        self._indexes[number] = (offset + position, blocks)
+        return blocks
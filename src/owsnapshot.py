@@ -0,0 +1,240 @@
+__author__ = 'sdavidson'
+
+import json
+import math
+import threading
+import time
+from array import array
+
+'''
+    Incrementally maintained, immutable snapshots of every sensor and property, in row (dict / JSON) and columnar
+    form.  OneWireNeo feeds each property update into a OneWireNeoSnapshotStore, which keeps one row per
+    (sensor id, property name) at a fixed position.  Rows are grouped into fixed-size chunks; a snapshot is a list of
+    immutable chunks, and taking one rebuilds only the chunks that changed since the previous snapshot and shares
+    the rest, so its cost follows the number of changes rather than the size of the bus.
+
+    Only a change of value, status or kind marks a row changed; a read which finds the value as it was (Stable twice
+    running) leaves its chunk alone.  Read times change on every read, so they are kept apart from the chunks in one
+    array('d') which each snapshot copies whole, a single memory copy rather than a rebuild.
+
+    Statuses and kinds are kept as their enum names and timestamps as epoch seconds (NaN before the first read).
+'''
+
+COLUMNS = ('sensorId', 'name', 'value', 'status', 'timestamp', 'kind')
+
+'''
+    Columns held in chunks, in chunk column order; timestamps are held by the snapshot
+'''
+_CHUNK_COLUMNS = ('sensorId', 'name', 'value', 'status', 'kind')
+
+'''
+    Rows per chunk
+'''
+CHUNK_SIZE = 256
+
+
+'''
+    One immutable block of rows: a tuple per column of _CHUNK_COLUMNS plus the version each row was last changed at
+'''
+class OneWireNeoSnapshotChunk(object):
+    __slots__ = ('columns', 'versions', 'version')
+
+    def __init__(self, columns, versions):
+        self.columns = columns
+        self.versions = versions
+        self.version = max(versions) if versions else 0
+
+
+class OneWireNeoSnapshot(object):
+    def __init__(self, version, createdAt, chunks, timestamps, sensors, index):
+        self._version = version
+        self._createdAt = createdAt
+        self._chunks = tuple(chunks)
+        self._timestamps = timestamps
+        self._sensors = sensors
+        self._index = index
+        self._length = sum([len(chunk.versions) for chunk in self._chunks])
+        self._columnCache = dict()
+
+    version = property(lambda self: self._version)
+    createdAt = property(lambda self: self._createdAt)
+    chunks = property(lambda self: self._chunks)
+
+    def __len__(self):
+        return self._length
+
+    '''
+        Sensor statuses by sensor id
+    '''
+    def sensors(self):
+        return dict(self._sensors)
+
+    '''
+        One column, in row order, e.g. column('value')
+    '''
+    def column(self, name):
+        cached = self._columnCache.get(name)
+        if cached is None:
+            if name == 'timestamp':
+                cached = tuple(self._timestamps)
+            else:
+                position = _CHUNK_COLUMNS.index(name)
+                cached = list()
+                for chunk in self._chunks:
+                    cached.extend(chunk.columns[position])
+            cached = self._columnCache[name] = tuple(cached)
+        return cached
+
+    '''
+        Columnar form: parallel tuples keyed by column name
+    '''
+    def columns(self):
+        return dict([(name, self.column(name)) for name in COLUMNS])
+
+    '''
+        Row for one property as a dict, or None if the snapshot does not hold it
+    '''
+    def get(self, sensorId, name):
+        row = self._index.get((sensorId, name))
+        if row is None or row >= self._length:
+            return None
+        return self._row(row)
+
+    '''
+        Rows changed after the given snapshot (or version number), oldest position first.  Only chunks which
+        changed are visited.
+    '''
+    def changedSince(self, previous):
+        version = previous.version if isinstance(previous, OneWireNeoSnapshot) else previous
+        rows = list()
+        for chunkIndex, chunk in enumerate(self._chunks):
+            if chunk.version > version:
+                for offset, rowVersion in enumerate(chunk.versions):
+                    if rowVersion > version:
+                        rows.append(self._row(chunkIndex * CHUNK_SIZE + offset))
+        return rows
+
+    '''
+        Dict form: {sensorId: {'status': ..., 'properties': {name: {'value', 'status', 'timestamp', 'kind'}}}}
+    '''
+    def asDict(self):
+        retval = dict()
+        for sensorId, status in self._sensors.items():
+            retval[sensorId] = {'status': status, 'properties': dict()}
+        timestamps = self._timestamps
+        for chunkIndex, chunk in enumerate(self._chunks):
+            sensorIds, names, values, statuses, kinds = chunk.columns
+            start = chunkIndex * CHUNK_SIZE
+            for offset in range(len(sensorIds)):
+                sensor = retval.get(sensorIds[offset])
+                if sensor is None:
+                    sensor = retval[sensorIds[offset]] = {'status': None, 'properties': dict()}
+                sensor['properties'][names[offset]] = {'value': values[offset], 'status': statuses[offset],
+                                                       'timestamp': _timestamp(timestamps[start + offset]),
+                                                       'kind': kinds[offset]}
+        return retval
+
+    '''
+        JSON form of asDict(); binary values (str or memoryview memory pages) are hex encoded
+    '''
+    def toJson(self, **options):
+        data = self.asDict()
+        for sensor in data.values():
+            for prop in sensor['properties'].values():
+                if prop['kind'] == 'Binary' and prop['value'] is not None:
+                    value = prop['value']
+                    prop['value'] = (value.tobytes() if isinstance(value, memoryview) else str(value)).encode('hex')
+        return json.dumps({'version': self._version, 'createdAt': self._createdAt, 'sensors': data}, **options)
+
+    def _row(self, row):
+        chunk, offset = self._chunks[row // CHUNK_SIZE], row % CHUNK_SIZE
+        retval = dict([(name, chunk.columns[i][offset]) for i, name in enumerate(_CHUNK_COLUMNS)])
+        retval['timestamp'] = _timestamp(self._timestamps[row])
+        return retval
+
+
+class OneWireNeoSnapshotStore(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = dict()
+        self._columns = tuple([list() for name in _CHUNK_COLUMNS])
+        self._timestamps = array('d')
+        self._timestampsChanged = False
+        self._versions = array('L')
+        self._sensors = dict()
+        self._sensorsChanged = False
+        self._dirtyChunks = set()
+        self._version = 0
+        self._last = None
+
+    version = property(lambda self: self._version)
+
+    def __len__(self):
+        return len(self._versions)
+
+    '''
+        Record one read.  The row is marked changed only when value, status or kind differ from what it holds.
+    '''
+    def update(self, sensorId, name, value, status, timestamp, kind):
+        timestamp = float('nan') if timestamp is None else timestamp
+        with self._lock:
+            row = self._index.get((sensorId, name))
+            if row is None:
+                self._version += 1
+                row = len(self._versions)
+                self._index[(sensorId, name)] = row
+                for column, item in zip(self._columns, (sensorId, name, value, status, kind)):
+                    column.append(item)
+                self._timestamps.append(timestamp)
+                self._versions.append(self._version)
+            else:
+                self._timestamps[row] = timestamp
+                self._timestampsChanged = True
+                values, statuses, kinds = self._columns[2:]
+                previous = values[row]
+                if (value is previous or value == previous) and status == statuses[row] and kind == kinds[row]:
+                    return
+                self._version += 1
+                values[row] = value
+                statuses[row] = status
+                kinds[row] = kind
+                self._versions[row] = self._version
+            self._dirtyChunks.add(row // CHUNK_SIZE)
+
+    def setSensor(self, sensorId, status):
+        with self._lock:
+            if self._sensors.get(sensorId) != status:
+                self._version += 1
+                self._sensors[sensorId] = status
+                self._sensorsChanged = True
+
+    '''
+        Immutable snapshot of the current state; the previous snapshot is returned as is when nothing was read
+        since.  A snapshot taken after reads which changed nothing but read times keeps the previous version and
+        shares all of its chunks.
+    '''
+    def snapshot(self):
+        with self._lock:
+            last = self._last
+            if last is not None and last.version == self._version and not self._timestampsChanged:
+                return last
+            chunks = list(last.chunks) if last is not None else list()
+            chunkCount = (len(self._versions) + CHUNK_SIZE - 1) // CHUNK_SIZE
+            while len(chunks) < chunkCount:
+                chunks.append(None)
+            for chunkIndex in self._dirtyChunks:
+                start, end = chunkIndex * CHUNK_SIZE, (chunkIndex + 1) * CHUNK_SIZE
+                columns = tuple([tuple(column[start:end]) for column in self._columns])
+                chunks[chunkIndex] = OneWireNeoSnapshotChunk(columns, tuple(self._versions[start:end]))
+            self._dirtyChunks = set()
+            self._timestampsChanged = False
+            sensors = last._sensors if last is not None and not self._sensorsChanged else dict(self._sensors)
+            self._sensorsChanged = False
+            # slicing an array copies its buffer in one go
+            self._last = OneWireNeoSnapshot(self._version, time.time(), chunks, self._timestamps[:], sensors,
+                                            self._index)
+            return self._last
+
+
+def _timestamp(value):
+    return None if math.isnan(value) else value
@@ -0,0 +1,168 @@
+__author__ = 'sdavidson'
+
+import threading
+from bisect import bisect_left
+from timeit import default_timer
+
+'''
+    In-process instrumentation for OneWireNeo: latency histograms for each timed operation, per-sensor latency,
+    and event counters.  Hooks registered with addHook() see every timing and counter update as it happens.
+
+    Timings recorded by OneWireNeo:
+        read        one capi.get call (connections without batch reads)
+        readBatch   one pipelined getMany call
+        dirWalk     directory walk of one sensor
+        sensor      full update of one sensor (also kept per sensor id)
+        refresh     one refresh() cycle
+        conversion  one simultaneous temperature conversion, including the wait
+        alarmSearch one search of the alarm directory in alarm-driven mode
+        write       one property write (also counted in writes or writeFailures)
+        discovery   one enumeration of the bus (devices and bus topology)
+
+    Counters: reads, readFailures, missingSensors, missingProperties, writes, writeFailures
+'''
+
+TIMINGS = ('read', 'readBatch', 'dirWalk', 'sensor', 'refresh', 'conversion', 'alarmSearch', 'write', 'discovery')
+COUNTERS = ('reads', 'readFailures', 'missingSensors', 'missingProperties', 'writes', 'writeFailures')
+
+'''
+    Upper bounds in seconds of the histogram buckets: 50us doubling up to ~105s, plus an overflow bucket
+'''
+BUCKET_BOUNDS = tuple([0.00005 * (2 ** i) for i in range(22)])
+
+'''
+    Clock used for all timings
+'''
+clock = default_timer
+
+
+class OneWireNeoLatencyHistogram(object):
+    def __init__(self, bounds=BUCKET_BOUNDS):
+        self._bounds = bounds
+        self._buckets = [0] * (len(bounds) + 1)
+        self._count = 0
+        self._total = 0.0
+        self._min = None
+        self._max = None
+
+    bounds = property(lambda self: self._bounds)
+    buckets = property(lambda self: tuple(self._buckets))
+    count = property(lambda self: self._count)
+    total = property(lambda self: self._total)
+    min = property(lambda self: self._min)
+    max = property(lambda self: self._max)
+    mean = property(lambda self: self._total / self._count if self._count else None)
+
+    def record(self, elapsed):
+        self._buckets[bisect_left(self._bounds, elapsed)] += 1
+        self._count += 1
+        self._total += elapsed
+        if self._min is None or elapsed < self._min:
+            self._min = elapsed
+        if self._max is None or elapsed > self._max:
+            self._max = elapsed
+
+    '''
+        Approximate percentile (0-100): the upper bound of the bucket holding it, capped at the observed maximum
+    '''
+    def percentile(self, percent):
+        if not self._count:
+            return None
+        rank = max(1, int(round(self._count * percent / 100.0)))
+        seen = 0
+        for index, bucketCount in enumerate(self._buckets):
+            seen += bucketCount
+            if seen >= rank:
+                if index < len(self._bounds):
+                    return min(self._bounds[index], self._max)
+                return self._max
+        return self._max
+
+    def __str__(self):
+        if not self._count:
+            return 'n=0'
+        return 'n=%d mean=%.6f min=%.6f p50=%.6f p99=%.6f max=%.6f' % (self._count, self.mean, self._min,
+                                                                         self.percentile(50), self.percentile(99),
+                                                                         self._max)
+
+
+class OneWireNeoStats(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hooks = tuple()
+        self.reset()
+
+    hooks = property(lambda self: self._hooks)
+
+    '''
+        hook(name, value, detail) is called for every timing (value in seconds) and counter update (value is the
+        increment); detail is the sensor id or path involved, if any.  Hooks run on the thread doing the work.
+    '''
+    def addHook(self, hook):
+        with self._lock:
+            self._hooks = self._hooks + (hook,)
+
+    def removeHook(self, hook):
+        with self._lock:
+            self._hooks = tuple([h for h in self._hooks if h is not hook])
+
+    def reset(self):
+        with self._lock:
+            self._histograms = dict([(name, OneWireNeoLatencyHistogram()) for name in TIMINGS])
+            self._sensorHistograms = dict()
+            self._counters = dict([(name, 0) for name in COUNTERS])
+
+    def record(self, name, elapsed, detail=None):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = OneWireNeoLatencyHistogram()
+            histogram.record(elapsed)
+            if name == 'sensor' and detail is not None:
+                sensorHistogram = self._sensorHistograms.get(detail)
+                if sensorHistogram is None:
+                    sensorHistogram = self._sensorHistograms[detail] = OneWireNeoLatencyHistogram()
+                sensorHistogram.record(elapsed)
+        for hook in self._hooks:
+            hook(name, elapsed, detail)
+
+    def increment(self, name, count=1, detail=None):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + count
+        for hook in self._hooks:
+            hook(name, count, detail)
+
+    def histogram(self, name):
+        return self._histograms.get(name)
+
+    def counter(self, name):
+        return self._counters.get(name, 0)
+
+    def sensorHistogram(self, sensorId):
+        return self._sensorHistograms.get(sensorId)
+
+    '''
+        Sensor ids with the highest mean update time, slowest first
+    '''
+    def slowestSensors(self, count=10):
+        with self._lock:
+            ranked = sorted(self._sensorHistograms.items(), key=lambda item: item[1].mean, reverse=True)
+        return [sensorId for sensorId, histogram in ranked[:count]]
+
+    def __str__(self):
+        lines = list()
+        for name in sorted(self._histograms):
+            lines.append('%-10s %s' % (name, self._histograms[name]))
+        for name in sorted(self._counters):
+            lines.append('%-18s %d' % (name, self._counters[name]))
+        return '\n'.join(lines)
+
+
+'''
+    Hook reproducing the old console tracing, for when it is wanted
+'''
+def printTraceHook(name, value, detail):
+    if name in COUNTERS:
+        print("%s +%d [%s]" % (name, value, detail))
+    else:
+        print("%s %.6fs [%s]" % (name, value, detail))
@@ -0,0 +1,171 @@
+__author__ = 'sdavidson'
+
+import gc
+import json
+import optparse
+import os
+import sys
+import types
+import onewireneo
+import owmock
+from onewireneo import FEATURES
+from owstats import OneWireNeoStats, clock
+
+'''
+    Benchmarks for OneWireNeo against synthetic buses built by owmock.buildSyntheticBus.
+
+    For each bus size the suite reports, with all features desired:
+        refresh     first (discovery) cycle and steady-state cycle time, bus reads per cycle
+        memory      deep size of the sensor model after discovery, in total and per property
+        attributes  getDesiredAttributes over every device's property list
+        str         OneWireNeo.__str__
+
+    Results can be saved as a baseline and later runs compared against it:
+
+        cd test
+        PYTHONPATH=../src python onewireneoBench.py --sizes 10,100,1000 --save benchBaseline.json
+        PYTHONPATH=../src python onewireneoBench.py --sizes 10,100,1000 --compare benchBaseline.json
+
+    Read counts must match the baseline exactly; times and memory may drift by up to --tolerance before they are
+    reported as regressions.  Timings are machine dependent, so compare against a baseline taken on the same host.
+'''
+
+DEFAULT_SIZES = (10, 100, 1000, 5000)
+
+'''
+    Types not counted by deepSizeOf: code, shared configuration and anything reachable only through callbacks
+'''
+_SHARED_TYPES = (types.ModuleType, types.FunctionType, types.MethodType, types.BuiltinFunctionType, type,
+                 types.ClassType, onewireneo.OneWireNeoSchemaCache, onewireneo.OneWireNeoPollSchedule,
+                 OneWireNeoStats, owmock.MockCapi)
+
+
+'''
+    Approximate retained size in bytes of obj and everything it references, counting shared objects once
+'''
+def deepSizeOf(obj, seen=None):
+    seen = seen if seen is not None else set()
+    pending = [obj]
+    total = 0
+    while pending:
+        item = pending.pop()
+        if id(item) in seen or isinstance(item, _SHARED_TYPES) or type(item).__name__ == 'EnumValue':
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            pending.extend(item.keys())
+            pending.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            pending.extend(item)
+        if hasattr(item, '__dict__'):
+            pending.append(item.__dict__)
+        for slot in getattr(type(item), '__slots__', ()):
+            if hasattr(item, slot):
+                pending.append(getattr(item, slot))
+    return total
+
+def timed(work, repeat=1):
+    best = None
+    for i in range(repeat):
+        start = clock()
+        work()
+        elapsed = clock() - start
+        best = elapsed if best is None or elapsed < best else best
+    return best
+
+'''
+    Run work with stdout discarded (OneWireNeo prints its first refresh cycle)
+'''
+def quietly(work):
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        return work()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+def runSize(size, latency=0.0, jitter=0.0, busCount=1, repeat=3, lazy=False):
+    capi = owmock.MockCapi(latency, jitter, seed=size)
+    conn = owmock.buildSyntheticBus(capi, size, busCount=busCount, seed=size)
+    features = set(FEATURES)
+    gc.collect()
+    start = clock()
+    neo = quietly(lambda: onewireneo.OneWireNeo(desiredFeatures=features, connection=conn, lazy=lazy))
+    firstCycle = clock() - start
+    firstReads = capi.reads
+    try:
+        capi.resetCounters()
+        cycle = quietly(lambda: timed(lambda: neo.refresh(force=True), repeat))
+        cycleReads = capi.reads // repeat
+        memory = deepSizeOf(neo.sensors)
+        properties = sum([len(sensor._properties) for sensor in neo.sensors])
+        attributeLists = [capi.getDevice(sensorId).keys() for sensorId in capi.devices]
+        attributes = timed(lambda: [onewireneo.getDesiredAttributes(a, features) for a in attributeLists], repeat)
+        text = timed(lambda: str(neo), repeat)
+    finally:
+        neo.close()
+    return {'devices': size, 'sensors': len(neo.sensors), 'firstCycle': firstCycle, 'firstReads': firstReads,
+            'cycle': cycle, 'cycleReads': cycleReads, 'memory': memory, 'properties': properties,
+            'attributes': attributes, 'str': text}
+
+def formatResult(result):
+    return ('%(devices)5d devices  first %(firstCycle)8.3fs/%(firstReads)7d reads  cycle %(cycle)8.3fs/'
+            '%(cycleReads)7d reads  memory %(memory)10d B (%(perProperty)4d B/property)  attributes %(attributes)7.4fs  '
+            'str %(str)7.4fs') % dict(result, perProperty=result['memory'] // max(result['properties'], 1))
+
+'''
+    Regressions of result against baseline as human readable strings; empty when there are none
+'''
+def compareResult(result, baseline, tolerance):
+    problems = list()
+    for key in ('firstReads', 'cycleReads', 'sensors'):
+        if result[key] != baseline[key]:
+            problems.append('%d devices: %s %d, baseline %d' % (result['devices'], key, result[key], baseline[key]))
+    for key in ('firstCycle', 'cycle', 'memory', 'attributes', 'str'):
+        if result[key] > baseline[key] * (1.0 + tolerance):
+            problems.append('%d devices: %s %.4f, baseline %.4f' % (result['devices'], key, result[key],
+                                                                    baseline[key]))
+    return problems
+
+def main(argv):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--sizes', default=','.join([str(s) for s in DEFAULT_SIZES]),
+                      help='comma separated bus sizes (default %default)')
+    parser.add_option('--latency', type='float', default=0.0, help='seconds per bus access (default %default)')
+    parser.add_option('--jitter', type='float', default=0.0, help='extra random seconds per access (default %default)')
+    parser.add_option('--buses', type='int', default=1, help='number of buses (default %default)')
+    parser.add_option('--repeat', type='int', default=3, help='runs per timing, best is kept (default %default)')
+    parser.add_option('--lazy', action='store_true', default=False,
+                      help='start in lazy mode, so the first cycle only discovers')
+    parser.add_option('--save', metavar='FILE', help='write results as a baseline')
+    parser.add_option('--compare', metavar='FILE', help='compare results against a baseline')
+    parser.add_option('--tolerance', type='float', default=0.25,
+                      help='allowed relative slowdown before a regression is reported (default %default)')
+    options, args = parser.parse_args(argv)
+
+    results = list()
+    for size in [int(s) for s in options.sizes.split(',')]:
+        result = runSize(size, options.latency, options.jitter, options.buses, options.repeat, options.lazy)
+        print(formatResult(result))
+        results.append(result)
+
+    if options.save:
+        with open(options.save, 'w') as f:
+            json.dump({'latency': options.latency, 'buses': options.buses, 'results': results}, f, indent=1,
+                      separators=(',', ': '), sort_keys=True)
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = dict([(r['devices'], r) for r in json.load(f)['results']])
+        problems = list()
+        for result in results:
+            if baseline.has_key(result['devices']):
+                problems.extend(compareResult(result, baseline[result['devices']], options.tolerance))
+        for problem in problems:
+            print('REGRESSION ' + problem)
+        return 1 if problems else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
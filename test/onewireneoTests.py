@@ -1,7 +1,50 @@
 __author__ = 'sdavidson'
+import Queue
+import StringIO
+import datetime
+import shutil
+import sys
+import tempfile
+import threading
+import time
 import unittest
 import onewireneo
-from onewireneo import FEATURES
+import owmock
+from onewireneo import EVENT_KIND, FEATURES, PROPERTY_STATUS, READ_POLICY, SENSOR_STATUS, SERVER_STATUS
+from owrecorder import OneWireNeoLogReader
+
+class BusTrackingCapi(owmock.MockCapi):
+    '''
+        Mock capi which records the highest number of reads in flight, overall and per bus
+    '''
+    def __init__(self, latency):
+        owmock.MockCapi.__init__(self, latency)
+        self._trackLock = threading.Lock()
+        self._inFlight = dict()
+        self.maxPerBus = dict()
+        self.maxOverall = 0
+
+    def get(self, path, cached=True):
+        parts = [part for part in path.split('/') if part]
+        bus = self.getBus(parts[0]) if parts else None
+        with self._trackLock:
+            self._inFlight[bus] = self._inFlight.get(bus, 0) + 1
+            self.maxPerBus[bus] = max(self.maxPerBus.get(bus, 0), self._inFlight[bus])
+            self.maxOverall = max(self.maxOverall, sum(self._inFlight.values()))
+        try:
+            return owmock.MockCapi.get(self, path, cached)
+        finally:
+            with self._trackLock:
+                self._inFlight[bus] -= 1
+
+
+class FailingCapi(owmock.MockCapi):
+    '''
+        Simulates an unreachable owserver
+    '''
+    def get(self, path, cached=True):
+        raise IOError('owserver unreachable')
+
 
 class OneWireNeoTests(unittest.TestCase):
     def testGetFamilyInfo(self):
@@ -217,6 +260,962 @@ class OneWireNeoTests(unittest.TestCase):
         check = onewireneo.isDesiredSensor(testSensor,set([FEATURES.Temperature]))
         assert(check);
 
+    def getThermometer(self, index, temperature='21.5'):
+        return {
+            'id': '28.0000000000%02X' % index,
+            'family': '28',
+            'type': 'DS18B20',
+            'power': '1',
+            'temperature': temperature
+        }
+
+    def buildBus(self, capi, busCount, sensorsPerBus):
+        index = 0
+        for bus in range(busCount):
+            for i in range(sensorsPerBus):
+                data = self.getThermometer(index, '%d.5' % index)
+                capi.addDevice(data['id'], data, 'bus.%d' % bus)
+                index += 1
+        return owmock.MockConnection(capi)
+
+    def testRefresh_readsEverySensorOnEveryBus(self):
+        conn = self.buildBus(owmock.MockCapi(), 3, 4)
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Temperature]), connection=conn)
+        try:
+            assert(len(neo.sensors) == 12)
+            for sensor in neo.sensors:
+                index = int(sensor.id[-2:], 16)
+                assert(sensor.getProperty('temperature').value == index + 0.5)
+                assert(sensor.status == SENSOR_STATUS.New)
+            neo.refresh()
+            for sensor in neo.sensors:
+                assert(sensor.status == SENSOR_STATUS.Available)
+        finally:
+            neo.close()
+
+    def testRefresh_serializesReadsPerBus(self):
+        capi = BusTrackingCapi(0.005)
+        conn = self.buildBus(capi, 2, 3)
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Temperature]), connection=conn, maxWorkers=4)
+        try:
+            assert(len(neo.sensors) == 6)
+            assert(capi.maxPerBus['bus.0'] == 1)
+            assert(capi.maxPerBus['bus.1'] == 1)
+            assert(capi.maxOverall >= 2)
+        finally:
+            neo.close()
+
+    def testRefresh_marksMissingSensors(self):
+        capi = owmock.MockCapi()
+        conn = self.buildBus(capi, 1, 2)
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Temperature]), connection=conn)
+        capi.removeDevice('28.000000000001')
+        neo.refresh()
+        statuses = dict([(sensor.id, sensor.status) for sensor in neo.sensors])
+        assert(statuses['28.000000000000'] == SENSOR_STATUS.Available)
+        assert(statuses['28.000000000001'] == SENSOR_STATUS.Missing)
+
+    def testGetBusTopology(self):
+        conn = self.buildBus(owmock.MockCapi(), 2, 2)
+        topology = onewireneo.getBusTopology(conn)
+        assert(len(topology) == 4)
+        assert(topology['/28.000000000000/'] == 'bus.0')
+        assert(topology['/28.000000000003/'] == 'bus.1')
+
+    def testScheduler_lanesPerBus(self):
+        conn = self.buildBus(owmock.MockCapi(), 2, 3)
+        sensors = list(conn.iter_sensors())
+        scheduler = onewireneo.OneWireNeoRefreshScheduler(maxWorkers=4, perBusConcurrency=2)
+        lanes = scheduler.buildLanes(sensors, onewireneo.getBusTopology(conn))
+        assert(len(lanes) == 4)
+        assert([len(lane) for lane in lanes] == [2, 1, 2, 1])
+
+    def testScheduler_rejectsEmptyPool(self):
+        self.assertRaises(onewireneo.OneWireNeoException, onewireneo.OneWireNeoRefreshScheduler, 0, 1)
+        self.assertRaises(onewireneo.OneWireNeoException, onewireneo.OneWireNeoRefreshScheduler, 1, 0)
+
+    def getDirectoryReads(self, capi, sensorId):
+        return [path for path in capi.readLog if path.startswith('/%s/' % sensorId) and path.endswith('/')]
+
+    def testSchemaCache_refreshDoesNotRewalk(self):
+        capi = owmock.MockCapi()
+        capi.addDevice('12.000012ED0000', self.getTestData_ds2406())
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Voltage]), connection=owmock.MockConnection(capi))
+        assert(len(self.getDirectoryReads(capi, '12.000012ED0000')) == 4)
+        capi.resetCounters()
+        neo.refresh()
+        assert(len(self.getDirectoryReads(capi, '12.000012ED0000')) == 0)
+        assert(len(neo.sensors[0].getProperty('T8A/volt.7').path) > 0)
+
+    def testSchemaCache_sharedByFamilyAndType(self):
+        capi = owmock.MockCapi()
+        for index in range(3):
+            data = self.getThermometer(index)
+            capi.addDevice(data['id'], data)
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Temperature]), connection=owmock.MockConnection(capi))
+        assert(len(self.getDirectoryReads(capi, '28.000000000000')) == 1)
+        assert(len(self.getDirectoryReads(capi, '28.000000000001')) == 0)
+        assert(len(self.getDirectoryReads(capi, '28.000000000002')) == 0)
+        assert(len(neo.schemaCache) == 3)
+        for sensor in neo.sensors:
+            assert(sensor.getProperty('temperature').value == 21.5)
+
+    def testSchemaCache_variableLayoutFamilyNotShared(self):
+        capi = owmock.MockCapi()
+        first = self.getTestData_ds2406()
+        second = dict(first)
+        second['id'] = '12.000012EE0000'
+        del second['TAI8570/pressure']
+        capi.addDevice(first['id'], first)
+        capi.addDevice(second['id'], second)
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Pressure]), connection=owmock.MockConnection(capi))
+        sensors = dict([(sensor.id, sensor) for sensor in neo.sensors])
+        assert(sensors['12.000012ED0000'].getProperty('TAI8570/pressure').value == 192.5)
+        self.assertRaises(onewireneo.OneWireNeoException, sensors['12.000012EE0000'].getProperty, 'TAI8570/pressure')
+
+    def testSchemaCache_invalidatedWhenDeviceReturns(self):
+        capi = owmock.MockCapi()
+        data = self.getThermometer(1)
+        capi.addDevice(data['id'], data)
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Temperature]), connection=owmock.MockConnection(capi))
+        capi.removeDevice(data['id'])
+        neo.refresh()
+        assert(len(neo.schemaCache) == 1)
+        capi.addDevice(data['id'], data)
+        neo.refresh()
+        assert(len(neo.schemaCache) == 1)
+        assert(neo.sensors[0].status == SENSOR_STATUS.Available)
+        capi.resetCounters()
+        neo.flushSchemaCache()
+        neo.refresh()
+        assert(len(self.getDirectoryReads(capi, data['id'])) == 1)
+
+    def getClassifierNames(self):
+        names = set(self.getAagTai8570_properties())
+        for data in (self.getTestData_ds18s20(), self.getTestData_ds2404(), self.getTestData_ds2405()):
+            names.update(data.keys())
+        names.update(['temperature9', 'temperature12', 'fasttemp', 'typeK/temperature', 'counters.A', 'counters.ALL',
+                      'counter', 'readonly/cycles', 'pages/count.3', 'pages/counters.ALL', 'volthours', 'vis', 'VAD',
+                      'vbias', '8bit/volt.A', 'volt2.all', 'S3-R1-A/current', 'S3-R1-A/illumination', 'current',
+                      'amphours', 'uvi/uvi', 'uvi/valid', 'co2/ppm', 'udate', 'readonly/clock', 'endcharge/udate',
+                      'PIO.BYTE', 'flipflop.A', 'flipflop.ALL', 'latch.ALL', 'branch', 'application', 'page.12',
+                      'HIH4000/humidity', 'HTM1735/humidity', 'B1-R1-A/pressure', 'MultiSensor/type', 'r_locator'])
+        return sorted(names)
+
+    def legacyFeatureForProperty(self, propName):
+        for key, value in onewireneo._finderMatchers.items():
+            for matcher in value:
+                if matcher.match(propName):
+                    return key
+        return None
+
+    def legacyDesiredAttributes(self, attributeList, desiredFeatures):
+        retval = set([attr for attr in onewireneo.IDENT_PROPERTIES if attr in attributeList])
+        for feature in desiredFeatures:
+            for attr in attributeList:
+                for matcher in onewireneo._finderMatchers[feature]:
+                    if matcher.match(attr):
+                        retval.add(attr)
+        return retval
+
+    def testClassifier_matchesPatternWalk(self):
+        names = self.getClassifierNames()
+        for name in names:
+            assert(onewireneo.findFeatureForProperty(name) == self.legacyFeatureForProperty(name)), name
+        classified = onewireneo.classifyAttributes(names)
+        for name in names:
+            assert(classified[name] == self.legacyFeatureForProperty(name)), name
+        for feature in FEATURES:
+            desired = [feature]
+            assert(set(onewireneo.getDesiredAttributes(names, desired)) == self.legacyDesiredAttributes(names, desired))
+        desired = [FEATURES.Temperature, FEATURES.Voltage, FEATURES.Current, FEATURES.Illumination]
+        assert(set(onewireneo.getDesiredAttributes(names, desired)) == self.legacyDesiredAttributes(names, desired))
+
+    def testClassifier_featuresForAmbiguousName(self):
+        classifier = onewireneo.OneWireNeoClassifier(onewireneo._SOURCE_PATTERNS)
+        # 'S3-R1-A/current' is only illumination; plain 'current' is only current
+        assert(classifier.features('S3-R1-A/current') == frozenset([FEATURES.Illumination]))
+        assert(classifier.classify('current') == FEATURES.Current)
+        assert(classifier.classify('crc8') is None)
+        assert(classifier.features('crc8') == frozenset())
+        grouped = classifier.groupAttributes(['temperature', 'pio.a', 'crc8'])
+        assert(grouped == {FEATURES.Temperature: ['temperature'], FEATURES.Pio: ['pio.a']})
+
+    def testClassifier_cacheIsBounded(self):
+        classifier = onewireneo.OneWireNeoClassifier(onewireneo._SOURCE_PATTERNS, cacheSize=8)
+        for index in range(20):
+            classifier.classify('pages/page.%d' % index)
+        assert(len(classifier._cache) <= 8)
+        assert(classifier.classify('pages/page.3') == FEATURES.Memory)
+
+    def getValueReads(self, capi):
+        return set([path for path in capi.readLog if not path.endswith('/')])
+
+    def testPollSchedule_lookupOrder(self):
+        schedule = onewireneo.OneWireNeoPollSchedule({FEATURES.Voltage: 5})
+        assert(schedule.intervalFor('28.000000000000', 'temperature', FEATURES.Temperature) == 10)
+        assert(schedule.intervalFor('28.000000000000', 'volt.A', FEATURES.Voltage) == 5)
+        assert(schedule.intervalFor('28.000000000000', 'sensed', FEATURES.Sense) == onewireneo.DEFAULT_POLL_INTERVAL)
+        assert(schedule.intervalFor('28.000000000000', 'type', None) == onewireneo.IDENT_POLL_INTERVAL)
+        schedule.setSensorInterval('28.000000000000', 2)
+        schedule.setPropertyInterval('28.000000000000', 'temperature', 1)
+        assert(schedule.intervalFor('28.000000000000', 'temperature', FEATURES.Temperature) == 1)
+        assert(schedule.intervalFor('28.000000000000', 'type', None) == 2)
+        assert(schedule.intervalFor('28.000000000001', 'temperature', FEATURES.Temperature) == 10)
+        schedule.clearOverrides('28.000000000000')
+        assert(schedule.intervalFor('28.000000000000', 'temperature', FEATURES.Temperature) == 10)
+
+    def testPollSchedule_adaptive(self):
+        schedule = onewireneo.OneWireNeoPollSchedule()
+        schedule.setAdaptive(FEATURES.Temperature, 2, 40)
+        schedule.setAdaptive(None, 5, 100, 3.0)
+        stable, changed = onewireneo.PROPERTY_STATUS.Stable, onewireneo.PROPERTY_STATUS.Increased
+        assert(schedule.intervalFor('28.000000000000', 'temperature', FEATURES.Temperature, 10, stable) == 20)
+        assert(schedule.intervalFor('28.000000000000', 'temperature', FEATURES.Temperature, 30, stable) == 40)
+        assert(schedule.intervalFor('28.000000000000', 'temperature', FEATURES.Temperature, 40, changed) == 2)
+        assert(schedule.intervalFor('28.000000000000', 'temperature', FEATURES.Temperature, 80) == 40)
+        assert(schedule.intervalFor('26.000000000000', 'VAD', FEATURES.Voltage, 10, stable) == 30)
+        assert(schedule.intervalFor('28.000000000000', 'type', None, 10, stable) == onewireneo.IDENT_POLL_INTERVAL)
+        schedule.setPropertyInterval('28.000000000000', 'temperature', 7)
+        assert(schedule.intervalFor('28.000000000000', 'temperature', FEATURES.Temperature, 10, stable) == 7)
+        self.assertRaises(onewireneo.OneWireNeoException, schedule.setAdaptive, None, 10, 5)
+        schedule.clearAdaptive()
+        assert(schedule.intervalFor('26.000000000000', 'VAD', FEATURES.Voltage, 10, stable) == 10)
+
+    def testAdaptivePolling_backsOffAndSpeedsUp(self):
+        capi = owmock.MockCapi()
+        capi.addDevice('28.000000000001', self.getThermometer(1, '20.0'))
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Temperature]), connection=owmock.MockConnection(capi))
+        try:
+            prop = neo.sensors[0].getProperty('temperature')
+            neo.setAdaptivePolling(2, 40, FEATURES.Temperature)
+            assert(prop.pollInterval == 10)
+            intervals = list()
+            for i in range(3):
+                neo.refresh(force=True)
+                intervals.append(prop.pollInterval)
+            assert(intervals == [20, 40, 40])
+            capi.setValue('28.000000000001', 'temperature', '20.5')
+            neo.refresh(force=True)
+            assert(prop.pollInterval == 2 and prop.pollRate == 0.5)
+            neo.clearAdaptivePolling()
+            assert(prop.pollInterval == 10)
+        finally:
+            neo.close()
+
+    def testRefresh_readsOnlyDueProperties(self):
+        capi = owmock.MockCapi()
+        capi.addDevice('04.147A0A020800', self.getTestData_ds2404())
+        schedule = onewireneo.OneWireNeoPollSchedule({FEATURES.Counter: 0})
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Memory, FEATURES.Counter]),
+                                    connection=owmock.MockConnection(capi), pollSchedule=schedule)
+        sensor = neo.sensors[0]
+        assert(sensor.getProperty('cycle').pollInterval == 0)
+        assert(sensor.getProperty('pages/page.0').pollInterval == 3600)
+        capi.resetCounters()
+        neo.refresh()
+        assert(self.getValueReads(capi) == set(['/04.147A0A020800/cycle']))
+        capi.resetCounters()
+        neo.refresh(force=True)
+        assert(len(self.getValueReads(capi)) == 19)
+
+    def testSetPollInterval_reschedulesKnownProperties(self):
+        capi = owmock.MockCapi()
+        capi.addDevice('04.147A0A020800', self.getTestData_ds2404())
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Clock]), connection=owmock.MockConnection(capi))
+        capi.resetCounters()
+        neo.refresh()
+        assert(len(self.getValueReads(capi)) == 0)
+        neo.setPollInterval(0, sensorId='04.147A0A020800', propName='udate')
+        assert(neo.sensors[0].getProperty('udate').pollInterval == 0)
+        capi.setValue('04.147A0A020800', 'udate', '1301872378')
+        neo.refresh()
+        assert(self.getValueReads(capi) == set(['/04.147A0A020800/udate']))
+        assert(neo.sensors[0].getProperty('udate').value == '1301872378')
+        self.assertRaises(onewireneo.OneWireNeoException, neo.setPollInterval, 5, propName='udate')
+
+    def testStartPolling_refreshesInBackground(self):
+        capi = owmock.MockCapi()
+        data = self.getThermometer(1)
+        capi.addDevice(data['id'], data)
+        schedule = onewireneo.OneWireNeoPollSchedule({FEATURES.Temperature: 0})
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Temperature]),
+                                    connection=owmock.MockConnection(capi), pollSchedule=schedule)
+        capi.setValue(data['id'], 'temperature', '30.0')
+        neo.startPolling(0.01)
+        try:
+            deadline = time.time() + 5
+            while neo.sensors[0].getProperty('temperature').value != 30.0 and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            neo.close()
+        assert(neo.sensors[0].getProperty('temperature').value == 30.0)
+
+    def buildThermometerNeo(self, capi, **options):
+        data = self.getThermometer(1)
+        capi.addDevice(data['id'], data)
+        return onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Temperature]),
+                                     connection=owmock.MockConnection(capi), **options)
+
+    def testReadPolicy_uncachedUsesUncachedTree(self):
+        capi = owmock.MockCapi()
+        neo = self.buildThermometerNeo(capi, readPolicy=READ_POLICY.Uncached)
+        sensor = neo.sensors[0]
+        assert(not sensor.cached)
+        assert('/uncached/28.000000000001/temperature' in capi.readLog)
+        assert(sensor.getProperty('temperature').value == 21.5)
+        assert(sensor.cacheMisses == 4)
+        assert(sensor.cacheHits == 0)
+
+    def testReadPolicy_cachedSetter(self):
+        capi = owmock.MockCapi()
+        neo = self.buildThermometerNeo(capi)
+        sensor = neo.sensors[0]
+        assert(sensor.cached)
+        sensor.cached = False
+        assert(sensor.readPolicy == READ_POLICY.Uncached)
+        capi.resetCounters()
+        neo.refresh(force=True)
+        assert('/uncached/28.000000000001/temperature' in capi.readLog)
+        assert(sensor.cacheHits == 4)
+        assert(sensor.cacheMisses == 4)
+
+    def testReadPolicy_maxAge(self):
+        capi = owmock.MockCapi()
+        neo = self.buildThermometerNeo(capi, readPolicy=READ_POLICY.MaxAge, maxAge=3600)
+        prop = neo.sensors[0].getProperty('temperature')
+        assert(prop.cacheMisses == 1)
+        capi.resetCounters()
+        neo.refresh(force=True)
+        assert('/28.000000000001/temperature' in capi.readLog)
+        assert(prop.cacheHits == 1)
+        # a property-level policy wins over the sensor's
+        prop.setReadPolicy(READ_POLICY.MaxAge, 0)
+        capi.resetCounters()
+        neo.refresh(force=True)
+        assert('/uncached/28.000000000001/temperature' in capi.readLog)
+        assert('/28.000000000001/type' in capi.readLog)
+        assert(prop.cacheMisses == 2)
+        assert(neo.cacheMisses == 5)
+
+    def testReadPolicy_validation(self):
+        capi = owmock.MockCapi()
+        self.assertRaises(onewireneo.OneWireNeoException, self.buildThermometerNeo, capi, readPolicy=READ_POLICY.MaxAge)
+        self.assertRaises(onewireneo.OneWireNeoException, self.buildThermometerNeo, capi, readPolicy='cached')
+
+    def testSubscribe_deliversOnlyChanges(self):
+        capi = owmock.MockCapi()
+        neo = self.buildThermometerNeo(capi)
+        events = list()
+        neo.subscribe(events.append)
+        neo.refresh(force=True)
+        assert(events == [])
+        capi.setValue('28.000000000001', 'temperature', '22.5')
+        neo.refresh(force=True)
+        assert(len(events) == 1)
+        event = events[0]
+        assert(event.kind == EVENT_KIND.Changed)
+        assert(event.sensorId == '28.000000000001')
+        assert(event.propName == 'temperature')
+        assert(event.feature == FEATURES.Temperature)
+        assert(event.previous == 21.5)
+        assert(event.value == 22.5)
+        assert(event.status == onewireneo.PROPERTY_STATUS.Increased)
+
+    def testSubscribe_deadbandAndFilters(self):
+        capi = owmock.MockCapi()
+        neo = self.buildThermometerNeo(capi)
+        banded = list()
+        typeChanges = list()
+        neo.subscribe(banded.append, feature=FEATURES.Temperature, deadband=0.5)
+        neo.subscribe(typeChanges.append, propertyPattern='ty', kinds=[EVENT_KIND.Changed])
+        for value in ('21.7', '21.9', '22.1'):
+            capi.setValue('28.000000000001', 'temperature', value)
+            neo.refresh(force=True)
+        assert([event.value for event in banded] == [22.1])
+        assert(typeChanges == [])
+        capi.setValue('28.000000000001', 'type', 'DS1822')
+        neo.refresh(force=True)
+        assert([event.propName for event in typeChanges] == ['type'])
+        assert(len(banded) == 1)
+
+    def testSubscribe_rateLimit(self):
+        capi = owmock.MockCapi()
+        neo = self.buildThermometerNeo(capi)
+        events = list()
+        subscription = neo.subscribe(events.append, minInterval=3600)
+        for value in ('22.5', '23.5'):
+            capi.setValue('28.000000000001', 'temperature', value)
+            neo.refresh(force=True)
+        assert([event.value for event in events] == [22.5])
+        neo.unsubscribe(subscription)
+        capi.setValue('28.000000000001', 'temperature', '24.5')
+        neo.refresh(force=True)
+        assert(len(events) == 1)
+
+    def testSubscribe_sensorMissingAndAppeared(self):
+        capi = owmock.MockCapi()
+        neo = self.buildThermometerNeo(capi)
+        queue = Queue.Queue()
+        neo.subscribe(queue, sensorId='28.000000000001')
+        data = self.getThermometer(1)
+        capi.removeDevice(data['id'])
+        neo.refresh()
+        neo.refresh()
+        capi.addDevice(data['id'], data)
+        neo.refresh()
+        other = self.getThermometer(2)
+        capi.addDevice(other['id'], other)
+        neo.refresh()
+        kinds = list()
+        while not queue.empty():
+            kinds.append(queue.get_nowait().kind)
+        assert(kinds == [EVENT_KIND.SensorMissing, EVENT_KIND.SensorAppeared])
+
+    def testSubscribe_rejectsBadTarget(self):
+        neo = self.buildThermometerNeo(owmock.MockCapi())
+        self.assertRaises(onewireneo.OneWireNeoException, neo.subscribe, 42)
+
+    def testEnableHistory_numericPropertiesOfFeature(self):
+        capi = owmock.MockCapi()
+        capi.addDevice('12.000012ED0000', self.getTestData_ds2406())
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Voltage, FEATURES.Pressure]),
+                                    connection=owmock.MockConnection(capi),
+                                    pollSchedule=onewireneo.OneWireNeoPollSchedule(defaultInterval=0))
+        neo.enableHistory(16, windows=(2,), feature=FEATURES.Voltage)
+        sensor = neo.sensors[0]
+        assert(sensor.getProperty('TAI8570/pressure').history is None)
+        assert(sensor.getProperty('type').history is None)
+        for value in ('4.0', '5.0', '6.0'):
+            capi.setValue('12.000012ED0000', 'T8A/volt.0', value)
+            neo.refresh()
+        history = sensor.getProperty('T8A/volt.0').history
+        assert(list(history.values()) == [4.0, 5.0, 6.0])
+        assert(history.stats(2).mean == 5.5)
+        neo.disableHistory()
+        assert(sensor.getProperty('T8A/volt.0').history is None)
+
+    def testHistory_skipsFailedReads(self):
+        capi = owmock.MockCapi()
+        capi.addDevice('12.000012ED0000', self.getTestData_ds2406())
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Voltage]), connection=owmock.MockConnection(capi),
+                                    pollSchedule=onewireneo.OneWireNeoPollSchedule(defaultInterval=0))
+        neo.enableHistory(16, feature=FEATURES.Voltage)
+        prop = neo.sensors[0].getProperty('T8A/volt.0')
+        for value in ('4.0', None, '6.0'):
+            capi.setValue('12.000012ED0000', 'T8A/volt.0', value)
+            neo.refresh()
+            if value is None:
+                assert(prop.status == PROPERTY_STATUS.Indeterminate)
+                assert(prop.value == 4.0)
+        assert(list(prop.history.values()) == [4.0, 6.0])
+
+    def testStats_recordedDuringRefresh(self):
+        capi = owmock.MockCapi()
+        data = self.getThermometer(1)
+        data['temphigh'] = '40'
+        capi.addDevice(data['id'], data)
+        capi.addDevice('28.000000000002', self.getThermometer(2))
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Temperature]), connection=owmock.MockConnection(capi))
+        stats = neo.stats
+        assert(stats.histogram('refresh').count == 1)
+        assert(stats.histogram('sensor').count == 2)
+        assert(stats.histogram('dirWalk').count == 1)
+        assert(stats.counter('reads') == stats.histogram('read').count)
+        assert(stats.sensorHistogram('28.000000000001').count == 1)
+        capi.setValue(data['id'], 'temperature', None)
+        capi.removeDevice('28.000000000002')
+        neo.refresh(force=True)
+        neo.refresh(force=True)
+        assert(stats.counter('readFailures') == 2)
+        assert(stats.counter('missingSensors') == 1)
+
+    def testStats_missingPropertiesCountedNotPrinted(self):
+        capi = owmock.MockCapi()
+        data = self.getThermometer(1)
+        capi.addDevice(data['id'], data)
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Temperature]), connection=owmock.MockConnection(capi))
+        del capi.getDevice(data['id'])['type']
+        neo.flushSchemaCache()
+        output = StringIO.StringIO()
+        stdout, sys.stdout = sys.stdout, output
+        try:
+            neo.refresh(force=True)
+            neo.refresh(force=True)
+        finally:
+            sys.stdout = stdout
+        assert(output.getvalue() == '')
+        assert(neo.stats.counter('missingProperties') == 1)
+
+    def testAggregate_mergesServers(self):
+        zone1, zone2 = owmock.MockCapi(), owmock.MockCapi()
+        zone1.addDevice('28.000000000001', self.getThermometer(1, '20.0'))
+        zone2.addDevice('28.000000000001', self.getThermometer(1, '30.0'))
+        zone2.addDevice('28.000000000002', self.getThermometer(2, '31.0'))
+        connections = {'zone1:4304': owmock.MockConnection(zone1), 'zone2:4304': owmock.MockConnection(zone2)}
+        neo = onewireneo.OneWireNeoAggregate(['zone1:4304', 'zone2:4304'], set([FEATURES.Temperature]), connections)
+        try:
+            sensors = neo.sensors
+            assert(sorted(sensors) == ['zone1:4304/28.000000000001/', 'zone2:4304/28.000000000001/',
+                                       'zone2:4304/28.000000000002/'])
+            assert(sensors['zone1:4304/28.000000000001/'].getProperty('temperature').value == 20.0)
+            assert(neo.getSensor('zone2:4304', '/28.000000000001/').getProperty('temperature').value == 30.0)
+            assert([server.status for server in neo.servers] == [SERVER_STATUS.Online, SERVER_STATUS.Online])
+            # one connection per server, reused across refreshes
+            root = neo.getServer('zone1:4304').neo._root
+            neo.refresh(force=True)
+            assert(neo.getServer('zone1:4304').neo._root is root)
+        finally:
+            neo.close()
+
+    def testAggregate_offlineServer(self):
+        good = owmock.MockCapi()
+        good.addDevice('28.000000000001', self.getThermometer(1, '20.0'))
+        connections = {'good': owmock.MockConnection(good), 'down': owmock.MockConnection(FailingCapi())}
+        neo = onewireneo.OneWireNeoAggregate(['good', 'down'], set([FEATURES.Temperature]), connections)
+        try:
+            assert(neo.getServer('good').status == SERVER_STATUS.Online)
+            down = neo.getServer('down')
+            assert(down.status == SERVER_STATUS.Offline)
+            assert(isinstance(down.lastError, IOError))
+            neo.refresh()
+            assert(down.failures == 2)
+            assert(sorted(neo.sensors) == ['good/28.000000000001/'])
+        finally:
+            neo.close()
+
+    def testAggregate_slowServerDoesNotBlock(self):
+        fast, slow = owmock.MockCapi(), owmock.MockCapi()
+        fast.addDevice('28.000000000001', self.getThermometer(1, '20.0'))
+        slow.addDevice('28.000000000002', self.getThermometer(2, '21.0'))
+        connections = {'fast': owmock.MockConnection(fast), 'slow': owmock.MockConnection(slow)}
+        neo = onewireneo.OneWireNeoAggregate(['fast', 'slow'], set([FEATURES.Temperature]), connections, timeout=5.0)
+        try:
+            neo._timeout = 0.05
+            slow.latency = 0.02
+            fast.setValue('28.000000000001', 'temperature', '22.0')
+            start = time.time()
+            neo.refresh(force=True)
+            assert(time.time() - start < 1.0)
+            assert(neo.getServer('fast').status == SERVER_STATUS.Online)
+            assert(neo.getServer('fast').neo.sensors[0].getProperty('temperature').value == 22.0)
+            assert(neo.getServer('slow').status == SERVER_STATUS.Slow)
+            # a busy server is skipped rather than queued behind itself
+            reads = slow.reads
+            neo.refresh(force=True)
+            while neo.getServer('slow').busy:
+                time.sleep(0.01)
+            assert(neo.getServer('slow').status == SERVER_STATUS.Online)
+            assert(slow.reads - reads < 20)
+        finally:
+            neo.close()
+
+    def testSimultaneous_convertsOncePerBus(self):
+        capi = owmock.MockCapi()
+        self.buildBus(capi, 2, 3)
+        capi.addDevice('26.000000000001', {'id': '26.000000000001', 'family': '26', 'type': 'DS2438',
+                                           'temperature': '19.0', 'VAD': '4.2'}, 'bus.1')
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Temperature]), connection=owmock.MockConnection(capi),
+                                    simultaneous=True, conversionTime=0.0)
+        try:
+            assert(sorted([path for path, value in capi.writeLog]) ==
+                   ['/bus.0/simultaneous/temperature', '/bus.1/simultaneous/temperature'])
+            capi.resetCounters()
+            neo.refresh(force=True)
+            assert(len(capi.writeLog) == 2)
+            temperatureReads = [path for path in capi.readLog if path.endswith('/temperature')]
+            # latched thermometers are read from the bus; the DS2438 is not part of the conversion
+            assert(len(temperatureReads) == 7)
+            assert(len([path for path in temperatureReads if path.startswith('/uncached/28.')]) == 6)
+            assert('/26.000000000001/temperature' in temperatureReads)
+            assert(neo.stats.histogram('conversion').count == 2)
+            # nothing due: no conversion
+            capi.resetCounters()
+            neo.refresh()
+            assert(capi.writeLog == [])
+        finally:
+            neo.close()
+
+    def testSimultaneous_failedTriggerFallsBack(self):
+        capi = owmock.MockCapi()
+        capi.put = lambda path, value: False
+        capi.addDevice('28.000000000001', self.getThermometer(1))
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Temperature]), connection=owmock.MockConnection(capi),
+                                    simultaneous=True, conversionTime=5.0)
+        try:
+            assert(neo.sensors[0].getProperty('temperature').value == 21.5)
+            assert('/28.000000000001/temperature' in capi.readLog)
+        finally:
+            neo.close()
+
+    def testTemperatureResolution(self):
+        capi = owmock.MockCapi()
+        for index in (1, 2):
+            data = self.getThermometer(index, '21.5')
+            data.update({'temperature9': '21.5', 'temperature10': '21.5', 'temperature11': '21.375',
+                         'temperature12': '21.4375', 'fasttemp': '21.5'})
+            capi.addDevice(data['id'], data)
+        capi.addDevice('10.000000000003', {'id': '10.000000000003', 'family': '10', 'type': 'DS18S20',
+                                           'temperature': '18.0', 'fasttemp': '18.0'})
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Temperature]), connection=owmock.MockConnection(capi),
+                                    temperatureResolution=12)
+        try:
+            sensors = dict([(sensor.id, sensor) for sensor in neo.sensors])
+            first = sensors['28.000000000001']
+            # the chosen variant is read under the normalized name, the others are never discovered
+            assert(sorted(first._properties) == ['family', 'id', 'temperature', 'type'])
+            assert(first.getProperty('temperature').value == 21.4375)
+            assert(first.getProperty('temperature').path == '/28.000000000001/temperature12')
+            assert(first.getProperty('temperature').feature is FEATURES.Temperature)
+            # families without selectable resolution keep reading temperature, and fasttemp
+            assert(sensors['10.000000000003'].getProperty('temperature').path == '/10.000000000003/temperature')
+            assert('fasttemp' in sensors['10.000000000003']._properties)
+            neo.setTemperatureResolution(9, sensorId='28.000000000002')
+            neo.setTemperatureResolution(11, familyCode='28')
+            capi.resetCounters()
+            neo.refresh(force=True)
+            reads = [path for path in capi.readLog if '/temperature' in path or '/fasttemp' in path]
+            assert(sorted(reads) == ['/10.000000000003/fasttemp', '/10.000000000003/temperature',
+                                     '/28.000000000001/temperature11', '/28.000000000002/temperature9'])
+            assert(first.getProperty('temperature').value == 21.375)
+            self.assertRaises(onewireneo.OneWireNeoException, neo.setTemperatureResolution, 13)
+            # back to the device's own setting: fasttemp is read again
+            neo.setTemperatureResolution(None, sensorId='28.000000000002')
+            neo.setTemperatureResolution(None, familyCode='28')
+            neo.setTemperatureResolution(None)
+            neo.refresh(force=True)
+            assert('fasttemp' in sensors['28.000000000002']._properties)
+            assert(sensors['28.000000000002'].getProperty('temperature').path == '/28.000000000002/temperature')
+        finally:
+            neo.close()
+
+    def testCompactModel(self):
+        capi = owmock.MockCapi()
+        capi.addDevice('28.000000000001', self.getThermometer(1))
+        capi.addDevice('28.000000000002', self.getThermometer(2))
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Temperature]), connection=owmock.MockConnection(capi))
+        try:
+            first, second = sorted(neo.sensors, key=lambda sensor: sensor.id)
+            prop = first.getProperty('temperature')
+            assert(not hasattr(first, '__dict__') and not hasattr(prop, '__dict__'))
+            assert(prop.path == '/28.000000000001/temperature')
+            assert(isinstance(prop.lastRead, datetime.datetime) and isinstance(first.lastRead, datetime.datetime))
+            # names are shared between devices
+            assert(prop.name is second.getProperty('temperature').name)
+        finally:
+            neo.close()
+
+    def testLazy_discoversWithoutReading(self):
+        capi = owmock.MockCapi()
+        self.buildBus(capi, 2, 3)
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Temperature]), connection=owmock.MockConnection(capi),
+                                    lazy=True)
+        try:
+            # discovery is one walk per device and no value reads (schema sharing may skip walks but reads 'type')
+            assert([path for path in self.getValueReads(capi) if not path.endswith('/type')] == [])
+            sensors = dict([(sensor.id, sensor) for sensor in neo.sensors])
+            assert(len(sensors) == 6)
+            sensor = sensors['28.000000000001']
+            assert(sorted(sensor._properties) == ['family', 'id', 'temperature', 'type'])
+            assert(not sensor._properties['temperature'].materialized)
+            assert('-' in str(neo))
+            capi.resetCounters()
+            assert(sensor.getProperty('temperature').value == 1.5)
+            assert(capi.readLog == ['/28.000000000001/temperature'])
+            assert(sensors['28.000000000002']._properties['family'].value == '28')
+            # values read on access are reported and scheduled like refresh reads
+            assert(neo.snapshot().get('28.000000000001', 'temperature')['value'] == 1.5)
+            assert(sensor._properties['temperature'].nextPoll is not None)
+            # so the next refresh reads only what is still unread
+            capi.resetCounters()
+            neo.refresh()
+            assert(len(self.getValueReads(capi)) == 22)
+            assert('/28.000000000001/temperature' not in capi.readLog)
+            assert(sensors['28.000000000003'].getProperty('temperature').status == onewireneo.PROPERTY_STATUS.Changed)
+        finally:
+            neo.close()
+
+    def testLazy_firstAccessFollowsReadPolicy(self):
+        capi = owmock.MockCapi(cacheAge=60)
+        capi.addDevice('28.000000000001', self.getThermometer(1, '20.0'))
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Temperature]), connection=owmock.MockConnection(capi),
+                                    lazy=True, readPolicy=onewireneo.READ_POLICY.Uncached)
+        try:
+            assert(capi.get('/28.000000000001/temperature') == '20.0')
+            capi.setValue('28.000000000001', 'temperature', '25.0')
+            capi.resetCounters()
+            prop = neo.sensors[0].getProperty('temperature')
+            assert(prop.value == 25.0 and prop.cacheMisses == 1)
+            assert(capi.readLog == ['/uncached/28.000000000001/temperature'])
+        finally:
+            neo.close()
+
+    def testSnapshot(self):
+        capi = owmock.MockCapi()
+        capi.addDevice('28.000000000001', self.getThermometer(1, '20.0'))
+        capi.addDevice('28.000000000002', self.getThermometer(2, '21.0'))
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Temperature]), connection=owmock.MockConnection(capi))
+        try:
+            first = neo.snapshot()
+            assert(first.get('28.000000000001', 'temperature')['value'] == 20.0)
+            assert(first.get('28.000000000001', 'temperature')['status'] == 'Changed')
+            assert(first.sensors() == {'28.000000000001': 'New', '28.000000000002': 'New'})
+            assert(neo.snapshot() is first)
+            capi.setValue('28.000000000002', 'temperature', '22.0')
+            capi.removeDevice('28.000000000001')
+            neo.refresh(force=True)
+            second = neo.snapshot()
+            assert(second.sensors() == {'28.000000000001': 'Missing', '28.000000000002': 'Available'})
+            assert(second.get('28.000000000002', 'temperature')['status'] == 'Increased')
+            assert(first.get('28.000000000002', 'temperature')['value'] == 21.0)
+            assert(set(second.column('name')) == set(['family', 'id', 'temperature', 'type']))
+        finally:
+            neo.close()
+
+    def testRecording(self):
+        directory = tempfile.mkdtemp()
+        capi = owmock.MockCapi()
+        capi.addDevice('28.000000000001', self.getThermometer(1, '20.0'))
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Temperature]), connection=owmock.MockConnection(capi))
+        try:
+            recorder = neo.startRecording(directory, flushInterval=0.01)
+            capi.setValue('28.000000000001', 'temperature', '21.5')
+            neo.refresh(force=True)
+            capi.setValue('28.000000000001', 'temperature', '19.0')
+            neo.refresh(force=True)
+            neo.stopRecording()
+            assert(neo.recorder is None and recorder.written == 2)
+            timestamps, values, statuses = OneWireNeoLogReader(directory).read('28.000000000001', 'temperature')
+            assert(list(values) == [21.5, 19.0] and timestamps[0] <= timestamps[1])
+            assert(list(statuses) == [PROPERTY_STATUS.Increased.Value, PROPERTY_STATUS.Decreased.Value])
+        finally:
+            neo.close()
+            shutil.rmtree(directory)
+
+    def testQueries(self):
+        capi = owmock.MockCapi()
+        for index in range(3):
+            capi.addDevice('28.00000000000%d' % index, self.getThermometer(index, '2%d.0' % index))
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Temperature]), connection=owmock.MockConnection(capi))
+        try:
+            readings = neo.startQueries(capacity=10)
+            assert(neo.readings is readings)
+            query = readings.select(feature=FEATURES.Temperature)
+            assert(len(query) == 3 and query.mean() == 21.0)
+            capi.setValue('28.000000000002', 'temperature', '30.0')
+            neo.refresh(force=True)
+            query = readings.select(feature=FEATURES.Temperature)
+            assert(query.max() == 30.0)
+            assert(query.window(60).outside(high=25.0) == [('28.000000000002', 'temperature')])
+            neo.stopQueries()
+            assert(neo.readings is None)
+        finally:
+            neo.close()
+
+    def testMemoryPagesReadAsOneBlock(self):
+        capi = owmock.MockCapi()
+        memory = ''.join([chr(i) for i in range(64)])
+        data = {'id': '23.000000000001', 'family': '23', 'type': 'DS2433', 'pages/page.ALL': memory}
+        for page in range(4):
+            data['pages/page.%d' % page] = memory[page * 16:(page + 1) * 16]
+        capi.addDevice('23.000000000001', data)
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Memory]), connection=owmock.MockConnection(capi))
+        try:
+            sensor = neo.sensors[0]
+            reads = self.getValueReads(capi)
+            assert('/23.000000000001/pages/page.ALL' in reads)
+            assert(not [path for path in reads if '/page.' in path and not path.endswith('.ALL')])
+            page = sensor.getProperty('pages/page.2')
+            assert(isinstance(page.value, memoryview) and page.value == memory[32:48])
+            assert(page.getFormattedValue() == memory[32:48].encode('hex'))
+            assert(page.getFormattedValue() is page.getFormattedValue())
+            capi.setValue('23.000000000001', 'pages/page.ALL', memory[:32] + 'x' * 32)
+            neo.refresh(force=True)
+            assert(page.status == onewireneo.PROPERTY_STATUS.Changed)
+            assert(sensor.getProperty('pages/page.0').status == onewireneo.PROPERTY_STATUS.Stable)
+            assert(page.getFormattedValue() == ('x' * 16).encode('hex'))
+        finally:
+            neo.close()
+
+    def testPlanAggregateReads(self):
+        plan = onewireneo.planAggregateReads(['PIO.A', 'PIO.B', 'PIO.ALL', 'PIO.BYTE', 'T8A/volt.0', 'T8A/volt.7',
+                                              'T8A/volt.ALL', 'sensed.A', 'pages/page.1', 'pages/page.0',
+                                              'pages/page.ALL', 'temperature'])
+        assert(sorted(plan) == ['PIO.A', 'PIO.B', 'T8A/volt.0', 'T8A/volt.7', 'pages/page.0', 'pages/page.1'])
+        assert(plan['PIO.B'] == ('PIO.ALL', 1, 2, False))
+        assert(plan['T8A/volt.7'] == ('T8A/volt.ALL', 7, 2, False))
+        assert(plan['pages/page.1'] == ('pages/page.ALL', 1, 2, True))
+        assert(onewireneo.planAggregateReads(['temperature', 'sensed.A']) == {})
+
+    def testRefresh_readsAggregatesOnce(self):
+        capi = owmock.MockCapi()
+        sensorId, data = owmock.syntheticDevice('29', 1)
+        capi.addDevice(sensorId, data)
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Pio, FEATURES.Sense]),
+                                    connection=owmock.MockConnection(capi))
+        try:
+            reads = self.getValueReads(capi)
+            assert('/%s/PIO.ALL' % sensorId in reads and '/%s/sensed.ALL' % sensorId in reads)
+            assert(not [path for path in reads if path[-2] == '.' and path[-1].isdigit()])
+            sensor = neo.sensors[0]
+            for channel in range(8):
+                assert(sensor.getProperty('PIO.%d' % channel).value == data['PIO.%d' % channel])
+            flipped = '1' if data['PIO.3'] == '0' else '0'
+            fields = data['PIO.ALL'].split(',')
+            fields[3] = flipped
+            capi.setValue(sensorId, 'PIO.ALL', ','.join(fields))
+            neo.refresh(force=True)
+            assert(sensor.getProperty('PIO.3').value == flipped)
+            assert(sensor.getProperty('PIO.3').status == onewireneo.PROPERTY_STATUS.Changed)
+            assert(sensor.getProperty('PIO.4').status == onewireneo.PROPERTY_STATUS.Stable)
+        finally:
+            neo.close()
+
+    def testAlarmPolling(self):
+        capi = owmock.MockCapi()
+        switchId, switch = owmock.syntheticDevice('29', 1)
+        capi.addDevice(switchId, switch)
+        capi.addDevice('28.000000000001', self.getThermometer(1, '20.0'))
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Sense, FEATURES.Pio, FEATURES.Temperature]),
+                                    connection=owmock.MockConnection(capi), alarmPolling=True,
+                                    alarmSafetyInterval=600)
+        try:
+            sensor = [s for s in neo.sensors if s.id == switchId][0]
+            assert(sensor.alarmInterval == 600)
+            assert(sensor.getProperty('sensed.2').pollInterval == 600)
+            assert([s for s in neo.sensors if s.id != switchId][0].alarmInterval is None)
+            fields = switch['sensed.ALL'].split(',')
+            fields[2] = '1' if fields[2] == '0' else '0'
+            capi.setValue(switchId, 'sensed.ALL', ','.join(fields))
+            capi.resetCounters()
+            neo.refresh()
+            assert('/uncached/alarm/' in capi.readLog)
+            assert(not [path for path in capi.readLog if switchId in path])
+            capi.setAlarm(switchId)
+            neo.refresh()
+            assert(sensor.getProperty('sensed.2').value == fields[2])
+            assert(sensor.getProperty('sensed.2').status == onewireneo.PROPERTY_STATUS.Changed)
+            assert(('/%s/latch.BYTE' % switchId, '1') in capi.writeLog)
+            assert(capi.get('/alarm') == '')
+            assert(neo.stats.histogram('alarmSearch').count == 3)
+            neo.setAlarmPolling(False)
+            assert(sensor.alarmInterval is None and sensor.getProperty('sensed.2').pollInterval == 10)
+        finally:
+            neo.close()
+
+    def testAlarmPolling_bypassesCache(self):
+        capi = owmock.MockCapi(cacheAge=60)
+        switchId, switch = owmock.syntheticDevice('29', 1)
+        capi.addDevice(switchId, switch)
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Sense]), connection=owmock.MockConnection(capi),
+                                    alarmPolling=True, alarmSafetyInterval=600)
+        try:
+            sensor = neo.sensors[0]
+            neo.refresh()
+            assert(capi.get('/alarm') == '')
+            fields = switch['sensed.ALL'].split(',')
+            fields[5] = '1' if fields[5] == '0' else '0'
+            capi.setValue(switchId, 'sensed.ALL', ','.join(fields))
+            capi.setAlarm(switchId)
+            # the cached listing and value still show the state before the edge
+            assert(capi.get('/alarm') == '' and capi.get('/%s/sensed.ALL' % switchId) == switch['sensed.ALL'])
+            neo.refresh()
+            assert(sensor.getProperty('sensed.5').value == fields[5])
+            assert('/uncached/%s/sensed.ALL' % switchId in capi.readLog)
+            capi.resetCounters()
+            neo.refresh()
+            assert(not [path for path in capi.readLog if switchId in path])
+        finally:
+            neo.close()
+
+    def testMergeChannelWrites(self):
+        propList = ['PIO.A', 'PIO.B', 'PIO.ALL', 'latch.A', 'latch.B', 'latch.ALL', 'date']
+        writes = [('PIO.B', '1', ['b']), ('date', '0', ['d']), ('PIO.A', '0', ['a']), ('latch.A', '1', ['l'])]
+        assert(onewireneo.mergeChannelWrites(writes, propList) ==
+               [('PIO.ALL', '0,1', ['b', 'a']), ('date', '0', ['d']), ('latch.A', '1', ['l'])])
+        writes = [('PIO.ALL', '1,1', ['all']), ('PIO.A', '0', ['a']), ('PIO.B', '0', ['b'])]
+        assert(onewireneo.mergeChannelWrites(writes, propList) == [('PIO.ALL', '0,0', ['all', 'a', 'b'])])
+        writes = [('PIO.ALL', '1,1,1', ['all']), ('PIO.A', '0', ['a']), ('PIO.B', '0', ['b'])]
+        assert(onewireneo.mergeChannelWrites(writes, propList) == writes)
+
+    def testWrite_coalescesIntoOneBusWrite(self):
+        capi = owmock.MockCapi()
+        sensorId, data = owmock.syntheticDevice('29', 1)
+        capi.addDevice(sensorId, data)
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Pio]), connection=owmock.MockConnection(capi),
+                                    writeDelay=0.05)
+        try:
+            sensor = neo.sensors[0]
+            assert(sensor.getProperty('PIO.3').writable and not sensor.getProperty('type').writable)
+            self.assertRaises(onewireneo.OneWireNeoException, neo.write, sensorId, 'type', 'DS2408')
+            self.assertRaises(onewireneo.OneWireNeoException, neo.write, sensorId, 'nothere', '1')
+            first = neo.write(sensorId, 'PIO.0', True)
+            futures = [neo.write(sensorId, 'PIO.%d' % channel, channel % 2) for channel in range(8)]
+            for future in [first] + futures:
+                assert(future.result(5) is True)
+            assert(capi.writeLog == [('/%s/PIO.ALL' % sensorId, '0,1,0,1,0,1,0,1')])
+            assert(neo.stats.counter('writes') == 1)
+            neo.refresh()
+            assert(sensor.getProperty('PIO.1').value == '1' and sensor.getProperty('PIO.0').value == '0')
+            capi.removeDevice(sensorId)
+            failed = neo.write(sensorId, 'PIO.2', 1)
+            assert(isinstance(failed.exception(5), onewireneo.OneWireNeoException))
+            self.assertRaises(onewireneo.OneWireNeoException, failed.result)
+            assert(neo.stats.counter('writeFailures') == 1)
+        finally:
+            neo.close()
+        self.assertRaises(onewireneo.OneWireNeoException, neo.write, sensorId, 'PIO.2', 1)
+
+    def testWrite_waitsForRefreshOnTheBus(self):
+        capi = owmock.MockCapi()
+        sensorId, data = owmock.syntheticDevice('29', 1)
+        capi.addDevice(sensorId, data)
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Pio]), connection=owmock.MockConnection(capi),
+                                    writeDelay=0.01)
+        try:
+            # what a refresh lane working on the bus holds
+            neo._scheduler.lockBus(None)
+            try:
+                future = neo.write(sensorId, 'PIO.0', 1)
+                time.sleep(0.1)
+                assert(not future.done() and capi.writeLog == [])
+            finally:
+                neo._scheduler.unlockBus(None)
+            assert(future.result(5) is True and capi.writeLog == [('/%s/PIO.0' % sensorId, '1')])
+        finally:
+            neo.close()
+
+    def testDiscovery_runsApartFromRefresh(self):
+        capi = owmock.MockCapi()
+        capi.addDevice('28.000000000001', self.getThermometer(1, '20.0'))
+        capi.addDevice('28.000000000002', self.getThermometer(2, '21.0'))
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Temperature]), connection=owmock.MockConnection(capi),
+                                    discoveryInterval=3600)
+        try:
+            assert(neo.discoveryInterval == 3600 and len(neo.sensors) == 2)
+            capi.removeDevice('28.000000000002')
+            capi.addDevice('28.000000000003', self.getThermometer(3, '22.0'))
+            capi.resetCounters()
+            neo.refresh(force=True)
+            assert(not [path for path in capi.readLog if path.endswith('/')])
+            assert(len(neo.sensors) == 2)
+            neo.discover()
+            statuses = dict([(sensor.id, sensor.status) for sensor in neo.sensors])
+            assert(statuses == {'28.000000000001': SENSOR_STATUS.Available, '28.000000000002': SENSOR_STATUS.Missing})
+            neo.refresh()
+            assert(len(neo.sensors) == 3)
+            capi.addDevice('28.000000000002', self.getThermometer(2, '21.0'))
+            neo.startDiscovery(0.01)
+            deadline = time.time() + 5
+            while [s for s in neo.sensors if s.status is SENSOR_STATUS.Missing] and time.time() < deadline:
+                time.sleep(0.01)
+            assert(not [s for s in neo.sensors if s.status is SENSOR_STATUS.Missing])
+            assert(neo.stats.histogram('discovery').count >= 2)
+            neo.stopDiscovery()
+            assert(neo.discoveryInterval is None)
+        finally:
+            neo.close()
+
     #def testFoo(self):
         #tester = onewireneo.OneWireNeo('192.168.0.42:4304', [FEATURES.Temperature, FEATURES.Humidity, FEATURES.Pressure])
 
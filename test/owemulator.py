@@ -0,0 +1,244 @@
+__author__ = 'sdavidson'
+
+import errno
+import optparse
+import random
+import re
+import SocketServer
+import sys
+import threading
+import time
+import owmock
+import owprotocol
+from owprotocol import HEADER
+
+'''
+    Stand-alone owserver emulator.  Serves a MockCapi (usually a synthetic bus from owmock.buildSyntheticBus) over
+    the real owserver network protocol, so OneWireNeo can be driven end to end through pyowfs or OwserverConnection
+    without hardware:
+
+        PYTHONPATH=../src python owemulator.py --port 4304 --devices 500 --buses 4 --latency 0.002 --error-rate 0.01
+
+    Faults are injected per request: latency plus jitter before every reply (owserver keep-alive pings are sent
+    while a slow reply is pending), read errors returned as EIO, and devices dropped off the bus, either at random
+    for single requests (dropRate) or until restored (dropDevice / restoreDevice).
+'''
+
+'''
+    Seconds between keep-alive pings while a reply is delayed, as owserver does for slow reads
+'''
+PING_INTERVAL = 1.0
+
+_SENSOR_NAME = re.compile('[0-9A-F]{2}\.[0-9A-F]{12}$')
+
+
+class OwserverEmulatorHandler(SocketServer.BaseRequestHandler):
+    def handle(self):
+        server = self.server
+        while True:
+            header = self._recv(HEADER.size)
+            if header is None:
+                return
+            version, payloadLength, msgType, flags, size, offset = HEADER.unpack(header)
+            payload = self._recv(payloadLength) if payloadLength > 0 else ''
+            if payload is None:
+                return
+            path, sep, data = payload.partition('\0')
+            persistent = server.persistence and bool(flags & owprotocol.FLG_PERSISTENCE)
+            replyFlags = owprotocol.FLG_PERSISTENCE if persistent else 0
+            server.countRequest()
+            self._delay(server.nextDelay(), replyFlags)
+            if msgType == owprotocol.MSG_DIR:
+                entries = server.answer(owprotocol.MSG_DIRALLSLASH, path, data[:size])
+                if isinstance(entries, str):
+                    for entry in entries.split(','):
+                        self._reply(0, entry.rstrip('/'), replyFlags)
+                    entries = 0
+                self._reply(entries, '', replyFlags)
+            else:
+                reply = server.answer(msgType, path, data[:size])
+                if isinstance(reply, str):
+                    self._reply(len(reply), reply, replyFlags)
+                else:
+                    self._reply(reply, '', replyFlags)
+            if not persistent:
+                return
+
+    def _reply(self, ret, data, flags):
+        self.request.sendall(HEADER.pack(0, len(data), ret, flags, len(data), 0) + data)
+
+    def _delay(self, delay, flags):
+        while delay > PING_INTERVAL:
+            time.sleep(PING_INTERVAL)
+            delay -= PING_INTERVAL
+            self.request.sendall(HEADER.pack(0, owprotocol.PING_PAYLOAD, 0, flags, 0, 0))
+        if delay > 0:
+            time.sleep(delay)
+
+    def _recv(self, count):
+        data = ''
+        while len(data) < count:
+            chunk = self.request.recv(count - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+
+'''
+    Threaded owserver emulator.  answer() holds the protocol semantics: it returns the reply payload as a string, or
+    a negative errno.  port=0 picks a free port; address gives the 'host:port' to connect to.
+'''
+class OwserverEmulator(SocketServer.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, capi, host='127.0.0.1', port=0, persistence=True, latency=0.0, jitter=0.0, dropRate=0.0,
+                 errorRate=0.0, seed=None):
+        SocketServer.ThreadingTCPServer.__init__(self, (host, port), OwserverEmulatorHandler)
+        self.capi = capi
+        self.persistence = persistence
+        self.latency = latency
+        self.jitter = jitter
+        self.dropRate = dropRate
+        self.errorRate = errorRate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._dropped = set()
+        self._thread = None
+        self.requestCount = 0
+        self.errorCount = 0
+        self.dropCount = 0
+
+    address = property(lambda self: '%s:%d' % self.server_address)
+    dropped = property(lambda self: frozenset(self._dropped))
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    '''
+        Take a device off the bus until restoreDevice() is called
+    '''
+    def dropDevice(self, sensorId):
+        with self._lock:
+            self._dropped.add(sensorId)
+
+    def restoreDevice(self, sensorId):
+        with self._lock:
+            self._dropped.discard(sensorId)
+
+    def countRequest(self):
+        with self._lock:
+            self.requestCount += 1
+
+    def nextDelay(self):
+        if not self.jitter:
+            return self.latency
+        with self._lock:
+            return self.latency + self._random.uniform(0, self.jitter)
+
+    def answer(self, msgType, path, data):
+        if msgType == owprotocol.MSG_NOP:
+            return ''
+        if msgType == owprotocol.MSG_GET or msgType == owprotocol.MSG_GETSLASH:
+            msgType = owprotocol.MSG_DIRALLSLASH if self.capi.isDir(path) else owprotocol.MSG_READ
+        sensorId = self._sensorId(path)
+        if sensorId is not None and self._isDropped(sensorId):
+            return -errno.ENOENT
+        if msgType == owprotocol.MSG_READ or msgType == owprotocol.MSG_SIZE:
+            if self._fail():
+                return -errno.EIO
+            if self.capi.isDir(path):
+                return -errno.EISDIR
+            value = self.capi.get(path)
+            if value is None:
+                return -errno.ENOENT
+            return value if msgType == owprotocol.MSG_READ else len(value)
+        if msgType == owprotocol.MSG_DIRALL or msgType == owprotocol.MSG_DIRALLSLASH:
+            if not self.capi.isDir(path):
+                return -errno.ENOTDIR
+            listing = self.capi.get(path) or ''
+            prefix = path if path.endswith('/') else path + '/'
+            entries = [e for e in listing.split(',') if e and not self._isDropped(e.rstrip('/'))]
+            if msgType == owprotocol.MSG_DIRALL:
+                entries = [e.rstrip('/') for e in entries]
+            return ','.join([prefix + entry for entry in entries])
+        if msgType == owprotocol.MSG_WRITE:
+            if self._fail():
+                return -errno.EIO
+            return 0 if self.capi.put(path, data) else -errno.ENOENT
+        if msgType == owprotocol.MSG_PRESENCE:
+            return 0 if self.capi.get(path) is not None else -errno.ENOENT
+        return -errno.EINVAL
+
+    def _sensorId(self, path):
+        for part in path.split('/'):
+            if _SENSOR_NAME.match(part):
+                return part
+        return None
+
+    def _isDropped(self, sensorId):
+        with self._lock:
+            if sensorId in self._dropped:
+                return True
+            if self.dropRate and _SENSOR_NAME.match(sensorId) and self._random.random() < self.dropRate:
+                self.dropCount += 1
+                return True
+        return False
+
+    def _fail(self):
+        if not self.errorRate:
+            return False
+        with self._lock:
+            if self._random.random() < self.errorRate:
+                self.errorCount += 1
+                return True
+        return False
+
+
+def main(argv):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--host', default='127.0.0.1', help='address to listen on (default %default)')
+    parser.add_option('--port', type='int', default=4304, help='port to listen on (default %default)')
+    parser.add_option('--devices', type='int', default=100, help='number of synthetic devices (default %default)')
+    parser.add_option('--buses', type='int', default=1, help='number of buses (default %default)')
+    parser.add_option('--families', default=None,
+                      help="comma separated family codes, or 'all' (default: mostly thermometers)")
+    parser.add_option('--latency', type='float', default=0.0, help='seconds per request (default %default)')
+    parser.add_option('--jitter', type='float', default=0.0, help='extra random seconds per request (default %default)')
+    parser.add_option('--drop-rate', type='float', default=0.0, dest='dropRate',
+                      help='chance a device is missing from any one request (default %default)')
+    parser.add_option('--error-rate', type='float', default=0.0, dest='errorRate',
+                      help='chance a read or write fails with EIO (default %default)')
+    parser.add_option('--no-persistence', action='store_false', default=True, dest='persistence',
+                      help='close the connection after every reply')
+    parser.add_option('--seed', type='int', default=0, help='random seed (default %default)')
+    options, args = parser.parse_args(argv)
+
+    families = owmock.DEFAULT_FAMILY_MIX
+    if options.families == 'all':
+        families = 'all'
+    elif options.families:
+        families = [(code.strip().upper(), 1) for code in options.families.split(',')]
+    capi = owmock.MockCapi()
+    owmock.buildSyntheticBus(capi, options.devices, families, options.buses, options.seed)
+    server = OwserverEmulator(capi, options.host, options.port, options.persistence, options.latency, options.jitter,
+                              options.dropRate, options.errorRate, options.seed)
+    print('Serving %d devices on %d bus(es) at %s' % (options.devices, options.buses, server.address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
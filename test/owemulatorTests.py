@@ -0,0 +1,145 @@
+__author__ = 'sdavidson'
+
+import errno
+import unittest
+import onewireneo
+import owemulator
+import owmock
+import owprotocol
+from onewireneo import FEATURES, SENSOR_STATUS, SERVER_STATUS
+from owemulator import OwserverEmulator
+
+
+class OwemulatorTests(unittest.TestCase):
+    def setUp(self):
+        self.capi = owmock.MockCapi()
+        self.conn = owmock.buildSyntheticBus(self.capi, 12, busCount=2)
+        self.servers = list()
+        self.clients = list()
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        for server in self.servers:
+            server.stop()
+
+    def startServer(self, **options):
+        server = OwserverEmulator(self.capi, seed=1, **options).start()
+        self.servers.append(server)
+        return server
+
+    def getClient(self, server, **options):
+        client = owprotocol.OwserverClient(server.address, **options)
+        self.clients.append(client)
+        return client
+
+    def testAnswer(self):
+        server = OwserverEmulator(self.capi)
+        try:
+            sensorId = self.capi.devices[0]
+            temperature = self.capi.getDevice(sensorId)['temperature']
+            assert(server.answer(owprotocol.MSG_READ, '/%s/temperature' % sensorId, '') == temperature)
+            assert(server.answer(owprotocol.MSG_GET, '/%s/temperature' % sensorId, '') == temperature)
+            assert(server.answer(owprotocol.MSG_SIZE, '/%s/temperature' % sensorId, '') == len(temperature))
+            assert(server.answer(owprotocol.MSG_READ, '/%s/' % sensorId, '') == -errno.EISDIR)
+            assert(server.answer(owprotocol.MSG_READ, '/%s/nothere' % sensorId, '') == -errno.ENOENT)
+            assert(server.answer(owprotocol.MSG_PRESENCE, '/%s' % sensorId, '') == 0)
+            assert(server.answer(owprotocol.MSG_DIRALL, '/bus.1', '').split(',')[0] == '/bus.1/' + self.capi.devices[1])
+        finally:
+            server.server_close()
+
+    def testServesSyntheticBus(self):
+        server = self.startServer()
+        client = self.getClient(server)
+        assert(sorted([e for e in client.dir('/') if not e.startswith('bus.')]) ==
+               [sensorId + '/' for sensorId in self.capi.devices])
+        sensorId = self.capi.devices[0]
+        assert(client.get('/%s/temperature' % sensorId) == self.capi.getDevice(sensorId)['temperature'])
+
+    def testReadErrors(self):
+        server = self.startServer(errorRate=1.0)
+        client = self.getClient(server)
+        assert(client.get('/%s/temperature' % self.capi.devices[0]) is None)
+        assert(server.errorCount == 1)
+        assert(client.dir('/'))
+
+    def testDroppedDevice(self):
+        server = self.startServer()
+        client = self.getClient(server)
+        sensorId = self.capi.devices[0]
+        server.dropDevice(sensorId)
+        assert(sensorId + '/' not in client.dir('/'))
+        assert(client.get('/%s/temperature' % sensorId) is None)
+        server.restoreDevice(sensorId)
+        assert(sensorId + '/' in client.dir('/'))
+
+    def testPingsWhileDelayed(self):
+        interval = owemulator.PING_INTERVAL
+        owemulator.PING_INTERVAL = 0.01
+        try:
+            server = self.startServer(latency=0.035)
+            client = self.getClient(server)
+            sensorId = self.capi.devices[0]
+            assert(client.get('/%s/type' % sensorId) == 'DS18B20')
+        finally:
+            owemulator.PING_INTERVAL = interval
+
+    def testOneWireNeoEndToEnd(self):
+        server = self.startServer(jitter=0.001)
+        conn = owprotocol.OwserverConnection(server.address, poolSize=2)
+        neo = onewireneo.OneWireNeo(desiredFeatures=set(FEATURES), connection=conn, maxWorkers=2)
+        try:
+            assert(len(neo.sensors) == 12)
+            server.dropDevice(self.capi.devices[3])
+            neo.refresh(force=True)
+            missing = [s.id for s in neo.sensors if s.status == SENSOR_STATUS.Missing]
+            assert(missing == [self.capi.devices[3]])
+        finally:
+            neo.close()
+            conn.finish()
+
+    def testAlarmPollingOverTheProtocol(self):
+        capi = owmock.MockCapi()
+        switchId, switch = owmock.syntheticDevice('29', 1)
+        capi.addDevice(switchId, switch)
+        server = OwserverEmulator(capi, seed=1).start()
+        self.servers.append(server)
+        conn = owprotocol.OwserverConnection(server.address)
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Sense]), connection=conn, alarmPolling=True,
+                                    alarmSafetyInterval=600)
+        try:
+            fields = switch['sensed.ALL'].split(',')
+            fields[1] = '1' if fields[1] == '0' else '0'
+            capi.setValue(switchId, 'sensed.ALL', ','.join(fields))
+            capi.setAlarm(switchId)
+            assert(neo._searchAlarms() == set(['/' + switchId + '/']))
+            neo.refresh()
+            assert(neo.sensors[0].getProperty('sensed.1').value == fields[1])
+            assert(capi.get('/alarm/') == '')
+        finally:
+            neo.close()
+            conn.finish()
+
+    def testAggregateOverTwoServers(self):
+        zones = [owmock.MockCapi(), owmock.MockCapi()]
+        zones[0].addDevice('28.000000000001', {'id': '28.000000000001', 'family': '28', 'temperature': '20.0'})
+        zones[1].addDevice('28.000000000002', {'id': '28.000000000002', 'family': '28', 'temperature': '30.0'})
+        servers = [OwserverEmulator(capi, seed=1).start() for capi in zones]
+        self.servers.extend(servers)
+        addresses = [server.address for server in servers]
+        neo = onewireneo.OneWireNeoAggregate(addresses, set([FEATURES.Temperature]),
+                                             connectionOptions={'poolSize': 1})
+        try:
+            assert([server.status for server in neo.servers] == [SERVER_STATUS.Online, SERVER_STATUS.Online])
+            assert(isinstance(neo.getServer(addresses[0]).neo._root, owprotocol.OwserverConnection))
+            assert(sorted(neo.sensors) == sorted(['%s/28.000000000001/' % addresses[0],
+                                                  '%s/28.000000000002/' % addresses[1]]))
+            zones[1].setValue('28.000000000002', 'temperature', '31.0')
+            neo.refresh(force=True)
+            assert(neo.getSensor(addresses[1], '/28.000000000002/').getProperty('temperature').value == 31.0)
+            assert(neo.getSensor(addresses[0], '/28.000000000001/').getProperty('temperature').value == 20.0)
+        finally:
+            neo.close()
+
+if __name__ == '__main__':
+    unittest.main()
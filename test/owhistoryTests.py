@@ -0,0 +1,81 @@
+__author__ = 'sdavidson'
+
+import math
+import random
+import unittest
+from owhistory import OneWireNeoHistory, OneWireNeoRollingWindow
+
+
+class OwhistoryTests(unittest.TestCase):
+    def bruteStats(self, values):
+        mean = sum(values) / len(values)
+        stddev = math.sqrt(sum([(v - mean) ** 2 for v in values]) / len(values))
+        return min(values), max(values), mean, stddev
+
+    def testAppend_wrapsOldestFirst(self):
+        history = OneWireNeoHistory(4)
+        for i in range(6):
+            history.append(100.0 + i, float(i))
+        assert(len(history) == 4)
+        assert(list(history.values()) == [2.0, 3.0, 4.0, 5.0])
+        assert(list(history.timestamps()) == [102.0, 103.0, 104.0, 105.0])
+        assert(history.latest() == (105.0, 5.0))
+
+    def testRollingWindow_matchesBruteForce(self):
+        rng = random.Random(42)
+        window = OneWireNeoRollingWindow(25)
+        samples = list()
+        for i in range(500):
+            value = rng.uniform(-40.0, 85.0)
+            samples.append(value)
+            window.push(value)
+            stats = window.stats()
+            expected = self.bruteStats(samples[-25:])
+            assert(stats.count == min(len(samples), 25))
+            assert(stats.min == expected[0])
+            assert(stats.max == expected[1])
+            assert(abs(stats.mean - expected[2]) < 1e-9)
+            assert(abs(stats.stddev - expected[3]) < 1e-6)
+
+    def testStats_perWindow(self):
+        history = OneWireNeoHistory(100, windows=(3, 10))
+        for i in range(20):
+            history.append(float(i), float(i))
+        assert(history.windows == (3, 10))
+        short = history.stats(3)
+        assert((short.min, short.max, short.mean) == (17.0, 19.0, 18.0))
+        longer = history.stats(10)
+        assert((longer.min, longer.max, longer.mean) == (10.0, 19.0, 14.5))
+        self.assertRaises(KeyError, history.stats, 5)
+
+    def testAddWindow_seedsFromHistory(self):
+        history = OneWireNeoHistory(10)
+        for i in range(10):
+            history.append(float(i), float(i))
+        history.addWindow(4)
+        assert(history.stats(4).mean == 7.5)
+
+    def testStatsSince(self):
+        history = OneWireNeoHistory(8)
+        for i in range(12):
+            history.append(float(i), float(i * 2))
+        stats = history.statsSince(9.0)
+        assert(stats.count == 3)
+        assert((stats.min, stats.max, stats.mean) == (18.0, 22.0, 20.0))
+        assert(history.statsSince(100.0).count == 0)
+        assert(history.statsSince(0.0).count == 8)
+
+    def testClear(self):
+        history = OneWireNeoHistory(4, windows=(2,))
+        history.append(1.0, 1.0)
+        history.clear()
+        assert(len(history) == 0)
+        assert(history.latest() is None)
+        assert(history.stats(2).count == 0)
+
+    def testInvalidSizes(self):
+        self.assertRaises(ValueError, OneWireNeoHistory, 0)
+        self.assertRaises(ValueError, OneWireNeoRollingWindow, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,382 @@
+__author__ = 'sdavidson'
+
+import random
+import re
+import threading
+import time
+from onewireneo import FEATURES, getKnownFamilies
+from owprotocol import Sensor
+
+'''
+    In-memory stand-in for pyowfs.  Mirrors the small part of the pyowfs API used by OneWireNeo (Connection, Sensor
+    and Dir nodes, shared with owprotocol, plus capi.get/capi.put) so OneWireNeo can be driven without an owserver.
+    Devices are registered with a flat dictionary of property paths, e.g. {'temperature': '21.5', 'pages/page.0': ''}.
+
+    With a cacheAge, cached reads behave like owserver's cache: a value or directory listing read through the cache
+    is served again unchanged for cacheAge seconds.  Reads with cached=False or under /uncached/ always see the
+    current state and refresh the cache.
+'''
+
+_BUS_ENTRY = re.compile('bus\.\d+$')
+
+
+'''
+    Simulated bus: every get/put sleeps for latency plus a uniformly distributed extra of up to jitter seconds
+'''
+class MockCapi(object):
+    def __init__(self, latency=0.0, jitter=0.0, seed=None, cacheAge=None):
+        self._devices = dict()
+        self._buses = dict()
+        self._alarms = set()
+        self._cache = dict()
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self.latency = latency
+        self.jitter = jitter
+        self.cacheAge = cacheAge
+        self.reads = 0
+        self.writes = 0
+        self.readLog = list()
+        self.writeLog = list()
+
+    def addDevice(self, sensorId, properties, bus=None):
+        self._devices[sensorId] = dict(properties)
+        self._buses[sensorId] = bus
+
+    def removeDevice(self, sensorId):
+        self._devices.pop(sensorId, None)
+        self._buses.pop(sensorId, None)
+
+    def setValue(self, sensorId, propName, value):
+        self._devices[sensorId][propName] = value
+
+    '''
+        Put a device into (or take it out of) the alarm directory; writing its latches takes it out as well
+    '''
+    def setAlarm(self, sensorId, alarmed=True):
+        if alarmed:
+            self._alarms.add(sensorId)
+        else:
+            self._alarms.discard(sensorId)
+
+    def getBus(self, sensorId):
+        return self._buses.get(sensorId)
+
+    def getDevice(self, sensorId):
+        return self._devices.get(sensorId)
+
+    devices = property(lambda self: tuple(sorted(self._devices)))
+
+    def resetCounters(self):
+        with self._lock:
+            self.reads = 0
+            self.writes = 0
+            self.readLog = list()
+            self.writeLog = list()
+
+    def get(self, path, cached=True):
+        with self._lock:
+            self.reads += 1
+            self.readLog.append(path)
+        self._delay()
+        if self.cacheAge is None:
+            return self._resolve(path)
+        key, uncached = self._cacheKey(path)
+        now = time.time()
+        if cached and not uncached:
+            entry = self._cache.get(key)
+            if entry is not None and now - entry[1] < self.cacheAge:
+                return entry[0]
+        value = self._resolve(path)
+        with self._lock:
+            self._cache[key] = (value, now)
+        return value
+
+    def put(self, path, value):
+        with self._lock:
+            self.writes += 1
+            self.writeLog.append((path, value))
+        self._delay()
+        bus, sensorId, rel = self._split(path)
+        if sensorId == 'simultaneous':
+            return True
+        # like owserver, a write drops what the cache holds for the device
+        with self._lock:
+            for key in [key for key in self._cache if '/%s/' % sensorId in key + '/']:
+                del self._cache[key]
+        if sensorId is None or not self._devices.has_key(sensorId) or not self._devices[sensorId].has_key(rel):
+            return False
+        if rel.lower().startswith('latch.'):
+            # any write clears every latch of the device, and with them the alarm
+            self._alarms.discard(sensorId)
+            props = self._devices[sensorId]
+            for name in props:
+                if name.lower().startswith('latch.'):
+                    props[name] = ','.join(['0'] * len(props[name].split(','))) if ',' in props[name] else '0'
+            return True
+        self._devices[sensorId][rel] = str(value)
+        return True
+
+    '''
+        True when path names a directory: the root, a bus, a device or a subdirectory within one
+    '''
+    def isDir(self, path):
+        bus, sensorId, rel = self._split(path)
+        if sensorId is None or (sensorId == 'alarm' and not rel):
+            return True
+        props = self._devices.get(sensorId)
+        if props is None or (bus is not None and self._buses[sensorId] != bus):
+            return False
+        return not props.has_key(rel) and self._listDir(props, rel) is not None
+
+    def _delay(self):
+        delay = self.latency
+        if self.jitter:
+            delay += self._random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    '''
+        (path without its /uncached prefix, whether it had one)
+    '''
+    def _cacheKey(self, path):
+        parts = [part for part in path.split('/') if part]
+        uncached = bool(parts) and parts[0] == 'uncached'
+        return '/' + '/'.join(parts[1:] if uncached else parts), uncached
+
+    def _split(self, path):
+        parts = [part for part in path.split('/') if part]
+        if parts and parts[0] == 'uncached':
+            parts = parts[1:]
+        bus = None
+        if parts and _BUS_ENTRY.match(parts[0]):
+            bus = parts[0]
+            parts = parts[1:]
+        if not parts:
+            return bus, None, ''
+        return bus, parts[0], '/'.join(parts[1:])
+
+    def _resolve(self, path):
+        bus, sensorId, rel = self._split(path)
+        if sensorId is None:
+            return self._listBus(bus)
+        if sensorId == 'alarm' and not rel:
+            return ','.join([alarmed + '/' for alarmed in sorted(self._alarms) if self._devices.has_key(alarmed) and
+                             (bus is None or self._buses[alarmed] == bus)])
+        if not self._devices.has_key(sensorId):
+            return None
+        if bus is not None and self._buses[sensorId] != bus:
+            return None
+        props = self._devices[sensorId]
+        if props.has_key(rel):
+            return props[rel]
+        return self._listDir(props, rel)
+
+    def _listBus(self, bus):
+        entries = list()
+        for sensorId in sorted(self._devices):
+            if bus is None or self._buses[sensorId] == bus:
+                entries.append(sensorId + '/')
+        if bus is None:
+            for name in sorted(set([b for b in self._buses.values() if b is not None])):
+                entries.append(name + '/')
+        return ','.join(entries)
+
+    def _listDir(self, props, rel):
+        prefix = rel + '/' if rel else ''
+        entries = list()
+        for key in sorted(props):
+            if key.startswith(prefix):
+                remainder = key[len(prefix):]
+                slash = remainder.find('/')
+                entry = remainder if slash < 0 else remainder[:slash + 1]
+                if entry not in entries:
+                    entries.append(entry)
+        if not entries:
+            return None
+        return ','.join(entries)
+
+
+class MockConnection(Sensor):
+    def __init__(self, capi=None):
+        Sensor.__init__(self, '/', capi if capi is not None else MockCapi())
+
+    def __repr__(self):
+        return "<MockConnection %s>" % self._path
+
+    def finish(self):
+        pass
+
+
+'''
+    Synthetic devices.  Property trees follow what owfs shows for each family (and what _SOURCE_PATTERNS expects),
+    including third-party layouts such as the AAG TAI8570 pressure/temperature sensor on a DS2406.  Families with
+    no explicit layout get one assembled from the property groups of their features.
+'''
+_COMMON_PROPERTIES = ('address', 'alias', 'crc8', 'locator', 'power', 'present', 'r_address', 'r_id', 'r_locator')
+
+_FAMILY_TYPES = {
+    '01': 'DS2401', '02': 'DS1425', '04': 'DS2404', '05': 'DS2405', '06': 'DS1993', '08': 'DS1992', '09': 'DS2502',
+    '0A': 'DS1995', '0B': 'DS2505', '0C': 'DS1996', '0F': 'DS2506', '10': 'DS18S20', '12': 'DS2406', '14': 'DS2430A',
+    '18': 'DS1963S', '1B': 'DS2436', '1C': 'DS28E04-100', '1D': 'DS2423', '1E': 'DS2437', '1F': 'DS2409',
+    '20': 'DS2450', '21': 'DS1921', '22': 'DS1822', '23': 'DS2433', '24': 'DS2415', '26': 'DS2438', '27': 'DS2417',
+    '28': 'DS18B20', '29': 'DS2408', '2C': 'DS2890', '2D': 'DS2431', '2E': 'DS2770', '30': 'DS2760', '35': 'DS2755',
+    '36': 'DS2740', '37': 'DS1977', '3A': 'DS2413', '3B': 'DS1825', '3D': 'DS2781', '42': 'DS28EA00',
+    '43': 'DS28EC20', '51': 'DS2751', 'EE': 'UVI', 'EF': 'HobbyBoards_EF'
+}
+
+'''
+    Default mix of families for synthetic buses, as (family code, weight); mostly thermometers, like most buses
+'''
+DEFAULT_FAMILY_MIX = (('28', 50), ('10', 10), ('26', 8), ('1D', 6), ('12', 6), ('29', 5), ('05', 5), ('20', 5),
+                      ('23', 5))
+
+
+def _reading(rng, low, high):
+    return '%12.6f' % rng.uniform(low, high)
+
+def _channels(rng, names, values):
+    retval = dict()
+    for name in names:
+        retval[name] = rng.choice(values)
+    return retval
+
+def _aggregate(prefix, channels, props, allName='ALL'):
+    props['%s.%s' % (prefix, allName)] = ','.join([props['%s.%s' % (prefix, c)] for c in channels])
+
+def _memory(rng, pageCount, pageSize=32):
+    memory = ''.join([chr(rng.randint(0, 255)) for i in range(pageCount * pageSize)])
+    props = {'memory': memory, 'pages/page.ALL': memory}
+    for page in range(pageCount):
+        props['pages/page.%d' % page] = memory[page * pageSize:(page + 1) * pageSize]
+    return props
+
+def _temperatureGroup(rng):
+    temperature = rng.uniform(-10, 40)
+    props = {'temperature': '%12.4f' % temperature, 'fasttemp': '%12.1f' % temperature,
+             'temphigh': '%12.1f' % 75, 'templow': '%12.1f' % 10}
+    for bits in (9, 10, 11, 12):
+        props['temperature%d' % bits] = '%12.4f' % temperature
+    return props
+
+def _counterGroup(rng):
+    props = {'counters.A': '%12d' % rng.randint(0, 100000), 'counters.B': '%12d' % rng.randint(0, 100000)}
+    _aggregate('counters', 'AB', props)
+    return props
+
+def _voltageGroup(rng):
+    props = _channels(rng, ['volt.%s' % c for c in 'ABCD'], ['%12.6f' % v for v in (0.0, 1.25, 2.5, 4.98)])
+    _aggregate('volt', 'ABCD', props)
+    return props
+
+def _senseGroup(rng):
+    props = _channels(rng, ['sensed.A', 'sensed.B'], ['0', '1'])
+    _aggregate('sensed', 'AB', props)
+    props['sensed.BYTE'] = '%12d' % (int(props['sensed.A']) + 2 * int(props['sensed.B']))
+    return props
+
+def _pioGroup(rng):
+    props = _channels(rng, ['PIO.A', 'PIO.B', 'latch.A', 'latch.B'], ['0', '1'])
+    _aggregate('PIO', 'AB', props)
+    _aggregate('latch', 'AB', props)
+    props['PIO.BYTE'] = '%12d' % (int(props['PIO.A']) + 2 * int(props['PIO.B']))
+    props['latch.BYTE'] = '%12d' % (int(props['latch.A']) + 2 * int(props['latch.B']))
+    return props
+
+_FEATURE_GROUPS = {
+    FEATURES.Temperature: _temperatureGroup,
+    FEATURES.Humidity: lambda rng: {'humidity': _reading(rng, 20, 90), 'HIH4000/humidity': _reading(rng, 20, 90)},
+    FEATURES.Pressure: lambda rng: {'B1-R1-A/pressure': _reading(rng, 28, 31), 'B1-R1-A/gain': '1'},
+    FEATURES.Counter: _counterGroup,
+    FEATURES.Voltage: _voltageGroup,
+    FEATURES.Current: lambda rng: {'current': _reading(rng, 0, 2), 'amphours': _reading(rng, 0, 100)},
+    FEATURES.Sense: _senseGroup,
+    FEATURES.Pio: _pioGroup,
+    FEATURES.Memory: lambda rng: _memory(rng, 4),
+    FEATURES.Clock: lambda rng: {'date': 'Sat Oct 17 12:00:00 2026', 'udate': '%12d' % 1792238400},
+    FEATURES.Illumination: lambda rng: {'S3-R1-A/illumination': _reading(rng, 0, 1000), 'S3-R1-A/gain': '1'},
+    FEATURES.UV: lambda rng: {'uvi/uvi': _reading(rng, 0, 11), 'uvi/uvi-offset': '0', 'uvi/valid': '1',
+                              'uvi/in_case': '1'},
+    FEATURES.CO2: lambda rng: {'co2/ppm': '%12d' % rng.randint(400, 2000), 'co2/power': '1', 'co2/status': '1'},
+    FEATURES.LCD: lambda rng: {'LCD_H/message': '', 'LCD_H/clear': '0'}
+}
+
+def _ds2406Tai8570(rng):
+    props = _senseGroup(rng)
+    props.update(_pioGroup(rng))
+    props.update(_memory(rng, 4))
+    props['channels'] = '2'
+    props['TAI8570/pressure'] = _reading(rng, 950, 1050)
+    props['TAI8570/temperature'] = _reading(rng, -10, 40)
+    props['TAI8570/sibling'] = '12.%012X' % rng.randint(0, 0xFFFFFFFF)
+    for channel in range(8):
+        props['T8A/volt.%d' % channel] = _reading(rng, 0, 5)
+    _aggregate('T8A/volt', '01234567', props)
+    return props
+
+def _ds2438(rng):
+    props = {'temperature': _reading(rng, -10, 40), 'VAD': _reading(rng, 0, 10), 'VDD': _reading(rng, 4.5, 5.5),
+             'vis': _reading(rng, -0.25, 0.25), 'humidity': _reading(rng, 20, 90),
+             'HIH4000/humidity': _reading(rng, 20, 90), 'date': 'Sat Oct 17 12:00:00 2026',
+             'udate': '%12d' % 1792238400, 'MultiSensor/type': 'MS-TH',
+             'B1-R1-A/pressure': _reading(rng, 28, 31), 'B1-R1-A/gain': '1',
+             'S3-R1-A/illumination': _reading(rng, 0, 1000), 'S3-R1-A/current': _reading(rng, 0, 1)}
+    props.update(_memory(rng, 8, 8))
+    return props
+
+def _ds2423(rng):
+    props = _counterGroup(rng)
+    props.update(_memory(rng, 16))
+    for page in range(16):
+        props['pages/count.%d' % page] = '%12d' % rng.randint(0, 100000)
+    return props
+
+def _ds2408(rng):
+    props = _channels(rng, ['PIO.%d' % c for c in range(8)] + ['sensed.%d' % c for c in range(8)] +
+                      ['latch.%d' % c for c in range(8)], ['0', '1'])
+    for prefix in ('PIO', 'sensed', 'latch'):
+        _aggregate(prefix, '01234567', props)
+        props['%s.BYTE' % prefix] = '%12d' % sum([int(props['%s.%d' % (prefix, c)]) << c for c in range(8)])
+    props.update({'LCD_H/message': '', 'LCD_H/clear': '0', 'strobe': '0', 'por': '0'})
+    return props
+
+_FAMILY_LAYOUTS = {
+    '12': _ds2406Tai8570,
+    '1D': _ds2423,
+    '26': _ds2438,
+    '29': _ds2408
+}
+
+'''
+    Property dictionary for one synthetic device of the given family
+'''
+def syntheticDevice(familyCode, serial, rng=None):
+    rng = rng if rng is not None else random.Random(serial)
+    sensorId = '%s.%012X' % (familyCode, serial)
+    family = [f for f in getKnownFamilies() if f.familyCode == familyCode]
+    props = dict([(name, '0') for name in _COMMON_PROPERTIES])
+    props.update({'id': sensorId, 'family': familyCode, 'type': _FAMILY_TYPES.get(familyCode, 'unknown')})
+    layout = _FAMILY_LAYOUTS.get(familyCode)
+    if layout is not None:
+        props.update(layout(rng))
+    elif family:
+        for feature in family[0].features:
+            props.update(_FEATURE_GROUPS[feature](rng))
+    return sensorId, props
+
+'''
+    Populate capi with deviceCount synthetic devices spread round-robin over busCount buses.  families is a
+    sequence of (family code, weight) pairs; 'all' gives every known family which has features an equal share.
+'''
+def buildSyntheticBus(capi, deviceCount, families=DEFAULT_FAMILY_MIX, busCount=1, seed=0):
+    rng = random.Random(seed)
+    if families == 'all':
+        families = [(f.familyCode, 1) for f in getKnownFamilies() if f.features]
+    codes = list()
+    for code, weight in families:
+        codes.extend([code] * weight)
+    for index in range(deviceCount):
+        familyCode = codes[index % len(codes)] if families == DEFAULT_FAMILY_MIX else rng.choice(codes)
+        sensorId, props = syntheticDevice(familyCode, index + 1, rng)
+        capi.addDevice(sensorId, props, 'bus.%d' % (index % busCount))
+    return MockConnection(capi)
@@ -0,0 +1,86 @@
+__author__ = 'sdavidson'
+
+import unittest
+import onewireneo
+import onewireneoBench
+import owmock
+from onewireneo import FEATURES
+
+
+class OwmockTests(unittest.TestCase):
+    def testSyntheticDevice_coversFeatures(self):
+        for family in onewireneo.getKnownFamilies():
+            if not family.features:
+                continue
+            sensorId, props = owmock.syntheticDevice(family.familyCode, 1)
+            assert(sensorId == family.familyCode + '.000000000001')
+            assert(props['family'] == family.familyCode)
+            found = onewireneo.classifyAttributes(props.keys()).values()
+            for feature in family.features:
+                if feature is not FEATURES.LCD:
+                    assert([f for f in found if f is feature]), (family.familyCode, feature)
+
+    def testSyntheticDevice_tai8570(self):
+        sensorId, props = owmock.syntheticDevice('12', 7)
+        desired = onewireneo.getDesiredAttributes(props.keys(), set([FEATURES.Pressure]))
+        assert('TAI8570/pressure' in desired)
+        assert(len(props['T8A/volt.ALL'].split(',')) == 8)
+
+    def testBuildSyntheticBus(self):
+        capi = owmock.MockCapi()
+        conn = owmock.buildSyntheticBus(capi, 40, busCount=3)
+        assert(len(capi.devices) == 40)
+        assert(set([capi.getBus(sensorId) for sensorId in capi.devices]) == set(['bus.0', 'bus.1', 'bus.2']))
+        neo = onewireneo.OneWireNeo(desiredFeatures=set(FEATURES), connection=conn)
+        try:
+            assert(len(neo.sensors) == 40)
+        finally:
+            neo.close()
+
+    def testBuildSyntheticBus_isRepeatable(self):
+        first, second = owmock.MockCapi(), owmock.MockCapi()
+        owmock.buildSyntheticBus(first, 25, families='all', seed=3)
+        owmock.buildSyntheticBus(second, 25, families='all', seed=3)
+        assert(first.devices == second.devices)
+        assert([first.getDevice(s) for s in first.devices] == [second.getDevice(s) for s in second.devices])
+
+    def testJitter(self):
+        capi = owmock.MockCapi(latency=0.0, jitter=0.001, seed=1)
+        capi.addDevice('28.000000000001', {'temperature': '20.0'})
+        assert(capi.get('/28.000000000001/temperature') == '20.0')
+
+    def testAlarmDirectory(self):
+        capi = owmock.MockCapi()
+        sensorId, props = owmock.syntheticDevice('29', 1)
+        capi.addDevice(sensorId, props, 'bus.1')
+        assert(capi.isDir('/alarm') and capi.get('/alarm') == '')
+        capi.setAlarm(sensorId)
+        assert(capi.get('/alarm') == sensorId + '/' and capi.get('/bus.1/alarm') == sensorId + '/')
+        assert(capi.get('/bus.0/alarm') == '')
+        assert(capi.put('/%s/latch.BYTE' % sensorId, '1'))
+        assert(capi.get('/alarm') == '' and capi.get('/%s/latch.ALL' % sensorId) == '0,0,0,0,0,0,0,0')
+
+    def testCache(self):
+        capi = owmock.MockCapi(cacheAge=60)
+        capi.addDevice('28.000000000001', {'temperature': '20.0', 'power': '1'})
+        assert(capi.get('/28.000000000001/temperature') == '20.0')
+        capi.setValue('28.000000000001', 'temperature', '21.0')
+        assert(capi.get('/28.000000000001/temperature') == '20.0')
+        assert(capi.get('/28.000000000001/temperature', cached=False) == '21.0')
+        capi.setValue('28.000000000001', 'temperature', '22.0')
+        assert(capi.get('/uncached/28.000000000001/temperature') == '22.0')
+        assert(capi.get('/28.000000000001/temperature') == '22.0')
+        capi.setValue('28.000000000001', 'temperature', '23.0')
+        assert(capi.put('/28.000000000001/power', '0'))
+        assert(capi.get('/28.000000000001/temperature') == '23.0')
+        assert(owmock.MockCapi().get('/') == '')
+
+    def testBenchmarkRun(self):
+        result = onewireneoBench.runSize(10, repeat=1)
+        assert(result['sensors'] == 10)
+        assert(result['cycleReads'] > 0 and result['firstReads'] >= result['cycleReads'])
+        assert(result['memory'] > 0)
+        assert(not onewireneoBench.compareResult(result, result, 0.0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+__author__ = 'sdavidson'
+
+import unittest
+import onewireneo
+import owmock
+import owprotocol
+from onewireneo import FEATURES
+from owemulator import OwserverEmulator
+
+
+class OwprotocolTests(unittest.TestCase):
+    def setUp(self):
+        self.capi = owmock.MockCapi()
+        self.capi.addDevice('10.147A0A020800', {'id': '10.147A0A020800', 'family': '10', 'type': 'DS18S20',
+                                                'temperature': '37.2', 'errata/trim': '1'})
+        self.capi.addDevice('05.147A0A020800', {'id': '05.147A0A020800', 'family': '05', 'type': 'DS2405',
+                                                'PIO': '0', 'sensed': '1'})
+        self.servers = list()
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+
+    def startServer(self, persistence=True):
+        server = OwserverEmulator(self.capi, persistence=persistence).start()
+        self.servers.append(server)
+        return server
+
+    def testParseAddress(self):
+        assert(owprotocol.parseAddress('192.168.0.42:4305') == ('192.168.0.42', 4305))
+        assert(owprotocol.parseAddress('owhost') == ('owhost', 4304))
+
+    def testParseListing(self):
+        entries = owprotocol.parseListing('/10.147A0A020800/temperature,/10.147A0A020800/errata/\0')
+        assert(entries == ['temperature', 'errata/'])
+
+    def testGetMany_pipelinesOnOneConnection(self):
+        server = self.startServer()
+        client = owprotocol.OwserverClient(server.address, poolSize=1, pipelineDepth=8)
+        try:
+            paths = ['/10.147A0A020800/temperature', '/10.147A0A020800/type', '/05.147A0A020800/PIO',
+                     '/10.147A0A020800/missing']
+            values = client.getMany(paths)
+            assert(values == ['37.2', 'DS18S20', '0', None])
+            assert(client.requests == 4)
+            # the first request negotiates persistence, the remaining three share one round trip
+            assert(client.roundTrips == 2)
+        finally:
+            client.close()
+
+    def testGetMany_withoutPersistence(self):
+        server = self.startServer(persistence=False)
+        client = owprotocol.OwserverClient(server.address)
+        try:
+            values = client.getMany(['/10.147A0A020800/temperature', '/05.147A0A020800/sensed'])
+            assert(values == ['37.2', '1'])
+            assert(client.roundTrips == 2)
+        finally:
+            client.close()
+
+    def testDirAndWalk(self):
+        server = self.startServer()
+        client = owprotocol.OwserverClient(server.address)
+        try:
+            assert(client.dir('/') == ['05.147A0A020800/', '10.147A0A020800/'])
+            assert(client.get('/10.147A0A020800/') == 'errata/,family,id,temperature,type')
+            assert(sorted(client.walk('/10.147A0A020800/')) == ['errata/trim', 'family', 'id', 'temperature', 'type'])
+        finally:
+            client.close()
+
+    def testPut(self):
+        server = self.startServer()
+        client = owprotocol.OwserverClient(server.address)
+        try:
+            assert(client.put('/05.147A0A020800/PIO', 1))
+            assert(client.get('/05.147A0A020800/PIO') == '1')
+            assert(not client.put('/05.147A0A020800/nothere', 1))
+        finally:
+            client.close()
+
+    def testConnectFailure(self):
+        server = self.startServer()
+        address = server.address
+        server.stop()
+        self.servers.remove(server)
+        client = owprotocol.OwserverClient(address)
+        self.assertRaises(owprotocol.OwserverException, client.get, '/')
+
+    def testOneWireNeoOverOwserver(self):
+        server = self.startServer()
+        conn = owprotocol.OwserverConnection(server.address, poolSize=2)
+        neo = onewireneo.OneWireNeo(desiredFeatures=set([FEATURES.Temperature, FEATURES.Pio]), connection=conn)
+        try:
+            sensors = dict([(sensor.id, sensor) for sensor in neo.sensors])
+            assert(len(sensors) == 2)
+            assert(sensors['10.147A0A020800'].getProperty('temperature').value == 37.2)
+            assert(sensors['05.147A0A020800'].getProperty('PIO').value == '0')
+        finally:
+            neo.close()
+            conn.finish()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+__author__ = 'sdavidson'
+
+import math
+import unittest
+from onewireneo import FEATURES
+from owquery import OneWireNeoReadings
+
+
+class OwqueryTests(unittest.TestCase):
+    def buildReadings(self, **options):
+        readings = OneWireNeoReadings(**options)
+        for i in range(4):
+            readings.update('28.%012X' % i, 'temperature', FEATURES.Temperature, 1000.0, 20.0 + i)
+        readings.update('26.000000000001', 'VAD', FEATURES.Voltage, 1000.0, 4.9)
+        readings.update('26.000000000001', 'humidity', FEATURES.Humidity, 1000.0, 55.0)
+        return readings
+
+    def testSelect(self):
+        readings = self.buildReadings()
+        assert(len(readings) == 6)
+        query = readings.select(feature=FEATURES.Temperature)
+        assert(len(query) == 4 and query.count() == 4)
+        assert(query.min() == 20.0 and query.max() == 23.0 and query.mean() == 21.5)
+        assert(query.percentile(50) == 21.5)
+        assert(len(readings.select(family='26')) == 2)
+        assert(readings.select(prefix='28.000000000002').keys == [('28.000000000002', 'temperature')])
+        assert(readings.select(name='VAD').values.tolist() == [4.9])
+        assert(len(readings.select(feature=FEATURES.Temperature, family='26')) == 0)
+        assert(readings.select(feature=FEATURES.Pressure).mean() is None)
+
+    def testMissingValues(self):
+        readings = self.buildReadings()
+        readings.update('28.000000000003', 'temperature', FEATURES.Temperature, 1010.0, None)
+        query = readings.select(feature=FEATURES.Temperature)
+        assert(len(query) == 4 and query.count() == 3)
+        assert(query.max() == 22.0)
+        assert(math.isnan(query.values[3]))
+
+    def testOutside(self):
+        readings = self.buildReadings()
+        query = readings.select(feature=FEATURES.Temperature)
+        assert(query.outside(21.0, 22.0) == [('28.000000000000', 'temperature', 20.0),
+                                             ('28.000000000003', 'temperature', 23.0)])
+        assert(query.mask(high=22.5).tolist() == [False, False, False, True])
+        assert(query.outside() == [])
+
+    def testWindow(self):
+        readings = OneWireNeoReadings(capacity=4)
+        for step in range(6):
+            readings.update('28.000000000000', 'temperature', FEATURES.Temperature, 1000.0 + step * 10, 20.0 + step)
+            readings.update('28.000000000001', 'temperature', FEATURES.Temperature, 1000.0 + step * 10, 30.0)
+        query = readings.select(feature=FEATURES.Temperature)
+        window = query.window(20, now=1050.0)
+        assert(window.count() == 6)
+        assert(window.rowMeans().tolist() == [24.0, 30.0])
+        assert(window.outside(high=29.0) == [('28.000000000001', 'temperature')])
+        # capacity 4 keeps only the samples from 1020 on
+        assert(query.window(1000, now=1050.0).min() == 22.0)
+        assert(query.window(5, now=2000.0).count() == 0)
+        assert(math.isnan(query.window(5, now=2000.0).rowMeans()[0]))
+
+    def testGrowth(self):
+        readings = OneWireNeoReadings(capacity=2, initialRows=2)
+        for i in range(300):
+            readings.update('28.%012X' % i, 'temperature', FEATURES.Temperature, 1000.0, float(i))
+        query = readings.select(feature=FEATURES.Temperature)
+        assert(len(query) == 300 and query.max() == 299.0)
+        assert(query.keys[150] == ('28.000000000096', 'temperature'))
+        assert(query.window(10, now=1000.0).count() == 300)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+__author__ = 'sdavidson'
+
+import math
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import owrecorder
+from owrecorder import HEADER, RECORD, OneWireNeoLogReader, OneWireNeoRecorder
+
+
+class OwrecorderTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def record(self, recorder, count, sensorCount=3, start=1000.0):
+        for i in range(count):
+            recorder.record('28.%012X' % (i % sensorCount), 'temperature', start + i, 20.0 + i, 4)
+
+    def testRoundTrip(self):
+        recorder = OneWireNeoRecorder(self.directory, flushInterval=0.01)
+        try:
+            self.record(recorder, 30)
+            recorder.record('28.000000000000', 'temperature', 1030.0, None, 6)
+            recorder.record('28.000000000000', 'humidity', 1030.0, 55, 3)
+        finally:
+            recorder.close()
+        assert(recorder.written == 32)
+        reader = OneWireNeoLogReader(self.directory)
+        assert(reader.properties() == [('28.000000000000', 'humidity'), ('28.000000000000', 'temperature'),
+                                       ('28.000000000001', 'temperature'), ('28.000000000002', 'temperature')])
+        timestamps, values, statuses = reader.read('28.000000000001', 'temperature')
+        assert(list(timestamps) == [1001.0 + i for i in range(0, 30, 3)])
+        assert(list(values) == [21.0 + i for i in range(0, 30, 3)])
+        assert(set(statuses) == set([4]))
+        timestamps, values, statuses = reader.read('28.000000000000', 'temperature', 1010.0, 1030.0)
+        assert(list(timestamps) == [1012.0, 1015.0, 1018.0, 1021.0, 1024.0, 1027.0, 1030.0])
+        assert(math.isnan(values[-1]) and statuses[-1] == 6)
+        assert(list(reader.read('28.000000000000', 'humidity')[1]) == [55.0])
+        assert(list(reader.read('28.000000000000', 'temperature', 2000.0)[0]) == [])
+        assert(len(reader.read('28.999999999999', 'temperature')[0]) == 0)
+
+    def testRotationAndReopen(self):
+        segmentSize = HEADER.size + 10 * RECORD.size
+        recorder = OneWireNeoRecorder(self.directory, segmentSize=segmentSize)
+        self.record(recorder, 25)
+        recorder.close()
+        assert(owrecorder.listSegments(self.directory) == [1, 2, 3])
+        for number in (1, 2):
+            path = os.path.join(self.directory, owrecorder.segmentName(number))
+            assert(os.path.getsize(path) == segmentSize)
+        recorder = OneWireNeoRecorder(self.directory, segmentSize=segmentSize)
+        self.record(recorder, 6, start=1025.0)
+        recorder.record('28.000000000005', 'temperature', 1031.0, 1.0, 4)
+        recorder.close()
+        assert(owrecorder.listSegments(self.directory) == [1, 2, 3, 4])
+        properties = owrecorder.loadProperties(self.directory)
+        assert(properties[3] == ('28.000000000005', 'temperature'))
+        reader = OneWireNeoLogReader(self.directory)
+        timestamps = reader.read('28.000000000001', 'temperature', 1005.0, 1027.0)[0]
+        assert(list(timestamps) == [1007.0, 1010.0, 1013.0, 1016.0, 1019.0, 1022.0, 1026.0])
+
+    def testReadWhileRecording(self):
+        recorder = OneWireNeoRecorder(self.directory, flushInterval=0.01)
+        try:
+            self.record(recorder, 9)
+            recorder.flush()
+            reader = OneWireNeoLogReader(self.directory)
+            assert(len(reader.read('28.000000000002', 'temperature')[0]) == 3)
+            recorder.record('28.000000000009', 'temperature', 1010.0, 1.0, 4)
+            recorder.flush()
+            assert(list(reader.read('28.000000000009', 'temperature')[0]) == [1010.0])
+        finally:
+            recorder.close()
+
+    def testFlushWaitsForTheWrite(self):
+        class SlowRecorder(OneWireNeoRecorder):
+            def _write(self, records, newProperties):
+                time.sleep(0.02)
+                OneWireNeoRecorder._write(self, records, newProperties)
+
+        recorder = SlowRecorder(self.directory, flushInterval=0.01)
+        try:
+            for batch in range(3):
+                self.record(recorder, 30, start=1000.0 + 30 * batch)
+                recorder.flush()
+                assert(recorder.written == 30 * (batch + 1))
+                assert(len(OneWireNeoLogReader(self.directory).read('28.000000000000', 'temperature')[0]) ==
+                       10 * (batch + 1))
+        finally:
+            recorder.close()
+        recorder.flush()
+
+    def testIndexSkipsBlocksWithoutTheProperty(self):
+        recorder = OneWireNeoRecorder(self.directory, blockRecords=10)
+        for i in range(100):
+            sensorId = '28.000000000099' if i == 35 else '28.%012X' % (i % 5)
+            recorder.record(sensorId, 'temperature', 1000.0 + i, float(i), 4)
+        recorder.close()
+        reader = OneWireNeoLogReader(self.directory)
+        assert(list(reader.read('28.000000000099', 'temperature')[0]) == [1035.0])
+        assert(reader._scanned == 10)
+        reader._scanned = 0
+        assert(list(reader.read('28.000000000001', 'temperature', 1020.0, 1039.0)[1]) == [21.0, 26.0, 31.0, 36.0])
+        assert(reader._scanned == 20)
+
+    def testOutOfOrderTimestamps(self):
+        recorder = OneWireNeoRecorder(self.directory, flushInterval=0.01, blockRecords=4)
+        try:
+            for timestamp in (1000.0, 1005.0, 1010.0, 1015.0, 990.0, 1020.0, 1025.0):
+                recorder.record('28.000000000001', 'temperature', timestamp, timestamp - 1000.0, 4)
+            recorder.flush()
+            reader = OneWireNeoLogReader(self.directory)
+            # 990 sits in the unindexed tail while recording, in an indexed block afterwards
+            assert(list(reader.read('28.000000000001', 'temperature', 985.0, 1000.0)[0]) == [1000.0, 990.0])
+        finally:
+            recorder.close()
+        reader = OneWireNeoLogReader(self.directory)
+        assert(list(reader.read('28.000000000001', 'temperature', 985.0, 1000.0)[0]) == [1000.0, 990.0])
+        assert(list(reader.read('28.000000000001', 'temperature', 1012.0)[0]) == [1015.0, 1020.0, 1025.0])
+
+    def testDropsWhenBehind(self):
+        recorder = OneWireNeoRecorder(self.directory, flushInterval=60.0, maxPending=5)
+        self.record(recorder, 8)
+        assert(recorder.pending == 5 and recorder.dropped == 3)
+        recorder.close()
+        assert(recorder.written == 5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+__author__ = 'sdavidson'
+
+import json
+import unittest
+import owsnapshot
+from owsnapshot import CHUNK_SIZE, OneWireNeoSnapshotStore
+
+
+class OwsnapshotTests(unittest.TestCase):
+    def buildStore(self, sensorCount, propsPerSensor=4):
+        store = OneWireNeoSnapshotStore()
+        for sensor in range(sensorCount):
+            sensorId = '28.%012X' % sensor
+            store.setSensor(sensorId, 'Available')
+            for prop in range(propsPerSensor):
+                store.update(sensorId, 'prop%d' % prop, float(sensor + prop), 'Changed', 1000.0 + sensor, 'Numeric')
+        return store
+
+    def testRowsAndColumns(self):
+        store = self.buildStore(2, 2)
+        store.update('28.000000000000', 'memory', '\x00\xff', 'Changed', None, 'Binary')
+        snapshot = store.snapshot()
+        assert(len(snapshot) == 5)
+        assert(snapshot.column('sensorId') == ('28.000000000000',) * 2 + ('28.000000000001',) * 2 +
+               ('28.000000000000',))
+        assert(snapshot.column('value')[:4] == (0.0, 1.0, 1.0, 2.0))
+        assert(sorted(snapshot.columns()) == sorted(owsnapshot.COLUMNS))
+        assert(snapshot.get('28.000000000001', 'prop1') == {'sensorId': '28.000000000001', 'name': 'prop1',
+                                                            'value': 2.0, 'status': 'Changed', 'timestamp': 1001.0,
+                                                            'kind': 'Numeric'})
+        assert(snapshot.get('28.000000000001', 'nothere') is None)
+        data = snapshot.asDict()
+        assert(data['28.000000000000']['status'] == 'Available')
+        assert(data['28.000000000000']['properties']['memory']['timestamp'] is None)
+        exported = json.loads(snapshot.toJson())
+        assert(exported['sensors']['28.000000000000']['properties']['memory']['value'] == '00ff')
+        assert(exported['version'] == snapshot.version)
+
+    def testSnapshotIsImmutable(self):
+        store = self.buildStore(1, 1)
+        first = store.snapshot()
+        store.update('28.000000000000', 'prop0', 42.0, 'Increased', 2000.0, 'Numeric')
+        store.update('28.000000000000', 'prop1', 1.0, 'Changed', 2000.0, 'Numeric')
+        assert(first.column('value') == (0.0,))
+        assert(len(first) == 1 and first.get('28.000000000000', 'prop1') is None)
+        assert(store.snapshot().column('value') == (42.0, 1.0))
+
+    def testUnchangedChunksAreShared(self):
+        store = self.buildStore(200)
+        first = store.snapshot()
+        assert(len(first.chunks) == (800 + CHUNK_SIZE - 1) // CHUNK_SIZE)
+        assert(store.snapshot() is first)
+        store.update('28.0000000000C7', 'prop3', -1.0, 'Decreased', 3000.0, 'Numeric')
+        second = store.snapshot()
+        assert(second.chunks[:-1] == first.chunks[:-1])
+        assert(all([a is b for a, b in zip(second.chunks[:-1], first.chunks[:-1])]))
+        assert(second.chunks[-1] is not first.chunks[-1])
+        changed = second.changedSince(first)
+        assert([(row['sensorId'], row['name'], row['value']) for row in changed] == [('28.0000000000C7', 'prop3', -1.0)])
+        assert(second.changedSince(second) == [])
+
+    def testUnchangedReadsKeepChunks(self):
+        store = self.buildStore(200)
+        first = store.snapshot()
+        for sensor in range(200):
+            store.update('28.%012X' % sensor, 'prop0', float(sensor), 'Changed', 5000.0, 'Numeric')
+        second = store.snapshot()
+        assert(second is not first and second.version == first.version)
+        assert(all([a is b for a, b in zip(second.chunks, first.chunks)]))
+        assert(second.get('28.000000000005', 'prop0')['timestamp'] == 5000.0)
+        assert(second.column('timestamp')[4] == 5000.0 and second.column('timestamp')[5] == 1001.0)
+        assert(first.get('28.000000000005', 'prop0')['timestamp'] == 1005.0)
+        assert(second.changedSince(first) == [])
+        store.update('28.000000000005', 'prop0', 5.0, 'Stable', 6000.0, 'Numeric')
+        third = store.snapshot()
+        assert(third.version > second.version)
+        assert([row['status'] for row in third.changedSince(second)] == ['Stable'])
+        assert(sum([a is not b for a, b in zip(third.chunks, second.chunks)]) == 1)
+
+    def testSensorStatus(self):
+        store = self.buildStore(1, 1)
+        first = store.snapshot()
+        store.setSensor('28.000000000000', 'Available')
+        assert(store.snapshot() is first)
+        store.setSensor('28.000000000000', 'Missing')
+        assert(store.snapshot().sensors() == {'28.000000000000': 'Missing'})
+        assert(first.sensors() == {'28.000000000000': 'Available'})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+__author__ = 'sdavidson'
+
+import unittest
+from owstats import OneWireNeoLatencyHistogram, OneWireNeoStats
+
+
+class OwstatsTests(unittest.TestCase):
+    def testHistogram_summary(self):
+        histogram = OneWireNeoLatencyHistogram()
+        for elapsed in (0.001, 0.002, 0.004, 0.5):
+            histogram.record(elapsed)
+        assert(histogram.count == 4)
+        assert(histogram.min == 0.001)
+        assert(histogram.max == 0.5)
+        assert(abs(histogram.mean - 0.12675) < 1e-12)
+        assert(sum(histogram.buckets) == 4)
+
+    def testHistogram_percentileIsBucketBound(self):
+        histogram = OneWireNeoLatencyHistogram(bounds=(0.01, 0.1, 1.0))
+        for i in range(99):
+            histogram.record(0.005)
+        histogram.record(0.7)
+        assert(histogram.percentile(50) == 0.01)
+        assert(histogram.percentile(99) == 0.01)
+        assert(histogram.percentile(100) == 0.7)
+        histogram.record(5.0)
+        assert(histogram.percentile(100) == 5.0)
+        assert(OneWireNeoLatencyHistogram().percentile(50) is None)
+
+    def testStats_hooksAndCounters(self):
+        stats = OneWireNeoStats()
+        seen = list()
+        stats.addHook(lambda name, value, detail: seen.append((name, value, detail)))
+        stats.record('sensor', 0.25, '10.147A0A020800')
+        stats.record('sensor', 0.05, '28.000000000001')
+        stats.increment('reads', 3)
+        assert(stats.histogram('sensor').count == 2)
+        assert(stats.sensorHistogram('10.147A0A020800').mean == 0.25)
+        assert(stats.slowestSensors(1) == ['10.147A0A020800'])
+        assert(stats.counter('reads') == 3)
+        assert(seen[-1] == ('reads', 3, None))
+        assert(len(seen) == 3)
+        stats.reset()
+        assert(stats.counter('reads') == 0)
+        assert(stats.histogram('sensor').count == 0)
+
+if __name__ == '__main__':
+    unittest.main()